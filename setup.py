@@ -38,6 +38,11 @@ setup(name='slipsomat',
           'python-dateutil',
           'questionary',
       ],
+      extras_require={
+          'http': ['requests'],
+          'xslt': ['lxml'],
+          'images': ['Pillow'],
+      },
       entry_points={
           'console_scripts': ['slipsomat=slipsomat.shell:main']
       },
@@ -0,0 +1,268 @@
+# encoding=utf8
+"""
+Measure the throughput of slipsomat's commands against a simulated Alma.
+
+A FakeAlma server is started locally, and `pull`, `push`, `defaults` and `test` are
+run against it in a temporary workspace, with a real browser. For each command, the
+number of letters per minute and the number of WebDriver calls and HTTP requests per
+letter are reported. Results can be saved, and compared with earlier results to catch
+performance regressions:
+
+    python -m slipsomat.benchmark --latency 0.05 --save baseline.json
+    python -m slipsomat.benchmark --latency 0.05 --compare baseline.json
+
+With `--profiles default,headless,fast` the commands are run once per browser profile,
+so the profiles can be compared on the same simulated Alma. FakeAlma serves no images,
+fonts or analytics scripts, so only the headless and page load settings can make a
+difference here.
+
+Run `python -m slipsomat.benchmark --help` for all the options.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from textwrap import dedent
+
+from .config import read_config
+from .fake_alma import FakeAlma, FakeAlmaServer
+
+TEST_XML = u"""<?xml version="1.0" encoding="utf-8"?>
+<notification_data>
+  <languages><string>en</string></languages>
+  <preferred_language>en</preferred_language>
+  <letter_name>Bench Letter {:04d}</letter_name>
+</notification_data>
+"""
+
+
+def write_config(filename, base_url, browser, profile, http):
+    with open(filename, 'w') as fp:
+        fp.write(dedent(u"""\
+            [login]
+            username=bench
+            password=bench
+            institution=BENCH
+            instance=bench
+            auth_type=basic
+            base_url={}
+
+            [selenium]
+            browser={}
+            profile={}
+
+            [session]
+            cache=false
+
+            [http]
+            enabled={}
+            """.format(base_url, browser, profile, 'true' if http else 'false')))
+
+
+class Benchmark(object):
+    """Runs slipsomat commands against a FakeAlma server, recording a result per command."""
+
+    def __init__(self, server, worker):
+        self.server = server
+        self.worker = worker
+        self.results = []
+
+    def measure(self, command, fn, count=None):
+        """
+        Run `fn()` and record the time taken, and the WebDriver calls and HTTP requests made.
+
+        Params:
+            command: Name of the command
+            fn: Function running the command
+            count: Number of letters processed. By default, the number of letters fetched.
+        """
+        tracer = self.worker.tracer
+        tracer.reset()
+        requests = self.server.alma.requests
+        t0 = time.time()
+        with self.worker.step('benchmark: ' + command):
+            fn()
+        seconds = time.time() - t0
+
+        with tracer.lock:
+            spans = list(tracer.spans)
+        if count is None:
+            count = len([span for span in spans if span.name == 'letter'])
+        # Spans at depth 0 include the calls made in the nested spans, and each thread has its own
+        roundtrips = sum(span.roundtrips for span in spans if span.depth == 0)
+        result = {
+            'command': command,
+            'letters': count,
+            'seconds': round(seconds, 3),
+            'letters_per_min': round(count * 60. / seconds, 2) if seconds > 0 else 0.0,
+            'webdriver_calls_per_letter': round(roundtrips / float(count), 2) if count else 0.0,
+            'http_requests_per_letter': round((self.server.alma.requests - requests) / float(count), 2)
+            if count else 0.0,
+        }
+        self.results.append(result)
+        return result
+
+
+def print_results(results):
+    print('\n{:10} {:10} {:>8} {:>9} {:>12} {:>18} {:>18}'.format(
+        'Profile', 'Command', 'Letters', 'Seconds', 'Letters/min', 'WebDriver/letter', 'Requests/letter'))
+    for r in sorted(results, key=lambda r: r['command']):
+        print('{:10} {:10} {:8d} {:9.1f} {:12.1f} {:18.1f} {:18.1f}'.format(
+            r['profile'], r['command'], r['letters'], r['seconds'], r['letters_per_min'],
+            r['webdriver_calls_per_letter'], r['http_requests_per_letter']))
+
+
+def compare(results, baseline, tolerance):
+    """Print the commands that got slower than the baseline. Returns True if there were none."""
+    ok = True
+    previous = {(r.get('profile'), r['command']): r for r in baseline['results']}
+    for r in results:
+        old = previous.get((r['profile'], r['command']))
+        if old is None:
+            continue
+        if r['letters_per_min'] < old['letters_per_min'] * (1 - tolerance):
+            print('REGRESSION: {} ({}) went from {:.1f} to {:.1f} letters/min'.format(
+                r['command'], r['profile'], old['letters_per_min'], r['letters_per_min']))
+            ok = False
+        if r['webdriver_calls_per_letter'] > old['webdriver_calls_per_letter'] * (1 + tolerance):
+            print('REGRESSION: {} ({}) went from {:.1f} to {:.1f} WebDriver calls per letter'.format(
+                r['command'], r['profile'], old['webdriver_calls_per_letter'], r['webdriver_calls_per_letter']))
+            ok = False
+    if ok:
+        print('No regressions compared with the baseline')
+    return ok
+
+
+def run_profile(args, profile):
+    """Run the commands with one browser profile, in a fresh workspace. Returns the results."""
+    # Imported here, so --help works without Selenium
+    from .worker import Worker
+    from .configuration_table import ConfigurationTable
+    from .test_page import TestPage
+    from .slipsomat import StatusFile, LocalStorage, pull, pull_defaults, push, test
+
+    alma = FakeAlma(args.letters, args.components, args.latency, args.jitter, args.letter_size)
+    server = FakeAlmaServer(alma, port=args.port).start()
+    print('Simulated Alma with {} letters and {} components at {}, browser profile: {}'.format(
+        args.letters, args.components, server.base_url, profile))
+
+    workspace = tempfile.mkdtemp(prefix='slipsomat-benchmark-')
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    worker = None
+    try:
+        write_config('slipsomat.cfg', server.base_url, args.browser, profile, args.http)
+        worker = Worker(None, config=read_config('slipsomat.cfg'))
+        worker.connect()
+
+        benchmark = Benchmark(server, worker)
+        status_file = StatusFile()
+        local_storage = LocalStorage(status_file)
+        letters_configuration = ConfigurationTable('Letters Configuration', worker)
+        components_configuration = ConfigurationTable('Components Configuration', worker)
+
+        if 'pull' in args.commands:
+            benchmark.measure('pull', lambda: pull(letters_configuration, components_configuration, local_storage,
+                                                   status_file, args.jobs, include_all=True))
+
+        if 'push' in args.commands:
+            files = sorted(f for f in status_file.letters if status_file.checksum(f) is not None)[:args.push]
+            for filename in files:
+                with open(filename, 'ab') as fp:
+                    fp.write(b'\n<!-- modified by the benchmark -->\n')
+            benchmark.measure('push', lambda: push(letters_configuration, components_configuration, local_storage,
+                                                   status_file, files, args.jobs), len(files))
+
+        if 'defaults' in args.commands:
+            benchmark.measure('defaults', lambda: pull_defaults(letters_configuration, components_configuration,
+                                                                local_storage, status_file, args.jobs,
+                                                                force=True))
+
+        if 'test' in args.commands:
+            os.makedirs('test-data')
+            files = []
+            for i in range(args.tests):
+                filename = os.path.abspath(os.path.join('test-data', 'bench{:03d}.xml'.format(i)))
+                with open(filename, 'wb') as fp:
+                    fp.write(TEST_XML.format(i).encode('utf-8'))
+                files.append(filename)
+            testpage = TestPage(worker)
+            benchmark.measure('test', lambda: test(testpage, files, ['en'], args.jobs), len(files))
+
+        status_file.save()
+    finally:
+        if worker is not None and worker.driver is not None:
+            worker.close()
+        os.chdir(cwd)
+        server.shutdown()
+        if args.keep:
+            print('Workspace kept in {}'.format(workspace))
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    for result in benchmark.results:
+        result['profile'] = profile
+    return benchmark.results
+
+
+def run(args):
+    results = []
+    for profile in args.profiles:
+        results += run_profile(args, profile)
+
+    print_results(results)
+    data = {
+        'settings': {k: v for k, v in vars(args).items() if k not in ('save', 'compare', 'tolerance', 'keep')},
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(data, fp, indent=2, sort_keys=True)
+        print('Results saved to {}'.format(args.save))
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        if baseline.get('settings') != data['settings']:
+            print('Warning: the baseline was made with other settings: {}'.format(baseline.get('settings')))
+        return compare(results, baseline, args.tolerance)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark slipsomat against a simulated Alma')
+    parser.add_argument('--commands', default='pull,push,defaults,test',
+                        help='comma-separated commands to run (default: pull,push,defaults,test)')
+    parser.add_argument('--letters', type=int, default=100, help='number of letters (default: 100)')
+    parser.add_argument('--components', type=int, default=20, help='number of components (default: 20)')
+    parser.add_argument('--letter-size', type=int, default=2000, help='size of each letter in bytes')
+    parser.add_argument('--push', type=int, default=20, help='number of letters to push (default: 20)')
+    parser.add_argument('--tests', type=int, default=10, help='number of test files (default: 10)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='max random seconds added to every request')
+    parser.add_argument('--browser', default='firefox', help='firefox or chrome (default: firefox)')
+    parser.add_argument('--profiles', default='headless',
+                        help='comma-separated browser profiles to compare, e.g. default,headless,fast '
+                             '(default: headless)')
+    parser.add_argument('--http', action='store_true', help='enable the HTTP transport')
+    parser.add_argument('--jobs', type=int, default=1, help='number of browser sessions (default: 1)')
+    parser.add_argument('--port', type=int, default=0, help='port of the simulated Alma (default: any free port)')
+    parser.add_argument('--save', help='save the results as JSON to this file')
+    parser.add_argument('--compare', help='compare with results saved earlier, and exit with status 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown relative to the baseline (default: 0.2)')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary workspace')
+    args = parser.parse_args()
+    args.commands = args.commands.split(',')
+    args.profiles = args.profiles.split(',')
+
+    if not run(args):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# encoding=utf8
+from __future__ import print_function
+
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+
+try:
+    import queue  # Python 3
+    from html.parser import HTMLParser
+except ImportError:
+    import Queue as queue  # Python 2
+    from HTMLParser import HTMLParser
+
+from colorama import Fore, Style
+
+from .diff import unified_diff
+
+# Things that change from run to run without the letter having changed
+VOLATILE_PATTERNS = [
+    (re.compile(r'\b\d{1,4}[./-]\d{1,2}[./-]\d{1,4}\b'), '[date]'),
+    (re.compile(r'\b\d{1,2}:\d{2}(:\d{2})?\b'), '[time]'),
+    (re.compile(r'\b\d{6,}\b'), '[id]'),
+    (re.compile(r'jsessionid=[\w.-]+', re.IGNORECASE), 'jsessionid=[id]'),
+]
+
+# Max number of differing bits for two screenshots to be considered equal
+IMAGE_HASH_THRESHOLD = 4
+
+
+def normalize_html(html):
+    """Strip volatile dates, times and IDs and collapse whitespace, so outputs can be compared."""
+    for pattern, replacement in VOLATILE_PATTERNS:
+        html = pattern.sub(replacement, html)
+    return re.sub(r'\s+', ' ', html).strip()
+
+
+class StructureParser(HTMLParser):
+    """Turn an HTML document into one line per tag and text node, for structural diffs."""
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.lines = []
+        self.depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = ' '.join('%s="%s"' % (k, v) for k, v in sorted(attrs, key=lambda x: x[0]) if k != 'style')
+        self.lines.append('  ' * self.depth + '<%s%s>' % (tag, ' ' + attrs if attrs else ''))
+        if tag not in ('br', 'img', 'meta', 'link', 'hr', 'input'):
+            self.depth += 1
+
+    def handle_endtag(self, tag):
+        if tag not in ('br', 'img', 'meta', 'link', 'hr', 'input'):
+            self.depth = max(0, self.depth - 1)
+
+    def handle_data(self, data):
+        data = data.strip()
+        if data:
+            self.lines.append('  ' * self.depth + data)
+
+
+def html_structure(html):
+    parser = StructureParser()
+    parser.feed(html)
+    parser.close()
+    return parser.lines
+
+
+def image_hash(png):
+    """
+    Return a perceptual (average) hash of a screenshot as a hex string.
+
+    Falls back to a SHA-1 of the PNG data if Pillow is not installed.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return 'sha1:' + hashlib.sha1(png).hexdigest()
+
+    img = Image.open(io.BytesIO(png)).convert('L').resize((16, 16))
+    pixels = list(img.getdata())
+    mean = sum(pixels) / len(pixels)
+    bits = ''.join('1' if p > mean else '0' for p in pixels)
+    return '%064x' % int(bits, 2)
+
+
+def images_equal(hash1, hash2):
+    if hash1 is None or hash2 is None:
+        return hash1 == hash2
+    if hash1.startswith('sha1:') or hash2.startswith('sha1:'):
+        return hash1 == hash2
+    return bin(int(hash1, 16) ^ int(hash2, 16)).count('1') <= IMAGE_HASH_THRESHOLD
+
+
+class CaptureWriter(object):
+    """
+    Write test outputs in a background thread and compare them with a golden set.
+
+    The golden set lives in `golden_dir`: an `index.json` with the hashes of each output,
+    and the normalized HTML of each output for structural diffs. Outputs without a golden
+    version are added to the set, and with `update_golden` all outputs replace the
+    golden versions.
+    """
+
+    def __init__(self, golden_dir, update_golden=False):
+        self.golden_dir = golden_dir
+        self.update_golden = update_golden
+        self.index_file = os.path.join(golden_dir, 'index.json')
+        self.index = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file) as fp:
+                self.index = json.load(fp)
+
+        self.changed = []  # list of (name, list of diff lines, image changed)
+        self.added = []
+        self.count = 0
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, html_path, png_path, html, png):
+        """Hand over the page source and screenshot of a test run for writing and comparison."""
+        self.queue.put((html_path, png_path, html, png))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self.process(*item)
+            except Exception as e:
+                print('%sFailed to save %s: %s%s' % (Fore.RED, item[0], e, Fore.RESET))
+
+    def process(self, html_path, png_path, html, png):
+        with open(html_path, 'w+b') as html_file:
+            html_file.write(html.encode('utf-8'))
+        if png is not None:
+            with open(png_path, 'wb') as png_file:
+                png_file.write(png)
+        print('Saved output: %s' % html_path)
+
+        name = os.path.basename(html_path)
+        normalized = normalize_html(html)
+        entry = {
+            'html': hashlib.sha1(normalized.encode('utf-8')).hexdigest(),
+            'image': image_hash(png) if png is not None else None,
+        }
+        self.count += 1
+
+        golden = self.index.get(name)
+        golden_html_path = os.path.join(self.golden_dir, name)
+        if golden is not None and not self.update_golden:
+            html_changed = golden['html'] != entry['html']
+            image_changed = not images_equal(golden['image'], entry['image'])
+            if html_changed or image_changed:
+                diff = []
+                if html_changed and os.path.exists(golden_html_path):
+                    with open(golden_html_path, 'rb') as fp:
+                        old = html_structure(fp.read().decode('utf-8'))
+                    diff = list(unified_diff(old, html_structure(normalized), fromfile='golden', tofile='current'))
+                self.changed.append((name, diff, image_changed))
+            return
+
+        if golden is None:
+            self.added.append(name)
+        self.index[name] = entry
+        if not os.path.exists(self.golden_dir):
+            os.makedirs(self.golden_dir)
+        with open(golden_html_path, 'wb') as fp:
+            fp.write(normalized.encode('utf-8'))
+
+    def close(self):
+        """Wait for all outputs to be written, save the golden index and print a report."""
+        self.queue.put(None)
+        self.thread.join()
+
+        if len(self.added) != 0 or self.update_golden:
+            with open(self.index_file, 'w') as fp:
+                json.dump(self.index, fp, sort_keys=True, indent=2)
+
+        for name, diff, image_changed in sorted(self.changed):
+            print('%sChanged: %s%s%s' % (Fore.YELLOW, name, ' (screenshot differs)' if image_changed else '',
+                                         Style.RESET_ALL))
+            for line in diff[:40]:
+                print('    ' + line)
+            if len(diff) > 40:
+                print('    ... {} more lines'.format(len(diff) - 40))
+
+        if self.update_golden:
+            print('Updated the golden versions of {} output(s)'.format(self.count))
+        else:
+            print('{} of {} output(s) changed, {} new'.format(len(self.changed), self.count, len(self.added)))
@@ -0,0 +1,104 @@
+# encoding=utf8
+from __future__ import print_function
+
+import json
+import os
+
+
+class Checkpoint(object):
+    """
+    The letters a long-running command has finished, so it can be resumed after a crash.
+
+    Each finished letter is appended to `.slipsomat_checkpoint.jsonl` as
+    `[command, table, unique name]`. The results themselves are already in status.json
+    (or its journal), so a resumed run can simply skip these letters. The lines of the
+    command are removed when it completes; the file is shared with the other commands,
+    so `pull` and `defaults` can each be resumed.
+    """
+
+    filename = '.slipsomat_checkpoint.jsonl'
+
+    def __init__(self, command, resume=False):
+        """
+        Params:
+            command: Name of the command, like "pull" or "defaults"
+            resume: Keep the letters finished by an earlier, interrupted run of the
+                command. Otherwise any earlier checkpoint of the command is discarded.
+        """
+        self.command = command
+        self.completed = set()  # (table, unique name)
+        self.fp = None
+        if resume:
+            self.load()
+        else:
+            self.clear()
+
+    @classmethod
+    def read_entries(cls):
+        """Return the `[command, table, unique name]` entries of all commands."""
+        entries = []
+        if not os.path.exists(cls.filename):
+            return entries
+        with open(cls.filename, 'rb') as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # A partially written line, from a crash
+                    continue
+                entries.append(entry)
+        return entries
+
+    def load(self):
+        for command, table, name in self.read_entries():
+            if command == self.command:
+                self.completed.add((table, name))
+
+    def count(self, table):
+        return len([key for key in self.completed if key[0] == table])
+
+    def is_done(self, table, name):
+        return (table, name) in self.completed
+
+    def add(self, table, name):
+        """Record that a letter has been finished."""
+        self.completed.add((table, name))
+        if self.fp is None:
+            self.fp = open(self.filename, 'ab')
+            if self.fp.tell() != 0 and not self.ends_with_newline():
+                self.fp.write(b'\n')  # don't continue a partially written line
+        self.fp.write(json.dumps([self.command, table, name]).encode('utf-8') + b'\n')
+        self.fp.flush()
+
+    def ends_with_newline(self):
+        with open(self.filename, 'rb') as fp:
+            fp.seek(-1, os.SEEK_END)
+            return fp.read(1) == b'\n'
+
+    def clear(self):
+        """Forget the letters finished by this command, keeping those of the other commands."""
+        self.close()
+        self.completed = set()
+        entries = self.read_entries()
+        others = [entry for entry in entries if entry[0] != self.command]
+        if len(others) == len(entries):
+            return
+        if len(others) == 0:
+            os.remove(self.filename)
+            return
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as fp:
+            for entry in others:
+                fp.write(json.dumps(entry).encode('utf-8') + b'\n')
+        os.replace(tmp_filename, self.filename)
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    @classmethod
+    def pending(cls):
+        """Return the name of the command that left a checkpoint, if any."""
+        entries = cls.read_entries()
+        return entries[0][0] if len(entries) != 0 else None
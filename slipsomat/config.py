@@ -0,0 +1,76 @@
+# encoding=utf8
+from __future__ import print_function
+from textwrap import dedent
+from io import StringIO
+import getpass
+
+try:
+    from configparser import ConfigParser  # Python 3
+except Exception:
+    from ConfigParser import ConfigParser  # Python 2
+
+
+def read_config(cfg_file):
+    """
+    Read slipsomat.cfg on top of the default settings.
+
+    This module does not import Selenium, so the config can be read before the browser is started.
+    """
+    config = ConfigParser()
+    defaults = StringIO(dedent(
+        u"""[login]
+        domain=
+        base_url=
+
+        [selenium]
+        browser=firefox
+        profile=default
+        default_timeout=20
+        record=
+        replay=
+        replay_speed=1
+
+        [session]
+        cache=true
+        max_age_hours=8
+
+        [navigation]
+        url_cache=true
+        cached_url_timeout=10
+
+        [http]
+        enabled=false
+        pool_size=4
+
+        [window]
+        width=1300
+        height=800
+
+        [screenshot]
+        width=1000
+
+        [test]
+        max_in_flight=4
+
+        [retry]
+        timeout=3
+        stale=3
+        session=2
+        logged_out=2
+        backoff=2
+        max_backoff=60
+        """
+    ))
+    config.read_file(defaults)
+    config.read(cfg_file)
+
+    if config.get('login', 'username') == '':
+        raise RuntimeError('No username configured in slipsomat.cfg')
+
+    return config
+
+
+def ask_password(config):
+    """Ask for the password if it's not in the config file."""
+    if config.get('login', 'password') == '':
+        config.set('login', 'password', getpass.getpass())
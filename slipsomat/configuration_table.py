@@ -5,15 +5,46 @@ import os.path
 import re
 import time
 import sys
+from datetime import datetime
+
+from dateutil import parser as dateparser
 
-from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.remote.errorhandler import NoSuchElementException
+from selenium.common.exceptions import NoSuchWindowException, TimeoutException
 from colorama import Fore, Back, Style
 
 from .slipsomat import LetterContent
 from .letter_info import LetterInfo
+from .retry import RetryFailed
+from .tracing import format_duration
+from .pool import OpenTimes, WorkerPool
+from .http_transport import FormChanged
+
+
+# Links from a table row to the page of its letter. Other links in the table, like href="#"
+# or "javascript:" ones, resolve to the table page itself and are not letter URLs.
+LETTER_LINK = re.compile(r'^https?://[^?#]*/[^/?#]*letter[^/?#]*\?[^#]+$', re.IGNORECASE)
+
+
+def parse_alma_date(value):
+    """Parse a date from the "Updated on" column, returning None if it cannot be parsed."""
+    if not value:
+        return None
+    try:
+        return dateparser.parse(value, dayfirst=True).date()
+    except (ValueError, OverflowError):
+        return None
+
+
+def print_throughput(count, seconds):
+    """Print how many letters were checked per minute, for comparing browser profiles and job counts."""
+    if count == 0 or seconds <= 0:
+        return
+    sys.stdout.write('Checked {} letters in {:.0f} s ({:.1f} letters/min)\n'.format(
+        count, seconds, count * 60. / seconds))
+
 
 class ConfigurationTable(object):
     """Interface to "Customize letters" in Alma."""
@@ -24,18 +55,36 @@ class ConfigurationTable(object):
         self.worker = worker
         self.pagename = pagename 
         
+        self.current_page = None  # page of the table currently shown, if known
+        self.failed = []  # unique names of the letters that could not be fetched
+        self.started = None  # start time of the current batch of letters, for the ETA
+
         self.css_selector_table_row      = '.jsRecordContainer'
         self.css_selector_button_template = '#cnew_letter_labeltemplate_span'
 
+        # Pagination: the "Results per page" select, and the links to the next, previous and to a numbered page
+        self.css_selector_page_size = 'select[id$="recordsPerPage_hiddenSelect"]'
+        self.css_selector_next_page = '.paginationNext:not(.disabled) a'
+        self.css_selector_previous_page = '.paginationPrevious:not(.disabled) a'
+        self.xpath_page_link = '//*[contains(@class, "pagination")]//a[normalize-space(text())="%d"]'
+
+        self.css_selector_col_channel = None
+
         if pagename == 'Components Configuration':
             self.css_selector_table           = '#filesAndLabels'
+            self.css_selector_view_default    = '#ROW_ACTION_filesAndLabels_%d_c\\.ui\\.table\\.btn\\.view_default a'
             self.css_selector_col_name        = '#SELENIUM_ID_filesAndLabels_ROW_%d_COL_letterXslcfgFilefilename'
-            self.css_selector_col_customized  = '#SELENIUM_ID_filesAndLabels_ROW_%d_COL_customized' 
+            self.css_selector_col_customized  = '#SELENIUM_ID_filesAndLabels_ROW_%d_COL_customized'
+            self.css_selector_col_updated_by  = '#SELENIUM_ID_filesAndLabels_ROW_%d_COL_updatedBy'
+            self.css_selector_col_updated_on  = '#SELENIUM_ID_filesAndLabels_ROW_%d_COL_updateDate'
         elif pagename == 'Letters Configuration':
-            self.css_selector_table           = '#lettersOnPage' 
+            self.css_selector_table           = '#lettersOnPage'
+            self.css_selector_view_default    = '#ROW_ACTION_lettersOnPage_%d_c\\.ui\\.table\\.btn\\.view_default a'
             self.css_selector_col_name        = '#SELENIUM_ID_lettersOnPage_ROW_%d_COL_letterNameForUI'
             self.css_selector_col_channel     = '#SELENIUM_ID_lettersOnPage_ROW_%d_COL_channel'
-            self.css_selector_col_customized  = '#SELENIUM_ID_lettersOnPage_ROW_%d_COL_customized' 
+            self.css_selector_col_customized  = '#SELENIUM_ID_lettersOnPage_ROW_%d_COL_customized'
+            self.css_selector_col_updated_by  = '#SELENIUM_ID_lettersOnPage_ROW_%d_COL_updatedBy'
+            self.css_selector_col_updated_on  = '#SELENIUM_ID_lettersOnPage_ROW_%d_COL_updateDate'
 
         else:
             raise Exception()
@@ -43,8 +92,8 @@ class ConfigurationTable(object):
         
 
     def open(self):
-        """Go from Alma start page to general configuration and open subpage"""
-        
+        """Open the table, by its cached URL or else from the Alma start page through the menus."""
+        self.show_table()
         try:
             # at page that lists letters?
             self.worker.first(By.CSS_SELECTOR, self.css_selector_table)
@@ -52,32 +101,142 @@ class ConfigurationTable(object):
             # not at page that lists letters?
             self.print_letter_status('Opening table...', '')
 
-            # Goto Alma start page
-            self.worker.goto_alma_start_page()
-            
-            # Open Alma configuration
-            self.worker.wait_for_and_click(By.CSS_SELECTOR, '#ALMA_MENU_TOP_NAV_configuration')
-            
-            # Open configuration "General" 
-            self.worker.click(By.XPATH, '//*[@href="#CONF_MENU6"]')
-            
-            # Open Subpage
-            self.worker.click(By.XPATH, '//*[text() = "' + self.pagename + '"]')
-            self.worker.wait_for(By.CSS_SELECTOR, self.css_selector_table)
+            def walk():
+                # Goto Alma start page
+                self.worker.goto_alma_start_page()
+
+                # Open Alma configuration
+                self.worker.wait_for_and_click(By.CSS_SELECTOR, '#ALMA_MENU_TOP_NAV_configuration')
+
+                # Open configuration "General"
+                self.worker.click(By.XPATH, '//*[@href="#CONF_MENU6"]')
+
+                # Open Subpage
+                self.worker.click(By.XPATH, '//*[text() = "' + self.pagename + '"]')
+
+            with self.worker.step('open table'):
+                cached = self.worker.navigate(self.pagename, By.CSS_SELECTOR, self.css_selector_table, walk)
+            # The cached URL could be of another page than the first one
+            self.current_page = self.shown_page() if cached else 1
 
         return self
 
-    def modified(self, name):
-#         idx = self.names.index(name)
-#         return self.update_dates[idx]
-        return ""
+    def show_table(self):
+        """Switch back from the letter tab to the window with the table."""
+        worker = self.worker
+        if worker.letter_window is not None and worker.in_letter_window:
+            worker.in_letter_window = False
+            try:
+                worker.driver.switch_to.window(worker.table_window)
+            except NoSuchWindowException:
+                # The browser was restarted, and we're in its only window
+                worker.letter_window = None
+
+    def wait_for_table_reload(self, old_row):
+        """Wait for the table to be rendered again after paging or changing the page size."""
+        if old_row is not None:
+            self.worker.wait_for_staleness(old_row)
+        self.worker.wait_for(By.CSS_SELECTOR, self.css_selector_table)
+
+    def first_row(self):
+        rows = self.worker.all(By.CSS_SELECTOR, self.css_selector_table_row)
+        return rows[0] if len(rows) != 0 else None
+
+    def set_max_page_size(self):
+        """Show as many rows per page as Alma allows, so that large tables need few pages."""
+        selects = self.worker.all(By.CSS_SELECTOR, self.css_selector_page_size)
+        if len(selects) == 0:
+            return
+        sizes = [opt.get_attribute('value') for opt in selects[0].find_elements(By.TAG_NAME, 'option')]
+        sizes = [int(size) for size in sizes if size.isdigit()]
+        if len(sizes) == 0 or selects[0].get_attribute('value') == str(max(sizes)):
+            return
+
+        with self.worker.step('set page size'):
+            old_row = self.first_row()
+            self.worker.execute_script(
+                'arguments[0].value = arguments[1];'
+                'arguments[0].dispatchEvent(new Event("change", {bubbles: true}));',
+                selects[0], str(max(sizes)))
+            self.wait_for_table_reload(old_row)
+        self.current_page = 1
+
+    # The number of the page shown, which the pagination has as plain text instead of a link
+    shown_page_script = """
+        var pagination = document.querySelector('[class*="pagination"]');
+        if (!pagination) return null;
+        var walker = document.createTreeWalker(pagination, NodeFilter.SHOW_TEXT);
+        while (walker.nextNode()) {
+            var text = walker.currentNode.nodeValue.trim();
+            if (/^[0-9]+$/.test(text) && !walker.currentNode.parentNode.closest('a')) {
+                return parseInt(text, 10);
+            }
+        }
+        return null;
+    """
+
+    def shown_page(self):
+        """Return the number of the page shown, as read from the pagination, or None if it can't be told."""
+        return self.worker.execute_script(self.shown_page_script)
+
+    def goto_page(self, page):
+        """
+        Show the given page of the table.
 
-    def set_modified(self, name, date):
+        The page link is clicked directly if the pagination shows it. Paginations only
+        show the pages around the current one, so a distant page is reached by stepping
+        with the next or previous link until its link shows up.
+        """
+        if self.current_page is None:
+            self.current_page = self.shown_page()
+        while self.current_page != page:
+            links = self.worker.all(By.XPATH, self.xpath_page_link % page)
+            target = page
+            if len(links) == 0:
+                if self.current_page is None:
+                    if page == 1:
+                        # No link to the first page, so there is no pagination at all, or the first page is shown
+                        self.current_page = 1
+                        return
+                    raise RuntimeError('Could not find page {} of {}'.format(page, self.pagename))
+                if page > self.current_page:
+                    links = self.worker.all(By.CSS_SELECTOR, self.css_selector_next_page)
+                    target = self.current_page + 1
+                else:
+                    links = self.worker.all(By.CSS_SELECTOR, self.css_selector_previous_page)
+                    target = self.current_page - 1
+                if len(links) == 0:
+                    raise RuntimeError('Could not find page {} of {}'.format(page, self.pagename))
+
+            with self.worker.step('goto page'):
+                old_row = self.first_row()
+                self.worker.execute_script('arguments[0].click();', links[0])
+                self.wait_for_table_reload(old_row)
+            self.current_page = target
+
+    def modified(self, letter_info):
+        return letter_info.updated_on or ''
+
+    def set_modified(self, letter_info, date):
         # Allow updating a single date instead of having to re-read the whole table
-        idx = self.letter_infos.index(name)
-        self.update_dates[idx] = date
+        letter_info.updated_on = date
+        self.update_dates[self.letter_infos.index(letter_info)] = date
+
+    def eta(self, progress):
+        """Return the throughput and estimated time left of the current batch, given progress like ' 3/40'."""
+        try:
+            done, total = [int(x) for x in progress.split('/')]
+        except ValueError:
+            return ''
+        elapsed = time.time() - self.started
+        if done == 0 or done >= total or elapsed <= 0:
+            return ''
+        rate = done / elapsed
+        return '  [{:.1f}/min, ETA {}]'.format(rate * 60, format_duration((total - done) / rate))
 
     def print_letter_status(self, string, msg, progress=None, newline=False):
+        if progress is not None and newline and self.started is not None:
+            msg += self.eta(progress)
         sys.stdout.write('\r{:100}'.format(''))  # We clear the line first
         if progress is not None:
             sys.stdout.write('\r[{}] {:60} {}'.format(
@@ -95,43 +254,70 @@ class ConfigurationTable(object):
         sys.stdout.flush()
 
 
-    def read(self):
-        self.letter_infos = []
-
-        # number of letters on page 
-        elems_rows = self.worker.all(By.CSS_SELECTOR, self.css_selector_table_row)
-        
-        # first try: only read the first page
-        for i in range(0, len(elems_rows)):
-            name = self.worker.all(By.CSS_SELECTOR, self.css_selector_col_name % i)[0].text
-            
-            if self.pagename == 'Letters Configuration':
-                channel = self.worker.all(By.CSS_SELECTOR, self.css_selector_col_channel % i)[0].text
-            else:
-                channel = None
-
-            letter_info = LetterInfo(name, i, channel)
-                
-            self.letter_infos.append(letter_info)
-            print(str(i+1) + ': ' + letter_info.unique_name)
-        
+    # Reads all the rows of the table in a single WebDriver round trip.
+    # arguments[0] is the row selector, arguments[1] maps column names to cell selectors
+    # (with %d for the row number).
+    read_table_script = """
+        var rows = document.querySelectorAll(arguments[0]);
+        var columns = arguments[1];
+        var result = [];
+        for (var i = 0; i < rows.length; i++) {
+            var row = {index: i};
+            for (var column in columns) {
+                var cell = columns[column] ? document.querySelector(columns[column].replace('%d', i)) : null;
+                row[column] = cell ? (cell.innerText || cell.textContent).trim() : null;
+            }
+            var link = columns.name ? document.querySelector(columns.name.replace('%d', i) + ' a') : null;
+            row.link = link ? link.href : null;
+            result.push(row);
+        }
+        return result;
+    """
+
+    def read_page(self, page):
+        with self.worker.step('read table'):
+            rows = self.worker.execute_script(self.read_table_script, self.css_selector_table_row, {
+                'name': self.css_selector_col_name,
+                'channel': self.css_selector_col_channel,
+                'customized': self.css_selector_col_customized,
+                'updated_by': self.css_selector_col_updated_by,
+                'updated_on': self.css_selector_col_updated_on,
+            })
+        return LetterInfo.from_rows(rows, page)
 
-#         # Read the modification date column
-#         elems = self.worker.all(By.CSS_SELECTOR,
-#                                 '#lettersOnPage tr > td:nth-child(%d) > span' % updatedate_col)
-#         self.update_dates = [el.text for el in elems]
-# 
-#         # return [{x[0]:2 {'modified': x[1], 'index': n}} for n, x in enumerate(zip(names, update_dates))]
-
-
-    def is_customized(self, name):
-        index = self.letter_infos.index(name)
-        css_selector_element = self.css_selector_col_customized % index
-        
-        self.worker.wait_for(By.CSS_SELECTOR, css_selector_element)
-        updated_by = self.worker.first(By.CSS_SELECTOR, css_selector_element)
-
-        return updated_by.text not in ('-', 'Network')
+    def read(self):
+        """Read the rows of all pages of the table into LetterInfo objects."""
+        self.set_max_page_size()
+        self.goto_page(1)
+
+        page = 1
+        self.letter_infos = self.read_page(page)
+        while True:
+            links = self.worker.all(By.CSS_SELECTOR, self.css_selector_next_page)
+            if len(links) == 0:
+                break
+            page += 1
+            with self.worker.step('goto page'):
+                old_row = self.first_row()
+                self.worker.execute_script('arguments[0].click();', links[0])
+                self.wait_for_table_reload(old_row)
+            self.current_page = page
+            self.letter_infos += self.read_page(page)
+
+        self.update_dates = [letter_info.updated_on for letter_info in self.letter_infos]
+
+        transport = self.worker.transport
+        if transport is not None:
+            for letter_info in self.letter_infos:
+                if letter_info.link and LETTER_LINK.match(letter_info.link) and not transport.can_fetch(letter_info):
+                    transport.learn(letter_info, letter_info.link)
+
+        sys.stdout.write(''.join(
+            '{}: {}\n'.format(i + 1, letter_info.unique_name) for i, letter_info in enumerate(self.letter_infos)
+        ))
+
+    def is_customized(self, letter_info):
+        return letter_info.customized not in ('-', 'Network')
 
     def assert_page_title(self, page_title):
         """ Assert that we are at the right letter """
@@ -147,50 +333,176 @@ class ConfigurationTable(object):
 
 
     def open_letter(self, letter_info):
+        """
+        Open a letter and return its contents as a LetterContent object.
+
+        If the HTTP transport is enabled and knows the letter, the letter is fetched
+        directly, without rendering it in the browser.
+        """
+        transport = self.worker.transport
+        if transport is not None and transport.can_fetch(letter_info):
+            try:
+                with self.worker.step('open_letter: http fetch'):
+                    return transport.fetch(letter_info)
+            except FormChanged as e:
+                print('\nHTTP fetch of {} failed ({}), using the browser'.format(letter_info.unique_name, e))
+                transport.forget(letter_info)
+
+        return self.open_letter_in_browser(letter_info)
+
+    def open_letter_in_browser(self, letter_info):
+        """Open a letter in the browser and return its contents as a LetterContent object."""
+        content = self.open_letter_in_tab(letter_info)
+        if content is not None:
+            return content
+
         self.open()
 
-        # Open a letter and return its contents as a LetterContent object.
-        index = self.letter_infos.index(letter_info)
-        self.worker.wait.until(EC.presence_of_element_located(
-            (By.CSS_SELECTOR, self.css_selector_col_name % index))
-        )
+        css_selector_link = (self.css_selector_col_name + ' a') % letter_info.index
 
-        time.sleep(0.2)
+        with self.worker.step('open_letter: wait for table row'):
+            self.goto_page(letter_info.page)
+            link = self.worker.wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, css_selector_link)))
+            if link.text != letter_info.name:
+                # Alma has shown another page than we thought, e.g. after going back from a letter
+                self.current_page = None
+                self.goto_page(letter_info.page)
+                self.worker.wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, css_selector_link)))
 
         # Open Letter configuration
-        self.worker.scroll_into_view_and_click((self.css_selector_col_name + ' a') % index, By.CSS_SELECTOR)
-        time.sleep(0.2)
-
-        # We should now be at the letter edit form. Assert that page title is correct
-        self.assert_page_title(letter_info.name)
+        with self.worker.step('open_letter: open letter page'):
+            self.worker.scroll_into_view_and_click(css_selector_link, By.CSS_SELECTOR)
 
+            # We should now be at the letter edit form. Assert that page title is correct
+            self.assert_page_title(letter_info.name)
 
         # goto tab "Template"
         # Click tab "Template" menu item
-        css_selector_link = self.css_selector_button_template + ' a'
-        self.worker.wait_for(By.CSS_SELECTOR, css_selector_link)
-        self.worker.scroll_into_view_and_click(css_selector_link, By.CSS_SELECTOR)
+        with self.worker.step('open_letter: open template tab'):
+            css_selector_link = self.css_selector_button_template + ' a'
+            self.worker.wait_for(By.CSS_SELECTOR, css_selector_link)
+            self.worker.scroll_into_view_and_click(css_selector_link, By.CSS_SELECTOR)
 
-        css_selector_template_textarea = 'pageBeanfileContent'
-        self.worker.wait_for(By.ID, css_selector_template_textarea)
-        txtarea = self.worker.first(By.ID, css_selector_template_textarea)
-        return LetterContent(txtarea.text)
+        with self.worker.step('open_letter: read template'):
+            txtarea = self.worker.wait_for_content(By.ID, 'pageBeanfileContent')
+            content = LetterContent(txtarea.text)
 
+        if self.worker.urls is not None:
+            # Next time, the template page can be opened directly
+            self.worker.urls.set('letter:' + letter_info.unique_name, self.worker.driver.current_url)
+
+        if self.worker.transport is not None:
+            # Remember where the template page is, so the next fetch can skip the browser
+            self.worker.transport.learn(letter_info, self.worker.driver.current_url)
+
+        return content
+
+    def open_letter_in_tab(self, letter_info):
+        """
+        Open the template page of a letter by its cached URL, in a tab next to the table.
+
+        The tab belongs to the worker, so it is reused for the next letters by all the tables
+        using the worker, and `close_letter` just switches back to the table, so the table
+        doesn't have to be loaded again. It is closed with the worker. Returns the contents of
+        the letter, or None if its URL is not cached or did not work.
+        """
+        name = 'letter:' + letter_info.unique_name
+        url = self.worker.urls.get(name) if self.worker.urls is not None else None
+        if url is None:
+            return None
+
+        worker = self.worker
+        driver = worker.driver
+        with worker.step('open_letter: open cached url'):
+            if worker.letter_window is not None and not worker.in_letter_window:
+                try:
+                    driver.switch_to.window(worker.letter_window)
+                    worker.in_letter_window = True
+                except NoSuchWindowException:
+                    # The tab is gone, e.g. after a browser restart
+                    worker.letter_window = None
+            if worker.letter_window is None:
+                worker.table_window = driver.current_window_handle
+                driver.switch_to.new_window('tab')
+                worker.letter_window = driver.current_window_handle
+                worker.in_letter_window = True
+
+            self.worker.get(url)
+            try:
+                txtarea = self.worker.wait_for_content(By.ID, 'pageBeanfileContent',
+                                                       timeout=self.worker.cached_url_timeout)
+                self.assert_page_title(letter_info.name)
+            except (TimeoutException, AssertionError):
+                if self.worker.is_logged_out():
+                    raise  # not the URL's fault, leave it to the retry policy
+                self.worker.urls.forget(name)
+                self.show_table()
+                return None
+            return LetterContent(txtarea.text)
+
+    def open_default_letter(self, letter_info):
+        """
+        Open the default version of a customized letter and return its contents as a LetterContent object.
+
+        The template page shows the customized version, so the default is opened through
+        the "View Default" action of the letter's row in the table.
+        """
+        self.show_table()
+        self.open()
+
+        with self.worker.step('open_default_letter: wait for table row'):
+            self.goto_page(letter_info.page)
+            css_selector_link = (self.css_selector_col_name + ' a') % letter_info.index
+            link = self.worker.wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, css_selector_link)))
+            if link.text != letter_info.name:
+                # Alma has shown another page than we thought, e.g. after going back from a letter
+                self.current_page = None
+                self.goto_page(letter_info.page)
+
+        with self.worker.step('open_default_letter: view default'):
+            # The action is in the row's actions menu, which doesn't have to be opened to click it
+            action = self.worker.wait.until(EC.presence_of_element_located(
+                (By.CSS_SELECTOR, self.css_selector_view_default % letter_info.index)))
+            self.worker.execute_script('arguments[0].click();', action)
+            self.assert_page_title(letter_info.name)
+
+        with self.worker.step('open_default_letter: read template'):
+            txtarea = self.worker.wait_for_content(By.ID, 'pageBeanfileContent')
+            return LetterContent(txtarea.text)
 
     def close_letter(self):
+        if self.worker.in_letter_window:
+            # The table is still loaded in its own window
+            self.show_table()
+            return
+
         # If we are at specific letter, press the "Cancel" button.
         elems = self.worker.all(By.CSS_SELECTOR, '.pageTitle')
         if len(elems) != 0:
-            btn_selector = '#PAGE_BUTTONS_cbuttonnavigationcancel'
-            self.worker.scroll_into_view_and_click(btn_selector, By.CSS_SELECTOR)
+            with self.worker.step('close_letter'):
+                btn_selector = '#PAGE_BUTTONS_cbuttonnavigationcancel'
+                self.worker.scroll_into_view_and_click(btn_selector, By.CSS_SELECTOR)
+
+                # Wait for the letter page to go away and the table to be rendered again
+                self.worker.wait_for_staleness(elems[0])
+                self.worker.wait_for(By.CSS_SELECTOR, self.css_selector_table)
 
-        
     def put_contents(self, letter_info, content):
         """
         Save letter contents to Alma.
 
         This method assumes the letter has already been opened.
         """
+        transport = self.worker.transport
+        if transport is not None and transport.can_save(letter_info):
+            try:
+                with self.worker.step('put_contents: http save'):
+                    return transport.save(letter_info, content)
+            except FormChanged as e:
+                print('\nHTTP save of {} failed ({}), using the browser'.format(letter_info.unique_name, e))
+                transport.forget(letter_info)
+                self.open_letter_in_browser(letter_info)
+
         self.assert_page_title(letter_info.name)
 
         # The "normal" way to set the value of a textarea with Selenium is to use
@@ -201,7 +513,7 @@ class ConfigurationTable(object):
 
         value = content.text.replace('"', '\\"').replace('\n', '\\n')
         script = 'document.getElementById("%s").value = "%s";' % (txtarea_id, value)
-        self.worker.driver.execute_script(script)
+        self.worker.execute_script(script)
 
         # Submit the form
         try:
@@ -212,70 +524,323 @@ class ConfigurationTable(object):
 
         # Wait for the table view.
         # Longer timeout per https://github.com/scriptotek/alma-slipsomat/issues/33
-        self.worker.wait_for(By.CSS_SELECTOR, '.typeD table', timeout=40)
+        with self.worker.step('put_contents: wait for save'):
+            self.worker.wait_for(By.CSS_SELECTOR, '.typeD table', timeout=40)
 
         return True
 
+    def push_letter(self, letter_info, content, expected_sha1, overwrite=None):
+        """
+        Upload a letter, unless its remote version has changed.
+
+        The remote version is expected to have the checksum `expected_sha1`. If it has
+        another one, `overwrite(remote_content)` is called with the letter still open to
+        decide whether to upload anyway. Without `overwrite`, the letter is skipped.
+
+        Failures are retried according to the worker's retry policy. A retry that finds
+        the letter already saved (e.g. after the browser crashed while waiting for the
+        save) counts as pushed.
+
+        Returns a `(pushed, remote_content)` tuple. Raises RetryFailed if the letter could
+        not be pushed.
+        """
+        def push():
+            remote_content = self.open_letter(letter_info)
+            if remote_content.sha1 == content.sha1:
+                self.close_letter()
+                return True, remote_content
+            if remote_content.sha1 != expected_sha1 and (overwrite is None or not overwrite(remote_content)):
+                self.close_letter()
+                return False, remote_content
+            self.put_contents(letter_info, content)
+            return True, remote_content
+
+        with self.worker.step('push letter', letter=letter_info.unique_name):
+            return self.worker.retry(push, reset=self.open)
+
+    def child(self, worker):
+        """Return a copy of this table bound to another worker, sharing the rows already read."""
+        table = ConfigurationTable(self.pagename, worker)
+        table.letter_infos = self.letter_infos
+        table.update_dates = self.update_dates
+        return table
+
+    def fetch_letter(self, letter_info, progress=None, default=False):
+        """
+        Open a letter, read its contents and go back to the table.
+
+        With `default`, the default version of the letter is read. That is the template
+        itself for letters that are not customized.
+
+        Failures are retried according to the worker's retry policy, starting over from
+        the table. Raises RetryFailed if the letter could not be fetched.
+        """
+        def fetch():
+            if default and self.is_customized(letter_info):
+                content = self.open_default_letter(letter_info)
+            else:
+                content = self.open_letter(letter_info)
+            self.close_letter()
+            return content
+
+        def on_retry(category, attempt, delay):
+            if progress is not None:
+                self.print_letter_status(letter_info.unique_name, '{}, retrying in {:.0f} s...'.format(
+                    category.replace('_', ' '), delay), progress)
+
+        with self.worker.step('letter', letter=letter_info.unique_name):
+            return self.worker.retry(fetch, reset=self.open, on_retry=on_retry)
 
-    def pull(self, local_storage, status_file):
+    def fetch_letters(self, letter_infos, jobs=1, default=False):
+        """
+        Fetch the contents of the given letters, yielding `(letter_info, content)` pairs.
+
+        With `default`, the default versions of the letters are fetched.
+
+        With `jobs` > 1, the letters are distributed over a pool of worker sessions,
+        starting with the letters that have been slowest to open on earlier runs.
+        The pairs are then yielded in the order they complete.
+
+        Letters that still fail after the retries allowed by the retry policy are
+        skipped, and listed in `self.failed`.
+        """
+        self.failed = []
+        if jobs <= 1:
+            for idx, letter_info in enumerate(letter_infos):
+                progress = '%3d/%3d' % ((idx + 1), len(letter_infos))
+                self.print_letter_status(letter_info.unique_name, 'checking...', progress)
+                try:
+                    content = self.fetch_letter(letter_info, progress, default)
+                except RetryFailed as e:
+                    self.skip_failed(letter_info, e, progress)
+                    continue
+                yield letter_info, content
+            return
+
+        open_times = OpenTimes()
+        pool = WorkerPool(self.worker, jobs)
+        sys.stdout.write('Starting {} additional browser session(s)...\n'.format(jobs - 1))
+        pool.connect()
+        try:
+            def make_task(worker):
+                table = self.child(worker).open()
+
+                def task(letter_info):
+                    try:
+                        return table.fetch_letter(letter_info, default=default)
+                    except RetryFailed as e:
+                        # Hand it back to the main thread, the worker itself may still be fine
+                        return e
+                return task
+
+            for letter_info, content, seconds in pool.imap(make_task, letter_infos,
+                                                           key=lambda x: x.unique_name,
+                                                           cost=lambda x: open_times.estimate(x.unique_name)):
+                if isinstance(content, RetryFailed):
+                    self.skip_failed(letter_info, content)
+                    continue
+                open_times.set(letter_info.unique_name, seconds)
+                yield letter_info, content
+        finally:
+            open_times.save()
+            pool.close()
+
+    def skip_failed(self, letter_info, error, progress=None):
+        self.failed.append(letter_info.unique_name)
+        self.print_letter_status(letter_info.unique_name, Fore.RED + 'failed, skipping ({})'.format(
+            error) + Style.RESET_ALL, progress, True)
+
+    def plan(self, status_file, include_all=False):
+        """
+        Decide which letters need to be opened, by comparing the table with status.json.
+
+        Alma only shows the date a letter was last updated, not the time, so letters
+        updated today are always opened.
+
+        Returns a list of `(letter_info, reason)` pairs, with `reason` set to None
+        for letters that do not need to be opened.
+        """
+        today = datetime.now().date()
+        plan = []
+        for letter_info in self.letter_infos:
+            filename = letter_info.get_filename()
+            wanted = include_all or self.is_customized(letter_info)
+            if letter_info.unique_name.endswith('-WEBHOOK'):
+                # --- Bug, skip webhook letters
+                reason = None
+            elif status_file.checksum(filename) is None:
+                reason = 'new' if wanted else None
+            elif status_file.remote(filename) != letter_info.remote_metadata():
+                # Also when the customization was removed, so the local copy is not left behind
+                reason = 'changed in Alma'
+            elif not wanted:
+                reason = None
+            elif parse_alma_date(letter_info.updated_on) in (None, today):
+                reason = 'updated today'
+            else:
+                reason = None
+            plan.append((letter_info, reason))
+        return plan
+
+    def print_plan(self, plan):
+        fetch = [(letter_info, reason) for letter_info, reason in plan if reason is not None]
+        for letter_info, reason in fetch:
+            self.print_letter_status(letter_info.unique_name, reason, None, True)
+        sys.stdout.write('{}: {} of {} letters would be fetched\n'.format(self.pagename, len(fetch), len(plan)))
+
+    def store_letter(self, local_storage, status_file, letter_info, content, progress):
+        """
+        Store a fetched letter if it has changed.
 
+        Returns 'new' or 'changed' if the letter was stored, otherwise None.
+        """
+        old_sha1 = status_file.checksum(letter_info.get_filename())
+        if content.sha1 == old_sha1:
+            status_file.set_remote(letter_info.get_filename(), letter_info.remote_metadata())
+            self.print_letter_status(letter_info.unique_name, 'no changes', progress, True)
+            return None
+
+        if not local_storage.store(letter_info, content, self.modified(letter_info)):
+            self.print_letter_status(
+                letter_info.unique_name, Fore.RED + 'skipped due to conflict' + Style.RESET_ALL, progress, True)
+            return None
+        status_file.set_remote(letter_info.get_filename(), letter_info.remote_metadata())
+
+        if old_sha1 is None:
+            self.print_letter_status(letter_info.unique_name, Fore.GREEN + 'fetched new letter @ {}'.format(
+                content.sha1[0:7]) + Style.RESET_ALL, progress, True)
+            return 'new'
+
+        self.print_letter_status(letter_info.unique_name, Fore.GREEN + 'updated from {} to {}'.format(
+            old_sha1[0:7], content.sha1[0:7]) + Style.RESET_ALL, progress, True)
+        return 'changed'
+
+    def pull_defaults(self, local_storage, status_file, jobs=1, only_new=False, checkpoint=None):
+        """
+        Pull in the default versions of the letters in this table.
+
+        The template of a letter that is not customized is its default version. For
+        customized letters, the default version is opened with "View Default".
+
+        Params:
+            local_storage: LocalStorage object
+            status_file: StatusFile object
+            jobs: Number of browser sessions to open the letters in
+            only_new: Only check the letters that have no default version in status.json yet
+            checkpoint: Checkpoint object. Letters it has as finished are skipped,
+                and the letters finished by this run are added to it.
+
+        Returns a `(count_new, count_changed, failed)` tuple, where `failed` lists the
+        unique names of the letters that could not be fetched.
+        """
         count_new = 0
         count_changed = 0
 
         self.open()
         self.read()
 
-        for idx, letter_info in enumerate(self.letter_infos):
-            progress = '%3d/%3d' % ((idx + 1), len(self.letter_infos))
-    
-            self.print_letter_status(letter_info.unique_name, '', progress)
-    
-            self.print_letter_status(letter_info.unique_name, 'checking...', progress)
+        letter_infos = [letter_info for letter_info in self.letter_infos
+                        if not letter_info.unique_name.endswith('-WEBHOOK')]
+        total = len(letter_infos)
+        if only_new:
+            letter_infos = [letter_info for letter_info in letter_infos
+                            if status_file.default_checksum(letter_info.get_filename()) is None]
+        sys.stdout.write('{} of {} default letters need to be checked\n'.format(len(letter_infos), total))
+        if checkpoint is not None:
+            remaining = [letter_info for letter_info in letter_infos
+                         if not checkpoint.is_done(self.pagename, letter_info.unique_name)]
+            if len(remaining) != len(letter_infos):
+                sys.stdout.write('Resuming: {} letter(s) were finished by the last run\n'.format(
+                    len(letter_infos) - len(remaining)))
+            letter_infos = remaining
+
+        self.started = time.time()
+        for idx, (letter_info, content) in enumerate(self.fetch_letters(letter_infos, jobs, default=True)):
+            progress = '%3d/%3d' % ((idx + 1), len(letter_infos))
+            filename = letter_info.get_filename()
+            old_sha1 = status_file.default_checksum(filename)
 
-            # --- Bug, skip webhook letters 
-            if letter_info.unique_name.endswith('-WEBHOOK'):
-                self.print_letter_status(
-                    letter_info.unique_name, Fore.RED + 'skipped WEBHOOK' + Style.RESET_ALL, progress, True)
-                continue
-            # --- End Bug, Letter             
-            
-            
-            
-            try:
-                content = self.open_letter(letter_info)
-                # if self.is_customized(letter_info):
-                #     content = self.open_letter(letter_info)
-                # else:
-                #     content = self.open_default_letter(letter_info)
-            except TimeoutException:
-                # Retry once
-                self.print_letter_status(letter_info.unique_name, 'retrying...', progress)
-#                 if self.is_customized(letter_info):
-                content = self.open_letter(letter_info)
-#                 else:
-#                     content = self.open_default_letter(letter_info)
-    
-            self.close_letter()
-    
-            old_sha1 = status_file.checksum(letter_info.get_filename())
             if content.sha1 == old_sha1:
                 self.print_letter_status(letter_info.unique_name, 'no changes', progress, True)
-                continue
-    
-            if not local_storage.store(letter_info, content, self.modified(letter_info)):
-                self.print_letter_status(
-                    letter_info.unique_name, Fore.RED + 'skipped due to conflict' + Style.RESET_ALL, progress, True)
-                continue
-    
-            if old_sha1 is None:
-                count_new += 1
-                self.print_letter_status(letter_info.unique_name, Fore.GREEN + 'fetched new letter @ {}'.format(
-                    content.sha1[0:7]) + Style.RESET_ALL, progress, True)
             else:
+                local_storage.store_default(filename, content)
+                if old_sha1 is None:
+                    count_new += 1
+                    self.print_letter_status(letter_info.unique_name, Fore.GREEN + 'fetched new letter @ {}'.format(
+                        content.sha1[0:7]) + Style.RESET_ALL, progress, True)
+                else:
+                    count_changed += 1
+                    self.print_letter_status(letter_info.unique_name, Fore.GREEN + 'updated from {} to {}'.format(
+                        old_sha1[0:7], content.sha1[0:7]) + Style.RESET_ALL, progress, True)
+            if checkpoint is not None:
+                checkpoint.add(self.pagename, letter_info.unique_name)
+
+        self.started = None
+
+        # Checkpoint
+        status_file.save()
+        return count_new, count_changed, self.failed
+
+    def pull(self, local_storage, status_file, jobs=1, dry_run=False, include_all=False, checkpoint=None):
+        """
+        Pull in letters from this table that have been modified in Alma.
+
+        Only letters whose customized/updated by/updated on columns differ from the
+        values stored in status.json, or that were updated today, are opened.
+
+        Params:
+            local_storage: LocalStorage object
+            status_file: StatusFile object
+            jobs: Number of browser sessions to open the letters in
+            dry_run: Only print which letters would be fetched
+            include_all: Also fetch letters that are not customized
+            checkpoint: Checkpoint object. Letters it has as finished are skipped,
+                and the letters finished by this run are added to it.
+
+        Returns the unique names of the letters that could not be fetched.
+        """
+        count_new = 0
+        count_changed = 0
+        t0 = time.time()
+
+        self.open()
+        self.read()
+
+        plan = self.plan(status_file, include_all)
+        if dry_run:
+            self.print_plan(plan)
+            return []
+
+        letter_infos = [letter_info for letter_info, reason in plan if reason is not None]
+        sys.stdout.write('{} of {} letters need to be checked\n'.format(len(letter_infos), len(plan)))
+        if checkpoint is not None:
+            remaining = [letter_info for letter_info in letter_infos
+                         if not checkpoint.is_done(self.pagename, letter_info.unique_name)]
+            if len(remaining) != len(letter_infos):
+                sys.stdout.write('Resuming: {} letter(s) were finished by the last run\n'.format(
+                    len(letter_infos) - len(remaining)))
+            letter_infos = remaining
+
+        self.started = time.time()
+        for idx, (letter_info, content) in enumerate(self.fetch_letters(letter_infos, jobs)):
+            progress = '%3d/%3d' % ((idx + 1), len(letter_infos))
+
+            result = self.store_letter(local_storage, status_file, letter_info, content, progress)
+            if result == 'new':
+                count_new += 1
+            elif result == 'changed':
                 count_changed += 1
-                self.print_letter_status(letter_info.unique_name, Fore.GREEN + 'updated from {} to {}'.format(
-                    old_sha1[0:7], content.sha1[0:7]) + Style.RESET_ALL, progress, True)
-    
+            if checkpoint is not None:
+                checkpoint.add(self.pagename, letter_info.unique_name)
+
+        self.started = None
+
+        # Checkpoint
+        status_file.save()
+
         sys.stdout.write(Fore.GREEN + 'Fetched {} new, {} changed letters\n'.format(
             count_new, count_changed) + Style.RESET_ALL)
-    
+        if len(self.failed) != 0:
+            sys.stdout.write(Fore.RED + 'Failed to fetch {} letter(s)\n'.format(len(self.failed)) + Style.RESET_ALL)
+        print_throughput(len(letter_infos), time.time() - t0)
+        return self.failed
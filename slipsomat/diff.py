@@ -0,0 +1,337 @@
+# encoding=utf8
+"""
+Line and XML diffs of letters.
+
+The line diff is a patience diff: lines that occur exactly once in both versions are
+matched first (in the longest increasing order), which keeps reformatted blocks of an
+XSL template apart instead of matching their closing tags and blank lines, and the
+gaps between them are diffed with Myers' O(ND) algorithm. Gaps that differ in more
+than MAX_EDITS lines are simply shown as replaced, which bounds the time a diff takes.
+
+The XML diff compares canonical forms of the letters, with attributes sorted and
+whitespace-only text removed, so only changes that matter to the XSLT are shown.
+Whitespace is kept in `xsl:text` and under `xml:space="preserve"`, where it ends up
+in the output.
+"""
+from __future__ import print_function
+
+import os
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+# Gaps between the unique lines are given up on, and shown as replaced, after this many edits
+MAX_EDITS = 1000
+
+XSL_TEXT = '{http://www.w3.org/1999/XSL/Transform}text'
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'  # of xml:space, bound to the xml prefix without a declaration
+XML_SPACE = '{%s}space' % XML_NAMESPACE
+
+
+def longest_increasing(pairs):
+    """Return the longest subsequence of `(i, j)` pairs, sorted by i, in which j is increasing too."""
+    tails = []  # tails[n] is the index in pairs of the smallest j ending an increasing run of length n+1
+    tail_js = []
+    previous = [None] * len(pairs)
+    for index, (i, j) in enumerate(pairs):
+        n = bisect_left(tail_js, j)
+        previous[index] = tails[n - 1] if n > 0 else None
+        if n == len(tails):
+            tails.append(index)
+            tail_js.append(j)
+        else:
+            tails[n] = index
+            tail_js[n] = j
+    result = []
+    index = tails[-1] if len(tails) != 0 else None
+    while index is not None:
+        result.append(pairs[index])
+        index = previous[index]
+    result.reverse()
+    return result
+
+
+def myers(a, b, a0, a1, b0, b1, max_edits=MAX_EDITS):
+    """
+    Return the matching line pairs of `a[a0:a1]` and `b[b0:b1]` by Myers' algorithm.
+
+    Returns None if more than `max_edits` lines have to be added or removed.
+    """
+    n = a1 - a0
+    m = b1 - b0
+    v = {1: 0}
+    trace = []
+    for d in range(min(n + m, max_edits) + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return backtrack(trace, n, m, a0, b0)
+    return None
+
+
+def backtrack(trace, x, y, a0, b0):
+    matches = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((a0 + x, b0 + y))
+        x, y = prev_x, prev_y
+    matches.reverse()
+    return matches
+
+
+def patience(a, b, a0, a1, b0, b1, matches):
+    """Append the matching line pairs of `a[a0:a1]` and `b[b0:b1]` to `matches`."""
+    while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+        matches.append((a0, b0))
+        a0 += 1
+        b0 += 1
+    suffix = []
+    while a0 < a1 and b0 < b1 and a[a1 - 1] == b[b1 - 1]:
+        a1 -= 1
+        b1 -= 1
+        suffix.append((a1, b1))
+    if a0 == a1 or b0 == b1:
+        matches.extend(reversed(suffix))
+        return
+
+    counts = {}
+    for i in range(a0, a1):
+        counts.setdefault(a[i], [0, 0, None])
+        counts[a[i]][0] += 1
+        counts[a[i]][2] = i
+    for j in range(b0, b1):
+        if b[j] in counts:
+            counts[b[j]][1] += 1
+    unique = {}
+    for j in range(b0, b1):
+        count = counts.get(b[j])
+        if count is not None and count[0] == 1 and count[1] == 1:
+            unique[count[2]] = j
+    anchors = longest_increasing(sorted(unique.items()))
+
+    if len(anchors) == 0:
+        matches.extend(myers(a, b, a0, a1, b0, b1) or [])
+    else:
+        i, j = a0, b0
+        for anchor_i, anchor_j in anchors:
+            patience(a, b, i, anchor_i, j, anchor_j, matches)
+            matches.append((anchor_i, anchor_j))
+            i, j = anchor_i + 1, anchor_j + 1
+        patience(a, b, i, a1, j, b1, matches)
+    matches.extend(reversed(suffix))
+
+
+def get_opcodes(a, b):
+    """Return the differences between two lists of lines as `difflib.SequenceMatcher.get_opcodes()` does."""
+    matches = []
+    patience(a, b, 0, len(a), 0, len(b), matches)
+    matches.append((len(a), len(b)))  # sentinel
+
+    opcodes = []
+    i = j = 0
+    for match_i, match_j in matches:
+        if i < match_i or j < match_j:
+            tag = 'replace' if i < match_i and j < match_j else 'delete' if i < match_i else 'insert'
+            opcodes.append((tag, i, match_i, j, match_j))
+        if match_i < len(a):
+            if len(opcodes) != 0 and opcodes[-1][0] == 'equal':
+                opcodes[-1] = ('equal', opcodes[-1][1], match_i + 1, opcodes[-1][3], match_j + 1)
+            else:
+                opcodes.append(('equal', match_i, match_i + 1, match_j, match_j + 1))
+        i, j = match_i + 1, match_j + 1
+    return opcodes
+
+
+def grouped_opcodes(opcodes, n=3):
+    """Split opcodes into hunks with up to `n` lines of context, as `difflib` does."""
+    if len(opcodes) == 0:
+        return
+    codes = list(opcodes)
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > 2 * n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if len(group) != 0 and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def format_range(start, stop):
+    length = stop - start
+    if length == 1:
+        return '{}'.format(start + 1)
+    if length == 0:
+        return '{},0'.format(start)
+    return '{},{}'.format(start + 1, length)
+
+
+def unified_diff(a, b, fromfile='', tofile='', n=3):
+    """Yield the lines of a unified diff of two lists of lines, like `difflib.unified_diff`."""
+    started = False
+    for group in grouped_opcodes(get_opcodes(a, b), n):
+        if not started:
+            started = True
+            yield '--- {}'.format(fromfile)
+            yield '+++ {}'.format(tofile)
+        yield '@@ -{} +{} @@'.format(format_range(group[0][1], group[-1][2]),
+                                     format_range(group[0][3], group[-1][4]))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a[i1:i2]:
+                    yield ' ' + line
+                continue
+            for line in a[i1:i2]:
+                yield '-' + line
+            for line in b[j1:j2]:
+                yield '+' + line
+
+
+def canonical_lines(text):
+    """
+    Return a canonical form of an XML document as a list of lines.
+
+    Each element is put on a line of its own, indented by its depth, with its attributes
+    sorted by name. Whitespace-only text is left out and other text is stripped, so
+    reindenting a letter or reordering attributes does not show up as a change. Text in
+    `xsl:text` and under `xml:space="preserve"` is kept as it is, quoted and on a single
+    line. Namespaced names keep the prefixes used in the document. Raises ValueError if
+    the text is not well-formed XML.
+    """
+    prefixes = {}
+
+    class Builder(ElementTree.TreeBuilder):
+        def __init__(self):
+            try:
+                ElementTree.TreeBuilder.__init__(self, insert_comments=True)
+            except TypeError:
+                ElementTree.TreeBuilder.__init__(self)  # Python < 3.8, comments are left out
+
+        def start_ns(self, prefix, uri):
+            prefixes.setdefault(uri, prefix)
+
+    parser = ElementTree.XMLParser(target=Builder())
+    try:
+        parser.feed(text)
+        root = parser.close()
+    except ElementTree.ParseError as e:
+        raise ValueError(str(e))
+
+    def name(qname):
+        if qname.startswith('{'):
+            uri, local = qname[1:].split('}', 1)
+            if uri == XML_NAMESPACE:
+                return 'xml:' + local
+            if uri not in prefixes:
+                return qname
+            return '{}:{}'.format(prefixes[uri], local) if prefixes[uri] else local
+        return qname
+
+    lines = []
+    for uri, prefix in sorted(prefixes.items(), key=lambda x: x[1]):
+        lines.append('xmlns{}="{}"'.format(':' + prefix if prefix else '', uri))
+
+    def is_empty(text, preserve):
+        return text is None or text == '' or (not preserve and text.strip() == '')
+
+    def text_line(text, depth, preserve):
+        if is_empty(text, preserve):
+            return
+        if preserve:
+            text = '"{}"'.format(text.replace('\\', '\\\\').replace('"', '\\"')
+                                 .replace('\n', '\\n').replace('\t', '\\t'))
+        else:
+            text = ' '.join(text.split())
+        lines.append('  ' * depth + text)
+
+    def walk(elem, depth, preserve):
+        indent = '  ' * depth
+        if not isinstance(elem.tag, str):
+            lines.append(indent + '<!-- {} -->'.format(' '.join((elem.text or '').split())))
+        else:
+            inner = {'preserve': True, 'default': False}.get(elem.get(XML_SPACE), preserve)
+            attrs = ''.join(' {}="{}"'.format(name(k), v) for k, v in sorted(elem.attrib.items(),
+                                                                             key=lambda x: name(x[0])))
+            if len(elem) == 0 and is_empty(elem.text, inner or elem.tag == XSL_TEXT):
+                lines.append('{}<{}{}/>'.format(indent, name(elem.tag), attrs))
+            else:
+                lines.append('{}<{}{}>'.format(indent, name(elem.tag), attrs))
+                text_line(elem.text, depth + 1, inner or elem.tag == XSL_TEXT)
+                for child in elem:
+                    walk(child, depth + 1, inner)
+                lines.append('{}</{}>'.format(indent, name(elem.tag)))
+        text_line(elem.tail, depth, preserve)
+
+    walk(root, 0, False)
+    return lines
+
+
+def diff_texts(old, new, fromfile='', tofile='', xml=False, n=3):
+    """
+    Return a unified diff of two letters as a list of lines.
+
+    With `xml`, the canonical forms of the letters are compared instead of their lines,
+    unless one of them is not well-formed.
+    """
+    if xml:
+        try:
+            return list(unified_diff(canonical_lines(old), canonical_lines(new), fromfile, tofile, n))
+        except ValueError:
+            pass
+    return list(unified_diff(old.strip().splitlines(), new.strip().splitlines(), fromfile, tofile, n))
+
+
+def diff_file(args):
+    """Diff two files given as `(old filename, new filename, xml)`. This function is run in worker processes."""
+    old_filename, new_filename, xml = args
+    texts = []
+    for filename in (old_filename, new_filename):
+        with open(filename, 'rb') as fp:
+            texts.append(fp.read().decode('utf-8'))
+    return diff_texts(texts[0], texts[1], old_filename, os.path.normpath(new_filename), xml)
+
+
+def diff_files(pairs, xml=False, jobs=None):
+    """
+    Diff many pairs of files in parallel.
+
+    Returns a list with the diff lines of each pair, in the same order as `pairs`.
+
+    Params:
+        pairs: list of `(old filename, new filename)` tuples
+        xml: compare the canonical XML forms of the files
+        jobs: number of processes to use. Defaults to the number of CPUs.
+    """
+    args = [(old, new, xml) for old, new in pairs]
+    if len(args) <= 1:
+        return [diff_file(arg) for arg in args]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(diff_file, args, chunksize=8))
@@ -0,0 +1,425 @@
+# encoding=utf8
+"""
+A small local stand-in for the parts of Alma that slipsomat uses.
+
+It serves the login form, the configuration menu, the "Letters Configuration" and
+"Components Configuration" tables (with paging), the letter edit pages and the
+"Notification Template" test page, using the same element ids and classes as Alma,
+so slipsomat can be run against it by setting `base_url` in the [login] section.
+Every request can be slowed down by a fixed latency plus random jitter, to simulate
+a remote Alma instance.
+
+Run `python -m slipsomat.fake_alma --help` to start it on its own.
+"""
+from __future__ import print_function
+
+import argparse
+import random
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from email.parser import BytesParser
+
+try:
+    from html import escape  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from cgi import escape  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+# The two configuration tables, with the ids Alma uses for the table and its columns
+TABLES = {
+    'letters': {
+        'title': 'Letters Configuration',
+        'table_id': 'lettersOnPage',
+        'columns': ['letterNameForUI', 'channel', 'customized', 'updatedBy', 'updateDate'],
+    },
+    'components': {
+        'title': 'Components Configuration',
+        'table_id': 'filesAndLabels',
+        'columns': ['letterXslcfgFilefilename', 'customized', 'updatedBy', 'updateDate'],
+    },
+}
+
+LANGUAGES = [('en', 'English'), ('no', 'Norwegian'), ('de', 'German')]
+
+PAGE = u"""<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Alma</title></head>
+<body>
+<div class="logoAlma">Alma (simulated)</div>
+{body}
+</body>
+</html>
+"""
+
+HOME = u"""
+<span id="almaVersion">{version}</span>
+<a id="ALMA_MENU_TOP_NAV_configuration" href="javascript:void(0)"
+   onclick="document.getElementById('confMenu').style.display = 'block'">Configuration</a>
+<div id="confMenu" style="display: none">
+  <a href="#CONF_MENU6"
+     onclick="document.getElementById('CONF_MENU6').style.display = 'block'; return false;">General</a>
+  <div id="CONF_MENU6" style="display: none">
+    <a href="/mng/action/table?t=letters&amp;page=1">Letters Configuration</a>
+    <a href="/mng/action/table?t=components&amp;page=1">Components Configuration</a>
+    <a href="/mng/action/template">Notification Template</a>
+  </div>
+</div>
+"""
+
+LOGIN = u"""
+<form method="post" action="/mng/login">
+  <input type="text" id="username" name="username">
+  <input type="password" id="password" name="password">
+  <button type="submit">Log in</button>
+</form>
+"""
+
+LETTER_TEMPLATE = u"""<?xml version="1.0" encoding="utf-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <!-- {padding} -->
+  <xsl:template match="/">
+    <p>{name}</p>
+  </xsl:template>
+</xsl:stylesheet>
+"""
+
+
+class FakeAlma(object):
+    """
+    The state of the simulated Alma: the letters, and the sessions of the logged-in users.
+
+    Params:
+        letters: Number of rows in "Letters Configuration"
+        components: Number of rows in "Components Configuration"
+        latency: Seconds added to every request
+        jitter: Up to this many seconds are added at random to every request
+        letter_size: Approximate size of each letter in bytes
+        version: Alma release shown on the start page
+    """
+
+    page_sizes = [20, 50, 100]
+    page_window = 2  # page links shown on each side of the current page
+
+    def __init__(self, letters=100, components=20, latency=0.0, jitter=0.0, letter_size=2000,
+                 version='2026.10'):
+        self.latency = latency
+        self.version = version
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.sessions = {}  # session cookie -> dict with the uploaded test file
+        self.requests = 0
+
+        self.rows = {'letters': [], 'components': []}
+        for i in range(letters):
+            self.rows['letters'].append(self.make_row(
+                'Bench Letter {:04d}'.format(i), ['EMAIL', 'SMS', 'PRINT'][i % 3], i, letter_size))
+        for i in range(components):
+            self.rows['components'].append(self.make_row('component{:03d}.xsl'.format(i), None, i, letter_size))
+
+    @staticmethod
+    def make_row(name, channel, i, letter_size):
+        # Every fourth letter is not customized, and the others were updated some time last month
+        content = LETTER_TEMPLATE.format(name=escape(name), padding='x' * max(0, letter_size - 250))
+        return {
+            'name': name,
+            'channel': channel,
+            'customized': 'Institution' if i % 4 else '-',
+            'updated_by': 'bench',
+            'updated_on': (date.today() - timedelta(days=i % 30 + 1)).strftime('%d/%m/%Y'),
+            'content': content,
+            'default': content,
+        }
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def new_session(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[token] = {'uploaded': ''}
+        return token
+
+    def save_letter(self, table, index, content):
+        with self.lock:
+            row = self.rows[table][index]
+            row['content'] = content
+            row['customized'] = 'Institution'
+            row['updated_by'] = 'bench'
+            row['updated_on'] = date.today().strftime('%d/%m/%Y')
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Request handler for the simulated Alma. `self.server.alma` is the FakeAlma object."""
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def alma(self):
+        return self.server.alma
+
+    def session(self):
+        for part in (self.headers.get('Cookie') or '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == 'ALMA_SESSION' and value in self.alma.sessions:
+                return self.alma.sessions[value]
+        return None
+
+    def respond(self, body, status=200, headers=None):
+        data = PAGE.format(body=body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def redirect(self, location, headers=None):
+        self.send_response(302)
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def handle_request(self, method):
+        self.alma.count_request()
+        self.alma.delay()
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == '/favicon.ico':
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if url.path == '/mng/login':
+            if method == 'POST':
+                token = self.alma.new_session()
+                return self.redirect('/mng/action/home.do',
+                                     {'Set-Cookie': 'ALMA_SESSION={}; Path=/'.format(token)})
+            return self.respond(LOGIN)
+
+        session = self.session()
+        if session is None:
+            return self.redirect('/mng/login?auth=basic')
+
+        if url.path == '/mng/action/home.do':
+            return self.respond(HOME.format(version=escape(self.alma.version)))
+        if url.path == '/mng/action/table' and query.get('t') in TABLES:
+            if 'size' in query:
+                session['page_size_' + query['t']] = int(query['size'])
+            return self.respond(self.table_page(session, query['t'], int(query.get('page', 1))))
+        if url.path == '/mng/action/letter' and query.get('t') in TABLES:
+            index = int(query.get('id', -1))
+            if not 0 <= index < len(self.alma.rows[query['t']]):
+                return self.respond('<p>No such letter</p>', 404)
+            if method == 'POST':
+                fields = parse_qs(self.read_body().decode('utf-8'))
+                if 'save' in fields or 'customize' in fields:
+                    self.alma.save_letter(query['t'], index, fields.get('pageBean.fileContent', [''])[0])
+                page = index // self.page_size(session, query['t']) + 1
+                return self.respond(self.table_page(session, query['t'], page))
+            if query.get('view') == 'default':
+                return self.respond(self.default_page(session, query['t'], index))
+            return self.respond(self.letter_page(session, query['t'], index, query.get('tab', 'general')))
+        if url.path == '/mng/action/template':
+            message = None
+            if method == 'POST':
+                session['uploaded'] = self.read_upload()
+                message = 'The file was uploaded'
+            return self.respond(self.template_page(message))
+        if url.path == '/mng/action/output':
+            return self.respond(u'<h1>Notification</h1><p class="lang">{}</p><pre>{}</pre>'.format(
+                escape(query.get('lang', '')), escape(session['uploaded'])))
+
+        self.respond('<p>Not found</p>', 404)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def read_upload(self):
+        """Return the contents of the file in a multipart/form-data upload."""
+        body = self.read_body()
+        header = 'Content-Type: {}\r\n\r\n'.format(self.headers.get('Content-Type')).encode('utf-8')
+        message = BytesParser().parsebytes(header + body)
+        for part in message.get_payload() if message.is_multipart() else []:
+            if part.get_filename() is not None:
+                return part.get_payload(decode=True).decode('utf-8')
+        return ''
+
+    def page_size(self, session, table):
+        return session.get('page_size_' + table, self.alma.page_sizes[0])
+
+    def table_page(self, session, table, page):
+        spec = TABLES[table]
+        rows = self.alma.rows[table]
+        size = self.page_size(session, table)
+        pages = max(1, (len(rows) + size - 1) // size)
+        page = max(1, min(page, pages))
+        link = '/mng/action/table?t=' + table + '&page={}'
+
+        html = [u'<select id="pageBeanrecordsPerPage_hiddenSelect" style="display: none" '
+                u'onchange="location.href = \'/mng/action/table?t={}&amp;page=1&amp;size=\' + this.value">'
+                .format(table)]
+        for option in self.alma.page_sizes:
+            html.append(u'<option value="{0}"{1}>{0}</option>'.format(option, ' selected' if option == size else ''))
+        html.append(u'</select>')
+
+        html.append(u'<div class="typeD"><table id="{}"><tbody>'.format(spec['table_id']))
+        for i, index in enumerate(range((page - 1) * size, min(page * size, len(rows)))):
+            row = rows[index]
+            values = [row['name'], row['channel'], row['customized'], row['updated_by'], row['updated_on']]
+            if table == 'components':
+                del values[1]
+            html.append(u'<tr class="jsRecordContainer">')
+            for column, value in zip(spec['columns'], values):
+                cell_id = 'SELENIUM_ID_{}_ROW_{}_COL_{}'.format(spec['table_id'], i, column)
+                if column == spec['columns'][0]:
+                    value = u'<a href="/mng/action/letter?t={}&amp;id={}">{}</a>'.format(table, index, escape(value))
+                else:
+                    value = escape(value or '')
+                html.append(u'<td id="{}">{}</td>'.format(cell_id, value))
+            if row['customized'] != '-':
+                # The row actions menu of a customized letter has "View Default"
+                html.append(u'<td><span id="ROW_ACTION_{}_{}_c.ui.table.btn.view_default">'
+                            u'<a href="/mng/action/letter?t={}&amp;id={}&amp;view=default">View Default</a>'
+                            u'</span></td>'.format(spec['table_id'], i, table, index))
+            html.append(u'</tr>')
+        html.append(u'</tbody></table></div>')
+
+        html.append(u'<div class="pagination">')
+        html.append(u'<span class="paginationPrevious{}"><a href="{}">Previous</a></span>'.format(
+            ' disabled' if page == 1 else '', escape(link.format(max(page - 1, 1)))))
+        # Like Alma, only the pages around the current one are linked
+        for number in range(max(1, page - self.alma.page_window), min(pages, page + self.alma.page_window) + 1):
+            if number == page:
+                # Like Alma, the current page is not a link
+                html.append(u'<span class="paginationCurrent">{}</span> '.format(number))
+            else:
+                html.append(u'<a href="{}">{}</a> '.format(escape(link.format(number)), number))
+        html.append(u'<span class="paginationNext{}"><a href="{}">Next</a></span>'.format(
+            ' disabled' if page == pages else '', escape(link.format(min(page + 1, pages)))))
+        html.append(u'</div>')
+        return u'\n'.join(html)
+
+    def letter_page(self, session, table, index, tab):
+        row = self.alma.rows[table][index]
+        base = '/mng/action/letter?t={}&amp;id={}'.format(table, index)
+        page = index // self.page_size(session, table) + 1
+        html = [
+            u'<div class="pageTitle">{}</div>'.format(escape(row['name'])),
+            u'<span id="cnew_letter_labeltemplate_span"><a href="{}&amp;tab=template">Template</a></span>'.format(base),
+            u'<a id="PAGE_BUTTONS_cbuttonnavigationcancel" href="/mng/action/table?t={}&amp;page={}">Cancel</a>'.format(
+                table, page),
+        ]
+        if tab == 'template':
+            button = 'save' if row['customized'] != '-' else 'customize'
+            html += [
+                u'<form method="post" action="{}">'.format(base),
+                u'<input type="hidden" name="pageBean.token" value="{}">'.format(uuid.uuid4().hex),
+                u'<textarea id="pageBeanfileContent" name="pageBean.fileContent" rows="30" cols="100">{}</textarea>'
+                .format(escape(row['content'])),
+                u'<input type="submit" id="PAGE_BUTTONS_cbutton{0}" name="{0}" value="{0}">'.format(button),
+                u'</form>',
+            ]
+        return u'\n'.join(html)
+
+    def default_page(self, session, table, index):
+        row = self.alma.rows[table][index]
+        page = index // self.page_size(session, table) + 1
+        return u'\n'.join([
+            u'<div class="pageTitle">{}</div>'.format(escape(row['name'])),
+            u'<a id="PAGE_BUTTONS_cbuttonnavigationcancel" href="/mng/action/table?t={}&amp;page={}">Cancel</a>'.format(
+                table, page),
+            u'<textarea id="pageBeanfileContent" rows="30" cols="100" readonly>{}</textarea>'.format(
+                escape(row['default'])),
+        ])
+
+    def template_page(self, message=None):
+        options = u''.join(u'<option value="{}">{}</option>'.format(code, name) for code, name in LANGUAGES)
+        items = u''.join(
+            u'<li title="{1}"><a href="javascript:void(0)" onclick="'
+            u'document.getElementById(\'pageBeanuserPreferredLanguage_hiddenSelect\').value = \'{0}\';'
+            u'document.getElementById(\'pageBeanuserPreferredLanguage\').innerText = \'{1}\';'
+            u'this.parentNode.parentNode.style.display = \'none\'">{1}</a></li>'.format(code, name)
+            for code, name in LANGUAGES)
+        html = [
+            u'<form method="post" action="/mng/action/template" enctype="multipart/form-data" '
+            u'onsubmit="var m = document.querySelector(\'.infoErrorMessages\'); if (m) m.remove();">',
+            u'<input type="file" id="pageBeannewFormFile" name="pageBean.newFormFile">',
+            u'<input type="submit" id="cbuttonupload" value="Upload">',
+            u'</form>',
+            u'<select id="pageBeanuserPreferredLanguage_hiddenSelect" style="display: none">{}</select>'
+            .format(options),
+            u'<a id="pageBeanuserPreferredLanguage" href="javascript:void(0)" onclick="'
+            u'document.getElementById(\'pageBeanuserPreferredLanguage_hiddenSelect_list\').style.display = \'block\'">'
+            u'English</a>',
+            u'<ul id="pageBeanuserPreferredLanguage_hiddenSelect_list" style="display: none">{}</ul>'.format(items),
+            u'<button id="PAGE_BUTTONS_admconfigure_notification_templaterun_xsl" onclick="window.open('
+            u'\'/mng/action/output?lang=\' + document.getElementById(\'pageBeanuserPreferredLanguage_hiddenSelect\')'
+            u'.value, \'_blank\')">Run XSL</button>',
+        ]
+        if message is not None:
+            html.append(u'<div class="infoErrorMessages">{}</div>'.format(escape(message)))
+        return u'\n'.join(html)
+
+
+class FakeAlmaServer(ThreadingMixIn, HTTPServer):
+    """HTTP server for a FakeAlma, handling each request in its own thread."""
+
+    daemon_threads = True
+
+    def __init__(self, alma, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), Handler)
+        self.alma = alma
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """Serve requests in a background thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a simulated Alma for testing slipsomat')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--letters', type=int, default=100, help='number of letters')
+    parser.add_argument('--components', type=int, default=20, help='number of components')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='max random seconds added to every request')
+    args = parser.parse_args()
+
+    server = FakeAlmaServer(FakeAlma(args.letters, args.components, args.latency, args.jitter), port=args.port)
+    print('Serving a simulated Alma at {}. Set base_url={} in slipsomat.cfg'.format(
+        server.base_url, server.base_url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+# encoding=utf8
+from __future__ import print_function
+
+try:
+    from html.parser import HTMLParser  # Python 3
+    from urllib.parse import urljoin
+except ImportError:
+    from HTMLParser import HTMLParser  # Python 2
+    from urlparse import urljoin
+
+from .slipsomat import LetterContent
+
+
+class FormChanged(Exception):
+    """The letter page could not be loaded or did not have the expected shape, so the Selenium path should be used."""
+
+
+class LetterPageParser(HTMLParser):
+    """
+    Extract what we need from a letter edit page: the page title, the link to the
+    "Template" tab and the form holding the template textarea.
+    """
+
+    textarea_id = 'pageBeanfileContent'
+    template_tab_id = 'cnew_letter_labeltemplate_span'
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.title = None
+        self.template_link = None
+        self.forms = []  # list of dicts with action, method, fields and buttons
+        self.textarea_form = None
+        self.textarea_text = None
+        self.has_result_table = False
+
+        self._form = None
+        self._textarea = None  # (name, id, list of text chunks) while inside a textarea
+        self._select = None
+        self._in_title = False
+        self._in_template_tab = False
+        self._in_type_d = 0
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+
+        if 'pageTitle' in classes:
+            self._in_title = True
+            self.title = ''
+        if attrs.get('id') == self.template_tab_id:
+            self._in_template_tab = True
+        if tag == 'a' and self._in_template_tab and self.template_link is None:
+            self.template_link = attrs.get('href')
+        if 'typeD' in classes:
+            self._in_type_d += 1
+        if tag == 'table' and self._in_type_d > 0:
+            self.has_result_table = True
+
+        if tag == 'form':
+            self._form = {
+                'action': attrs.get('action') or '',
+                'method': (attrs.get('method') or 'get').lower(),
+                'fields': [],
+                'buttons': {},
+            }
+            self.forms.append(self._form)
+
+        name = attrs.get('name')
+        if tag == 'textarea' and name:
+            self._textarea = (name, attrs.get('id'), [])
+        if self._form is None:
+            return
+
+        if tag == 'input' and name:
+            input_type = (attrs.get('type') or 'text').lower()
+            if input_type in ('submit', 'button', 'image'):
+                self._form['buttons'][attrs.get('id') or name] = (name, attrs.get('value') or '')
+            elif input_type in ('checkbox', 'radio'):
+                if 'checked' in attrs:
+                    self._form['fields'].append([name, attrs.get('value') or 'on'])
+            elif input_type != 'file':
+                self._form['fields'].append([name, attrs.get('value') or ''])
+        elif tag == 'button' and name:
+            self._form['buttons'][attrs.get('id') or name] = (name, attrs.get('value') or '')
+        elif tag == 'select' and name:
+            self._select = [name, None]
+        elif tag == 'option' and self._select is not None:
+            if self._select[1] is None or 'selected' in attrs:
+                self._select[1] = attrs.get('value') or ''
+
+    def handle_endtag(self, tag):
+        if tag == 'span':
+            self._in_template_tab = False
+        if tag in ('h1', 'h2', 'h3', 'div', 'span'):
+            self._in_title = False
+        if tag == 'form':
+            self._form = None
+        elif tag == 'textarea' and self._textarea is not None:
+            name, elem_id, chunks = self._textarea
+            text = ''.join(chunks)
+            if self._form is not None:
+                self._form['fields'].append([name, text])
+                if elem_id == self.textarea_id:
+                    self._form['textarea_name'] = name
+                    self.textarea_form = self._form
+                    self.textarea_text = text
+            self._textarea = None
+        elif tag == 'select' and self._select is not None:
+            if self._select[1] is not None and self._form is not None:
+                self._form['fields'].append(self._select)
+            self._select = None
+
+    def handle_data(self, data):
+        if self._textarea is not None:
+            self._textarea[2].append(data)
+        elif self._in_title:
+            self.title += data
+
+    @classmethod
+    def parse(cls, html):
+        parser = cls()
+        parser.feed(html)
+        parser.close()
+        if parser.title is not None:
+            parser.title = parser.title.strip()
+        return parser
+
+
+class HttpTransport(object):
+    """
+    Fetch and save letters with plain HTTP requests, reusing the browser's login session.
+
+    The Selenium session is still used to log in and to find the letters. Whenever a
+    letter has been opened in the browser, the URL of its template page is remembered,
+    and later fetches of the same letter are done by requesting that URL directly and
+    parsing the HTML locally. The template URLs are kept in the worker's UrlCache, if
+    enabled, so they are known in the next run too. If a request fails or a page does not
+    look like we expect (for instance because we were logged out or Alma changed the
+    form), FormChanged is raised so the caller can fall back to the browser.
+    """
+
+    def __init__(self, worker):
+        try:
+            import requests
+            from requests.adapters import HTTPAdapter
+        except ImportError:
+            raise RuntimeError('The HTTP transport requires the "requests" package. '
+                               'Run "pip install requests" or set enabled=false in the [http] section.')
+
+        self.worker = worker
+        self.request_exception = requests.RequestException
+        self.session = requests.Session()
+        pool_size = int(worker.config.get('http', 'pool_size'))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.timeout = worker.default_timeout
+
+        self.letter_urls = {}  # unique_name -> URL of the letter's page, as found in the table
+        self.forms = {}  # unique_name -> (page URL, parsed form) of the last fetch
+
+    def sync_cookies(self):
+        """Copy the cookies and user agent from the browser session."""
+        driver = self.worker.driver
+        self.session.cookies.clear()
+        for cookie in driver.get_cookies():
+            self.session.cookies.set(cookie['name'], cookie['value'],
+                                     domain=cookie.get('domain'), path=cookie.get('path', '/'))
+        self.session.headers['User-Agent'] = driver.execute_script('return navigator.userAgent')
+
+    def learn(self, letter_info, url):
+        self.letter_urls[letter_info.unique_name] = url
+
+    def forget(self, letter_info):
+        self.letter_urls.pop(letter_info.unique_name, None)
+        self.forms.pop(letter_info.unique_name, None)
+        if self.worker.urls is not None:
+            self.worker.urls.forget('letter:' + letter_info.unique_name)
+
+    def letter_url(self, letter_info):
+        if self.worker.urls is not None:
+            # The template page, stored by ConfigurationTable.open_letter_in_browser in this or an earlier run
+            url = self.worker.urls.get('letter:' + letter_info.unique_name)
+            if url is not None:
+                return url
+        return self.letter_urls.get(letter_info.unique_name)
+
+    def can_fetch(self, letter_info):
+        return self.letter_url(letter_info) is not None
+
+    def can_save(self, letter_info):
+        return letter_info.unique_name in self.forms
+
+    def request(self, method, url, **kwargs):
+        try:
+            return self.session.request(method, url, timeout=self.timeout, **kwargs)
+        except self.request_exception as e:
+            raise FormChanged('Request to {} failed: {}'.format(url, e))
+
+    def get_page(self, url):
+        response = self.request('GET', url)
+        if response.status_code != 200 or '/login' in response.url:
+            raise FormChanged('Got {} from {}'.format(response.status_code, response.url))
+        return response.url, LetterPageParser.parse(response.text)
+
+    def fetch(self, letter_info):
+        """Fetch the template of a letter and return it as a LetterContent object."""
+        url, page = self.get_page(self.letter_url(letter_info))
+        if page.title != letter_info.name:
+            raise FormChanged('Unexpected page title: %r != %r' % (page.title, letter_info.name))
+
+        if page.textarea_form is None and page.template_link:
+            # We got the letter's first tab, follow the link to the "Template" tab
+            url, page = self.get_page(urljoin(url, page.template_link))
+
+        if page.textarea_form is None:
+            raise FormChanged('No template textarea found')
+
+        self.forms[letter_info.unique_name] = (url, page.textarea_form)
+        return LetterContent(page.textarea_text)
+
+    def save(self, letter_info, content):
+        """Submit the form of the last fetched version of a letter with new contents."""
+        url, form = self.forms.pop(letter_info.unique_name)
+
+        fields = [
+            (name, content.text if name == form['textarea_name'] else value)
+            for name, value in form['fields']
+        ]
+
+        for button_id in ('PAGE_BUTTONS_cbuttonsave', 'PAGE_BUTTONS_cbuttoncustomize'):
+            if button_id in form['buttons']:
+                fields.append(form['buttons'][button_id])
+                break
+        else:
+            raise FormChanged('No save button found')
+
+        response = self.request('POST', urljoin(url, form['action']), data=fields)
+        if response.status_code != 200 or not LetterPageParser.parse(response.text).has_result_table:
+            raise FormChanged('The letter table was not shown after saving')
+        return True
@@ -1,10 +1,16 @@
 class LetterInfo(object):
     """Interface to "Customize letters" in Alma."""
 
-    def __init__(self, name, index, channel):
+    def __init__(self, name, index, channel, customized=None, updated_by=None, updated_on=None, link=None,
+                 page=1):
         self.name = name
-        self.index = index
+        self.index = index  # row number on the page
+        self.page = page
         self.channel = channel
+        self.customized = customized
+        self.updated_by = updated_by
+        self.updated_on = updated_on
+        self.link = link
 
         self.unique_name = name + '-' + channel if channel else name
 
@@ -13,6 +19,27 @@ class LetterInfo(object):
 #         else:
 #             self.unique_name = name 
             
+    @classmethod
+    def from_rows(cls, rows, page=1):
+        """Create LetterInfo objects from the table rows returned by ConfigurationTable.read_table_script."""
+        return [
+            cls(row['name'], row['index'], row.get('channel'),
+                customized=row.get('customized'),
+                updated_by=row.get('updated_by'),
+                updated_on=row.get('updated_on'),
+                link=row.get('link'),
+                page=page)
+            for row in rows
+        ]
+
+    def remote_metadata(self):
+        """Return the table columns that tell whether the letter has been changed in Alma."""
+        return {
+            'customized': self.customized,
+            'updated_by': self.updated_by,
+            'updated_on': self.updated_on,
+        }
+
     def get_filename(self):
         filename = './' + self.unique_name.replace(' ', '_')
 
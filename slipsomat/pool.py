@@ -0,0 +1,189 @@
+# encoding=utf8
+from __future__ import print_function
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    import queue  # Python 3
+except ImportError:
+    import Queue as queue  # Python 2
+
+
+class OpenTimes(object):
+    """Remembers how long each letter took to open, so slow letters can be scheduled first."""
+
+    filename = '.slipsomat_timings.json'
+
+    def __init__(self):
+        self.times = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as fp:
+                self.times = json.load(fp)
+
+    def get(self, unique_name, default=None):
+        return self.times.get(unique_name, default)
+
+    def set(self, unique_name, seconds):
+        self.times[unique_name] = round(seconds, 3)
+
+    def estimate(self, unique_name):
+        """Return the recorded open time, or the mean of all recorded times for unknown letters."""
+        if unique_name in self.times:
+            return self.times[unique_name]
+        if len(self.times) == 0:
+            return 0.0
+        return sum(self.times.values()) / len(self.times)
+
+    def save(self):
+        with open(self.filename, 'w') as fp:
+            json.dump(self.times, fp, sort_keys=True, indent=2)
+
+
+class WorkerPool(object):
+    """
+    A pool of logged-in Worker sessions sharing a queue of letters.
+
+    The first worker is the caller's own (already connected) worker, the others are
+    clones that are logged in by `connect()`. Each worker runs in its own thread and
+    takes letters from a shared queue, so a worker that finishes early simply takes
+    the next letter. Results are handed back to the calling thread, which is the only
+    place local files and the status file are written.
+    """
+
+    def __init__(self, worker, size):
+        self.workers = [worker] + [worker.clone() for _ in range(size - 1)]
+        self.threads = []  # threads of the last `imap`
+        self.stopping = threading.Event()  # tells the threads not to start another item
+        self.cond = threading.Condition()
+
+    def connect(self):
+        """Log in all the cloned workers in parallel."""
+        errors = []
+
+        def connect(worker):
+            try:
+                worker.connect()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=connect, args=(worker,)) for worker in self.workers[1:]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(errors) != 0:
+            raise errors[0]
+
+    def stop(self):
+        """Let the threads finish the items they are working on, and wait for them."""
+        with self.cond:
+            self.stopping.set()
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def close(self):
+        """Stop the threads and close the cloned workers. The caller's own worker is left open."""
+        self.stop()
+        for worker in self.workers[1:]:
+            if worker.driver is not None:
+                worker.close()
+
+    def imap(self, make_task, items, key=None, cost=None):
+        """
+        Run a task for each item across all workers, yielding `(item, result, seconds)` as they complete.
+
+        If a worker crashes, the item it was working on is put back in the queue
+        and picked up by one of the remaining workers. An item is given up on (and the
+        exception re-raised) only when it has failed on every worker, or when all the
+        workers have crashed. When the generator stops, for whatever reason, the threads
+        don't start any more items, so the caller can use its own worker again after `close()`.
+
+        Params:
+            make_task: Function taking a Worker and returning a function that processes one item
+            items: List of items to process
+            key: Function returning a unique, hashable key for an item. Defaults to the item itself.
+            cost: Function returning the expected processing time of an item. If given, the most
+                  expensive items are started first (longest processing time first scheduling).
+        """
+        key = key or (lambda item: item)
+        if cost is not None:
+            items = sorted(items, key=cost, reverse=True)
+
+        pending = deque(items)
+        cond = self.cond
+        self.stopping.clear()
+        busy = [0]  # number of items currently being processed
+        results = queue.Queue()
+        failures = {}
+
+        def run(worker):
+            try:
+                task = make_task(worker)
+            except Exception as e:
+                results.put(('crashed', None, e, False))
+                return
+            while True:
+                with cond:
+                    # Idle workers stay around while others are busy, in case a crashed
+                    # worker hands its letter back to the queue.
+                    while len(pending) == 0 and busy[0] > 0 and not self.stopping.is_set():
+                        cond.wait()
+                    if len(pending) == 0 or self.stopping.is_set():
+                        cond.notify_all()
+                        results.put(('finished', None, None, False))
+                        return
+                    item = pending.popleft()
+                    busy[0] += 1
+                t0 = time.time()
+                try:
+                    value = task(item)
+                except Exception as e:
+                    # Hand the item over to the other workers before this one gives up
+                    with cond:
+                        failures[key(item)] = failures.get(key(item), 0) + 1
+                        requeued = failures[key(item)] < len(self.workers)
+                        if requeued:
+                            pending.appendleft(item)
+                        busy[0] -= 1
+                        cond.notify_all()
+                    results.put(('crashed', item, e, requeued))
+                    return
+                with cond:
+                    busy[0] -= 1
+                    cond.notify_all()
+                results.put(('done', item, value, time.time() - t0))
+
+        self.threads = [threading.Thread(target=run, args=(worker,)) for worker in self.workers]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+        alive = len(self.threads)
+        remaining = len(items)
+        try:
+            while remaining > 0:
+                if alive == 0:
+                    raise RuntimeError('All workers crashed, {} letter(s) not processed'.format(remaining))
+                status, item, value, extra = results.get()
+                if status == 'done':
+                    remaining -= 1
+                    yield item, value, extra
+                elif status == 'finished':
+                    alive -= 1
+                elif status == 'crashed':
+                    alive -= 1
+                    if item is None:
+                        continue
+                    if not extra:
+                        raise value
+                    print('\nWorker crashed ({}), handing {} over to the remaining workers'.format(value, key(item)))
+        finally:
+            with cond:
+                self.stopping.set()
+                cond.notify_all()
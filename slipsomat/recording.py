@@ -0,0 +1,182 @@
+# encoding=utf8
+from __future__ import print_function
+
+import gzip
+import json
+import time
+
+from selenium.common.exceptions import WebDriverException
+
+# Commands whose parameters or responses hold cookies, which give access to the Alma session
+COOKIE_COMMANDS = ['getCookies', 'getCookie', 'addCookie']
+
+REDACTED = '[redacted]'
+
+
+def open_session_file(filename, mode):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', encoding='utf-8')
+    return open(filename, mode)
+
+
+def redact(value, secrets, cookies=False):
+    """Return a copy of a JSON value with the secrets replaced, and with cookie values removed if `cookies`."""
+    if isinstance(value, dict):
+        keys = value.get('value')
+        if isinstance(keys, list) and all(isinstance(key, str) for key in keys) \
+                and any(secret in ''.join(keys) for secret in secrets):
+            # sendKeysToElement also sends the typed text one character at a time
+            value = dict(value, value=[REDACTED])
+        return {k: REDACTED if cookies and k == 'value' and 'name' in value else redact(v, secrets, cookies)
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v, secrets, cookies) for v in value]
+    if isinstance(value, str):
+        for secret in secrets:
+            value = value.replace(secret, REDACTED)
+    return value
+
+
+class ReplayMismatch(WebDriverException):
+    """The replayed session issued a command that is not in the recording."""
+
+
+class Recorder(object):
+    """
+    Write every WebDriver command and its response to a session file.
+
+    The file has one JSON object per line: for each browser session a header with the
+    capabilities of the browser, followed by one entry per command with the time it was
+    sent (relative to the start), how long it took, its parameters and the response.
+    Passwords, usernames and cookie values are redacted, so recordings can be attached
+    to bug reports. The file is compressed if its name ends with `.gz`.
+
+    Commands are recorded at the level of the command executor, i.e. as the JSON
+    exchanged with the browser driver, so the recording can be replayed by a
+    ReplayConnection without a browser.
+    """
+
+    def __init__(self, filename, secrets):
+        self.filename = filename
+        self.secrets = [secret for secret in secrets if secret]
+        self.fp = None
+        self.start = None
+        self.sessions = 0
+
+    def write(self, entry):
+        self.fp.write(json.dumps(entry) + '\n')
+        self.fp.flush()
+
+    def attach(self, driver):
+        """
+        Start recording the commands sent by a driver.
+
+        If the browser is restarted, the new driver is attached to the same recorder, and
+        its session is appended to the file after a new header.
+        """
+        self.fp = open_session_file(self.filename, 'w' if self.sessions == 0 else 'a')
+        self.sessions += 1
+        if self.start is None:
+            self.start = time.time()
+        self.write({
+            'type': 'session',
+            'session_id': driver.session_id,
+            'capabilities': redact(driver.capabilities, self.secrets),
+            'recorded_at': self.start,
+        })
+
+        executor = driver.command_executor
+        execute = executor.execute
+
+        def recorded_execute(command, params):
+            t0 = time.time()
+            entry = {
+                'type': 'command',
+                't': round(t0 - self.start, 4),
+                'command': command,
+                'params': redact(params, self.secrets, command in COOKIE_COMMANDS),
+            }
+            try:
+                response = execute(command, params)
+            except Exception as e:
+                entry.update(duration=round(time.time() - t0, 4), error=str(e))
+                self.write(entry)
+                raise
+            entry.update(duration=round(time.time() - t0, 4),
+                         response=redact(response, self.secrets, command in COOKIE_COMMANDS))
+            self.write(entry)
+            return response
+        executor.execute = recorded_execute
+        return driver
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
+class ReplayConnection(object):
+    """
+    A command executor for `webdriver.Remote` that answers with the responses from a recording.
+
+    Commands are matched in order against the recording. If the replayed code issues a
+    command that is not the next one recorded (for instance because the code has changed),
+    the recording is searched a little further ahead before ReplayMismatch is raised.
+
+    Params:
+        filename: Session file written by a Recorder
+        speed: Multiplier for the recorded duration of each command: 1 replays at the
+            recorded latency, 0 as fast as possible.
+        secrets: Strings to redact from the parameters before they are compared
+    """
+
+    lookahead = 50
+
+    def __init__(self, filename, speed=1.0, secrets=()):
+        self.speed = speed
+        self.secrets = [secret for secret in secrets if secret]
+        with open_session_file(filename, 'r') as fp:
+            self.entries = [json.loads(line) for line in fp if line.strip()]
+        if len(self.entries) == 0 or self.entries[0].get('type') != 'session':
+            raise ValueError('{} is not a slipsomat session recording'.format(filename))
+        self.position = 0
+
+    def find(self, command, params):
+        params = redact(params, self.secrets, command in COOKIE_COMMANDS)
+        end = min(len(self.entries), self.position + self.lookahead)
+        # First look for an exact match, then for the same command with other parameters.
+        # The search doesn't go past the start of the next browser session.
+        for exact in (True, False):
+            for i in range(self.position, end):
+                entry = self.entries[i]
+                if entry['type'] == 'session':
+                    break
+                if entry['command'] == command and (not exact or entry['params'] == params):
+                    return i
+        raise ReplayMismatch('Command {} {} not found in the recording after entry {}'.format(
+            command, json.dumps(params)[:200], self.position))
+
+    def start_session(self):
+        """Move on to the next browser session in the recording, and return the response to newSession."""
+        for i in range(self.position, len(self.entries)):
+            if self.entries[i]['type'] == 'session':
+                session = self.entries[i]
+                self.position = i + 1
+                return {'value': {'sessionId': session['session_id'], 'capabilities': session['capabilities']},
+                        'sessionId': session['session_id'], 'status': 0}
+        raise ReplayMismatch('No more browser sessions in the recording')
+
+    def execute(self, command, params):
+        if command == 'newSession':
+            return self.start_session()
+        if command in ('quit', 'close') and self.position >= len(self.entries):
+            return {'value': None, 'status': 0}
+
+        i = self.find(command, params)
+        entry = self.entries[i]
+        self.position = i + 1
+        if self.speed > 0:
+            time.sleep(entry['duration'] * self.speed)
+        if 'error' in entry:
+            raise WebDriverException(entry['error'])
+        return entry['response']
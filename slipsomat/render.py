@@ -0,0 +1,103 @@
+# encoding=utf8
+from __future__ import print_function
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+
+# Compiled stylesheets, cached per process: filename -> (mtime, XSLT object)
+_stylesheets = {}
+
+
+def set_preferred_language(text, lang):
+    """Substitute the language of a test XML file, the same way for Alma and local rendering."""
+    return re.sub('<preferred_language>[a-z]+</preferred_language>',
+                  '<preferred_language>%s</preferred_language>' % lang,
+                  text)
+
+
+def output_path(filename, lang, ext):
+    file_root, file_ext = os.path.splitext(filename)
+    return '%s_%s.%s' % (file_root, lang, ext)
+
+
+def find_letter_xsl(doc, basedir='.'):
+    """
+    Find the local letter XSL for a test XML document.
+
+    The letter is looked up by the `letter_name` or `letter_type` element of the XML.
+    If the letter exists for several channels, the EMAIL channel is preferred.
+    """
+    for tag in ('letter_name', 'letter_type'):
+        name = doc.findtext('.//' + tag)
+        if not name:
+            continue
+        name = name.strip().replace(' ', '_')
+        candidates = [os.path.join(basedir, name + '.xsl')] + sorted(glob(os.path.join(basedir, name + '-*.xsl')))
+        candidates = [c for c in candidates if os.path.isfile(c)]
+        for candidate in candidates:
+            if candidate.endswith('-EMAIL.xsl'):
+                return candidate
+        if len(candidates) != 0:
+            return candidates[0]
+    return None
+
+
+def get_stylesheet(filename):
+    from lxml import etree
+
+    mtime = os.path.getmtime(filename)
+    if filename not in _stylesheets or _stylesheets[filename][0] != mtime:
+        # Includes like header.xsl are resolved relative to the letter, i.e. from the working tree
+        _stylesheets[filename] = (mtime, etree.XSLT(etree.parse(filename)))
+    return _stylesheets[filename][1]
+
+
+def render(filename, lang, xsl=None):
+    """
+    Render a test XML file with the local letter XSL and write `<name>_<lang>.html`.
+
+    Returns `(html_path, error)`, where error is None on success. This function is run
+    in worker processes by `render_files`.
+    """
+    from lxml import etree
+
+    html_path = output_path(filename, lang, 'html')
+    try:
+        with open(filename, 'rb') as fp:
+            text = set_preferred_language(fp.read().decode('utf-8'), lang)
+        doc = etree.fromstring(text.encode('utf-8'))
+
+        xsl = xsl or find_letter_xsl(doc)
+        if xsl is None:
+            return html_path, 'Could not find a local letter for this file, use --xsl to specify one'
+
+        result = get_stylesheet(xsl)(doc)
+        with open(html_path, 'wb') as fp:
+            # Serialized according to the letter's xsl:output element
+            fp.write(bytes(result))
+    except (IOError, etree.Error) as e:
+        return html_path, str(e)
+    return html_path, None
+
+
+def _render(args):
+    return render(*args)
+
+
+def render_files(files, languages, xsl=None, jobs=None):
+    """
+    Render all combinations of files and languages across a process pool.
+
+    Yields `(filename, lang, html_path, error)` in the order of the combinations.
+    """
+    try:
+        import lxml  # noqa: F401
+    except ImportError:
+        raise RuntimeError('Local rendering requires the "lxml" package. Run "pip install lxml".')
+
+    tasks = [(filename, lang, xsl) for filename in files for lang in languages]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for task, (html_path, error) in zip(tasks, executor.map(_render, tasks)):
+            yield task[0], task[1], html_path, error
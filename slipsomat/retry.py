@@ -0,0 +1,110 @@
+# encoding=utf8
+from __future__ import print_function
+
+import time
+
+from selenium.common.exceptions import (InvalidSessionIdException, NoSuchElementException,
+                                        NoSuchWindowException, StaleElementReferenceException,
+                                        TimeoutException, WebDriverException)
+
+try:
+    from urllib3.exceptions import HTTPError as Urllib3Error
+except ImportError:
+    Urllib3Error = ()
+
+# Messages of WebDriver errors that mean the browser or its driver is gone
+SESSION_ERRORS = ['disconnected', 'not reachable', 'session deleted', 'no such session',
+                  'without establishing a connection', 'browsing context has been discarded']
+
+CATEGORIES = ['timeout', 'stale', 'session', 'logged_out']
+
+
+class RetryFailed(Exception):
+    """An operation still failed after the retries allowed for its kind of failure."""
+
+    def __init__(self, category, attempts, cause):
+        super(RetryFailed, self).__init__('{} after {} attempt(s): {}'.format(category, attempts, cause))
+        self.category = category
+        self.attempts = attempts
+        self.cause = cause
+
+
+class RetryPolicy(object):
+    """
+    Retry Selenium operations that fail for reasons that usually go away by themselves.
+
+    Failures are classified as:
+
+    - timeout: an element did not show up in time
+    - stale: the page was redrawn while we were using an element from it
+    - session: the browser crashed or its driver stopped responding; the browser is restarted
+    - logged_out: Alma sent us to the login page; we log in again in the same browser
+
+    Each category has its own retry limit, set in the [retry] section of slipsomat.cfg.
+    Before each retry we wait `backoff` seconds, doubling for each attempt up to `max_backoff`.
+    Other exceptions are not retried.
+    """
+
+    def __init__(self, config):
+        self.limits = {category: int(config.get('retry', category)) for category in CATEGORIES}
+        self.backoff = float(config.get('retry', 'backoff'))
+        self.max_backoff = float(config.get('retry', 'max_backoff'))
+
+    def classify(self, exc, worker):
+        """Return the category of a failure, or None if it should not be retried."""
+        if isinstance(exc, (InvalidSessionIdException, NoSuchWindowException, ConnectionError, Urllib3Error)):
+            return 'session'
+        if isinstance(exc, StaleElementReferenceException):
+            return 'stale'
+        if isinstance(exc, (TimeoutException, NoSuchElementException)):
+            try:
+                if worker.is_logged_out():
+                    return 'logged_out'
+            except Exception:
+                return 'session'
+            return 'timeout'
+        if isinstance(exc, WebDriverException):
+            message = str(exc).lower()
+            if any(text in message for text in SESSION_ERRORS):
+                return 'session'
+        return None
+
+    def recover(self, category, worker):
+        if category == 'session':
+            worker.restart()
+        elif category == 'logged_out':
+            worker.relogin()
+
+    def call(self, worker, fn, reset=None, on_retry=None):
+        """
+        Call `fn()` and return its result, retrying according to the policy.
+
+        Params:
+            worker: The Worker that `fn` uses, to be restarted or logged in again if needed
+            fn: Function to call
+            reset: Function to call after recovering and before retrying, to get back to
+                the page `fn` expects to start from
+            on_retry: Function called as `on_retry(category, attempt, delay)` before each retry
+
+        Raises RetryFailed when the retry limit of a category is reached.
+        """
+        attempts = dict.fromkeys(CATEGORIES, 0)
+        category = None
+        while True:
+            try:
+                if category is not None:
+                    self.recover(category, worker)
+                    if reset is not None:
+                        reset()
+                return fn()
+            except Exception as e:
+                category = self.classify(e, worker)
+                if category is None:
+                    raise
+                attempts[category] += 1
+                if attempts[category] > self.limits[category]:
+                    raise RetryFailed(category, attempts[category], e)
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempts[category] - 1))
+                if on_retry is not None:
+                    on_retry(category, attempts[category], delay)
+                time.sleep(delay)
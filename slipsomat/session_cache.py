@@ -0,0 +1,56 @@
+# encoding=utf8
+from __future__ import print_function
+
+import json
+import os
+import time
+
+
+class SessionCache(object):
+    """
+    The cookies of an authenticated Alma session, stored on disk so the login can be skipped.
+
+    The file is only readable by the current user, since the cookies give access to Alma
+    as long as the session lives. A cached session is tied to the Alma URL, institution
+    and username it was created for, and is not used after `max_age` seconds.
+    """
+
+    filename = '.slipsomat_session.json'
+
+    def __init__(self, base_url, institution, username, max_age):
+        self.key = '{}|{}|{}'.format(base_url, institution, username)
+        self.max_age = max_age
+
+    def load(self):
+        """Return the cached cookies, or None if there is no valid cached session."""
+        if not os.path.exists(self.filename):
+            return None
+        try:
+            with open(self.filename) as fp:
+                data = json.load(fp)
+        except ValueError:
+            return None
+
+        now = time.time()
+        if data.get('key') != self.key or data.get('saved_at', 0) + self.max_age < now:
+            return None
+        cookies = data.get('cookies', [])
+        if any(cookie.get('expiry') is not None and cookie['expiry'] < now for cookie in cookies):
+            return None
+        return cookies
+
+    def save(self, cookies):
+        data = {
+            'key': self.key,
+            'saved_at': time.time(),
+            'cookies': cookies,
+        }
+        # Create the file with owner-only permissions before anything is written to it
+        fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(data, fp)
+        os.chmod(self.filename, 0o600)
+
+    def clear(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
@@ -3,17 +3,18 @@ from __future__ import print_function
 import os
 import sys
 import shlex
+import argparse
 from textwrap import dedent
 from glob import glob
 from cmd import Cmd
+import threading
 import traceback
-import questionary
 
 from . import __version__
-from .worker import Worker
-from .slipsomat import StatusFile, LocalStorage, TestPage
-from .configuration_table import ConfigurationTable
-from .slipsomat import pull, pull_defaults, push, test
+from .checkpoint import Checkpoint
+from .config import read_config, ask_password
+from .slipsomat import StatusFile, LocalStorage
+from .slipsomat import diff, pull, pull_defaults, push, status, test, test_local
 
 histfile = '.slipsomat_history'
 try:
@@ -25,6 +26,63 @@ except ImportError:
     readline = None
 
 
+class CommandArgumentParser(argparse.ArgumentParser):
+    """Argument parser for shell commands that reports errors instead of exiting."""
+
+    def error(self, message):
+        raise ValueError(message)
+
+    def exit(self, status=0, message=None):
+        if message:
+            print(message)
+        raise ValueError()
+
+
+def parse_args(parser, arg):
+    """Parse a command line with the given parser, returning None on errors."""
+    try:
+        return parser.parse_args(shlex.split(arg))
+    except ValueError as e:
+        if str(e):
+            print('Error: {}'.format(e))
+        return None
+
+
+pull_parser = CommandArgumentParser(prog='pull', add_help=False)
+pull_parser.add_argument('-j', '--jobs', type=int, default=1)
+pull_parser.add_argument('--plan', action='store_true')
+pull_parser.add_argument('--all', action='store_true')
+pull_parser.add_argument('--resume', action='store_true')
+
+push_parser = CommandArgumentParser(prog='push', add_help=False)
+push_parser.add_argument('files', nargs='*')
+push_parser.add_argument('-j', '--jobs', type=int, default=1)
+
+defaults_parser = CommandArgumentParser(prog='defaults', add_help=False)
+defaults_parser.add_argument('-j', '--jobs', type=int, default=1)
+defaults_parser.add_argument('--resume', action='store_true')
+defaults_parser.add_argument('--force', action='store_true')
+
+diff_parser = CommandArgumentParser(prog='diff', add_help=False)
+diff_parser.add_argument('files', nargs='*')
+diff_parser.add_argument('--defaults', action='store_true')
+diff_parser.add_argument('--xml', action='store_true')
+diff_parser.add_argument('--stat', action='store_true')
+diff_parser.add_argument('-j', '--jobs', type=int)
+
+stats_parser = CommandArgumentParser(prog='stats', add_help=False)
+stats_parser.add_argument('--export')
+stats_parser.add_argument('--format', choices=['jsonl', 'chrome'])
+stats_parser.add_argument('--reset', action='store_true')
+
+test_parser = CommandArgumentParser(prog='test', add_help=False)
+test_parser.add_argument('files', nargs='?', default='')
+test_parser.add_argument('--local', action='store_true')
+test_parser.add_argument('--xsl')
+test_parser.add_argument('-j', '--jobs', type=int, default=1)
+test_parser.add_argument('--update-golden', action='store_true')
+
+
 class Shell(Cmd):
     """Interactive shell for parsing commands."""
 
@@ -32,28 +90,81 @@ class Shell(Cmd):
     prompt = "\001\033[1;36m\002slipsomat>\001\033[0m\002 "
     file = None
 
-    def __init__(self):
+    def __init__(self, connect=True):
         """
         Construct a new Shell object.
 
+        The browser is started and logged in in a background thread, so the prompt can be
+        used right away. Commands that need Alma wait for it with `require_browser()`.
+
         Params:
-            browser: Browser object for command dispatch
+            connect: Start the browser right away. If False, it's started by the first command needing it.
         """
         super(Shell, self).__init__()
         print('Starting slipsomat {}'.format(__version__))
 
-        self.worker = Worker('slipsomat.cfg')
-        self.worker.connect()
+        self.config = read_config('slipsomat.cfg')
         self.status_file = StatusFile()
         self.local_storage = LocalStorage(self.status_file)
-        sys.stdout.write('Reading table... ')
-        sys.stdout.flush()
-        
+
+        self.worker = None
+        self.letters_configuration = None
+        self.components_configuration = None
+        self.testpage = None
+        self.browser_thread = None
+        self.browser_error = None
+
+        if connect:
+            self.start_browser()
+
+    def start_browser(self):
+        """Start the browser and log in to Alma in a background thread."""
+        ask_password(self.config)
+        self.browser_error = None
+        self.browser_thread = threading.Thread(target=self.connect_browser)
+        self.browser_thread.daemon = True
+        self.browser_thread.start()
+
+    def connect_browser(self):
+        try:
+            # Selenium is imported here, so it doesn't slow down the startup
+            from .worker import Worker
+
+            self.worker = Worker(None, config=self.config)
+            self.worker.connect()
+            self.create_pages()
+        except Exception as e:
+            self.browser_error = e
+
+    def create_pages(self):
+        from .configuration_table import ConfigurationTable
+        from .test_page import TestPage
+
         self.letters_configuration    = ConfigurationTable('Letters Configuration', self.worker)
         self.components_configuration = ConfigurationTable('Components Configuration', self.worker)
-        
         self.testpage = TestPage(self.worker)
-        sys.stdout.write('\rReading table... DONE\n')
+
+    def require_browser(self):
+        """Wait for the browser to be logged in. Returns False if it failed to start."""
+        if self.browser_thread is None:
+            self.start_browser()
+        if self.browser_thread.is_alive():
+            print('Waiting for the browser to log in...')
+            self.browser_thread.join()
+        if self.browser_error is not None:
+            print('Failed to start the browser: {}'.format(self.browser_error))
+            print('The browser will be started again by the next command that needs it.')
+            if self.worker is not None and self.worker.driver is not None:
+                self.worker.close()
+            self.browser_thread = None
+            return False
+        return True
+
+    def close_browser(self):
+        if self.browser_thread is not None and self.browser_thread.is_alive():
+            self.browser_thread.join()
+        if self.worker is not None and self.worker.driver is not None:
+            self.worker.close()
 
     @staticmethod
     def completion_helper(basedir, word, file_ext=None):
@@ -72,26 +183,70 @@ class Shell(Cmd):
 
     def do_exit(self, arg):
         """Exit the program."""
-        self.worker.close()
+        self.status_file.save()
+        self.close_browser()
         sys.exit()
 
+    def help_pull(self):
+        print(dedent("""
+        pull [--jobs N] [--plan] [--all] [--resume]
+
+            Pull in letters modified directly in Alma. Only letters that Alma
+            shows as updated since the last pull (or updated today) are opened.
+
+        Options:
+            --jobs N   Log in N browser sessions and split the letters between
+                       them. Defaults to 1.
+            --plan     Only list the letters that would be fetched.
+            --all      Also fetch letters that are not customized.
+            --resume   Continue an interrupted pull, skipping the letters it
+                       already finished.
+        """))
+
     def do_pull(self, arg):
-        """Pull in letters modified directly in Alma."""
+        args = parse_args(pull_parser, arg)
+        if args is None or not self.require_browser():
+            return
         self.execute(
-            pull, 
-            self.letters_configuration, 
-            self.components_configuration, 
-            self.local_storage, 
-            self.status_file
+            pull,
+            self.letters_configuration,
+            self.components_configuration,
+            self.local_storage,
+            self.status_file,
+            max(1, args.jobs),
+            args.plan,
+            args.all,
+            args.resume
         )
 
+    def help_defaults(self):
+        print(dedent("""
+        defaults [--jobs N] [--resume] [--force]
+
+            Pull in updates to default letters, read from the letters that are
+            not customized. Default letters only change with Alma releases, so
+            if Alma shows the same release as the last time, only letters that
+            have no default version yet are opened.
+
+        Options:
+            --jobs N   Log in N browser sessions and split the letters between
+                       them. Defaults to 1.
+            --resume   Continue an interrupted run, skipping the letters it
+                       already finished.
+            --force    Check all the default letters, even if the Alma release
+                       is unchanged.
+        """))
+
     def do_defaults(self, arg):
-        """Pull in updates to default letters."""
-        self.execute(pull_defaults, self.letters_configuration, self.local_storage, self.status_file)
+        args = parse_args(defaults_parser, arg)
+        if args is None or not self.require_browser():
+            return
+        self.execute(pull_defaults, self.letters_configuration, self.components_configuration, self.local_storage,
+                     self.status_file, max(1, args.jobs), args.resume, args.force)
 
     def help_push(self):
         print(dedent("""
-        push
+        push [--jobs N]
 
             Push locally modified files to Alma. With no arguments specified, the
             command will look for locally modified files and ask if you want to
@@ -99,20 +254,75 @@ class Shell(Cmd):
 
         push <filename>
 
-            Specify a filename relative to xsl/letters to only push a specific file.
+            Specify a filename to only push a specific file.
+
+        The files are compiled as XSLT before anything is uploaded, and the push
+        is aborted if one of them fails to compile.
+
+        Options:
+            --jobs N   Log in N browser sessions, so the next letters are opened
+                       while Alma is still saving the previous ones. Results are
+                       reported in the order of the files. Defaults to 1.
         """))
 
     def do_push(self, arg):
-        files = ['xsl/letters/%s' % filename for filename in shlex.split(arg)]
-        self.execute(push, self.letters_configuration, self.local_storage, self.status_file, files)
+        args = parse_args(push_parser, arg)
+        if args is None or not self.require_browser():
+            return
+        self.execute(push, self.letters_configuration, self.components_configuration, self.local_storage,
+                     self.status_file, args.files, max(1, args.jobs))
 
     def complete_push(self, word, line, begin_idx, end_idx):
         """Complete push arguments."""
-        return self.completion_helper('xsl/letters/', word, '.xsl')
+        return [filename for filename in os.listdir('.')
+                if filename.endswith('.xsl') and filename.lower().startswith(word.lower())]
+
+    def help_status(self):
+        print(dedent("""
+        status
+
+            List the letters that are modified, untracked, missing or that have
+            an updated default letter, by comparing the local files with
+            status.json. This does not need the browser, and can also be run
+            from the command line as "slipsomat status".
+        """))
+
+    def do_status(self, arg):
+        self.execute(status, self.local_storage)
+
+    def help_diff(self):
+        print(dedent("""
+        diff [<filename> ...] [--defaults] [--xml] [--stat] [--jobs N]
+
+            Show the local changes to the modified letters, compared with the
+            version in Alma when they were last pulled or pushed. This does not
+            need the browser, and can also be run from the command line as
+            "slipsomat diff".
+
+        Options:
+            --defaults  Compare with the default letters in the "defaults"
+                        folder instead. Without filenames, all the letters
+                        that have a default version are compared.
+            --xml       Compare the letters as XML, ignoring the order of
+                        attributes and changes in indentation.
+            --stat      Only show the number of added and removed lines.
+            --jobs N    Number of processes to use. Defaults to the number
+                        of CPUs.
+        """))
+
+    def do_diff(self, arg):
+        args = parse_args(diff_parser, arg)
+        if args is None:
+            return
+        self.execute(diff, self.local_storage, args.files, args.defaults, args.xml, args.stat, args.jobs)
+
+    def complete_diff(self, word, line, begin_idx, end_idx):
+        """Complete diff arguments."""
+        return self.complete_push(word, line, begin_idx, end_idx)
 
     def help_test(self):
         print(dedent("""
-        test <filename>@<lang>
+        test <filename>@<lang> [--local [--xsl <letter>]]
 
             Test letter output by uploading XML files in the 'test-data' folder to
             the Alma Notification Template and storing screenshots of the resulting
@@ -123,14 +333,28 @@ class Shell(Cmd):
               or a glob pattern like '*.xml'
             - <lang> can be either a single language code or multiple language codes
               separated by comma. Defaults to "en" if not specified.
+
+        Options:
+            --local        Render the files with the local letters instead of
+                           uploading them to Alma (requires lxml). No screenshots
+                           are taken.
+            --xsl <letter> With --local, the letter to use. By default, the letter
+                           is found from the letter name in the XML file.
+            --jobs N       Spread the files over N browser sessions.
+            --update-golden
+                           Store the outputs as the new golden versions in
+                           'test-data/golden' instead of comparing with them.
         """))
 
     def do_test(self, arg):
+        args = parse_args(test_parser, arg)
+        if args is None:
+            return
         languages = 'en'
-        if '@' in arg:
-            files, languages = arg.split('@')
+        if '@' in args.files:
+            files, languages = args.files.split('@')
         else:
-            files = arg
+            files = args.files
         languages = languages.split(',')
         files = glob(os.path.abspath(os.path.join('test-data', files)))
 
@@ -138,18 +362,57 @@ class Shell(Cmd):
             print('Error: No such file')
             return
 
-        self.execute(test, self.testpage, files, languages)
+        if args.local:
+            self.execute(test_local, files, languages, args.xsl)
+        elif self.require_browser():
+            self.execute(test, self.testpage, files, languages, max(1, args.jobs), args.update_golden)
 
     def complete_test(self, word, line, begin_idx, end_idx):
         """Complete test arguments."""
         return self.completion_helper('test-data/', word, '.xml')
 
+    def help_stats(self):
+        print(dedent("""
+        stats [--export <file> [--format jsonl|chrome]] [--reset]
+
+            Show the time spent in each navigation step so far (total, median
+            and 95th percentile), the average number of WebDriver round trips
+            per step, and the throughput of letters fetched.
+
+        Options:
+            --export <file>  Write all the recorded steps to a file, as JSON lines
+                             or in the Chrome trace format, which can be opened in
+                             chrome://tracing or https://ui.perfetto.dev. By default
+                             the format is chosen from the file extension: Chrome
+                             for .json, JSON lines otherwise.
+            --reset          Forget the steps recorded so far.
+        """))
+
+    def do_stats(self, arg):
+        args = parse_args(stats_parser, arg)
+        if args is None:
+            return
+        if self.worker is None:
+            print('The browser has not been started')
+            return
+        tracer = self.worker.tracer
+        if args.export:
+            count = tracer.export(args.export, args.format)
+            print('Wrote {} span(s) to {}'.format(count, args.export))
+        elif not args.reset:
+            tracer.print_stats()
+        if args.reset:
+            tracer.reset()
+
     # Aliases
     do_EOF = do_exit  # ctrl-d
     do_eof = do_EOF
     do_quit = do_exit
+    do_timings = do_stats
 
     def handle_exception(self, e):
+        import questionary
+
         print("\nException:", e)
         traceback.print_exc(file=sys.stdout)
 
@@ -174,12 +437,20 @@ class Shell(Cmd):
             import pdb
             pdb.post_mortem()
         elif answer == 'Restart browser':
-            self.worker.restart()
-            self.letters_configuration    = ConfigurationTable('Letters Configuration', self.worker)
-            self.components_configuration = ConfigurationTable('Components Configuration', self.worker)
+            if self.worker is None:
+                # The browser was not started yet; it logs in while the next command is typed
+                if self.browser_thread is None or not self.browser_thread.is_alive():
+                    self.start_browser()
+            else:
+                self.worker.restart()
+                self.create_pages()
+            command = Checkpoint.pending()
+            if command is not None:
+                print('Run "{} --resume" to continue where the command stopped.'.format(command))
             return
 
-        self.worker.close()
+        self.status_file.save()
+        self.close_browser()
         sys.exit()
 
     def preloop(self):
@@ -195,6 +466,8 @@ class Shell(Cmd):
             fn(*args, **kwargs)
         except Exception as e:
             self.handle_exception(e)
+        finally:
+            self.status_file.save()
 
     def precmd(self, line):
         """Process the command part of the input before it is sent to onecmd."""
@@ -206,6 +479,14 @@ def main():
         print('No slipsomat.cfg file found in this directory. Exiting.')
         return
 
+    if len(sys.argv) > 1:
+        # Run a single command, and only start the browser if the command needs it
+        shell = Shell(connect=False)
+        shell.onecmd(' '.join(shlex.quote(arg) for arg in sys.argv[1:]))
+        shell.status_file.save()
+        shell.close_browser()
+        return
+
     shell = Shell()
     shell.cmdloop()
 
@@ -4,22 +4,22 @@ from __future__ import print_function
 import os
 import os.path
 import re
-import time
 import sys
 import hashlib
 import json
-import difflib
-import tempfile
+import time
 
 from datetime import datetime
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.remote.errorhandler import NoSuchElementException
 from xml.etree import ElementTree
 from colorama import Fore, Back, Style
 
+from .validation import validate_files
+from .diff import diff_texts, diff_files
+from .pool import WorkerPool
+from .capture import CaptureWriter
+from .checkpoint import Checkpoint
+from .render import render_files
+
 try:
     input = raw_input  # Python 2
 except NameError:
@@ -52,56 +52,123 @@ def resolve_conflict(filename, local_content, remote_content, msg):
 
     msg = 'Continue with {}?'.format(filename)
     while True:
-        response = input(Fore.CYAN + "%s [y: yes, n: no, d: diff] " % msg + Style.RESET_ALL).lower()[:1]
-        if response == 'd':
-            show_diff(remote_content, local_content)
+        response = input(Fore.CYAN + "%s [y: yes, n: no, d: diff, x: XML diff] " % msg + Style.RESET_ALL).lower()[:1]
+        if response in ('d', 'x'):
+            show_diff(remote_content, local_content, xml=response == 'x')
         else:
             return response == 'y'
 
 
-def show_diff(dst, src):
-    src = src.text.strip().splitlines()
-    dst = dst.text.strip().splitlines()
-
+def show_diff(dst, src, xml=False):
+    """Print the changes from `dst` to `src`. With `xml`, the canonical XML forms are compared."""
     print()
-    for line in color_diff(difflib.unified_diff(dst, src, fromfile='Alma', tofile='Local')):
+    for line in color_diff(diff_texts(dst.text, src.text, fromfile='Alma', tofile='Local', xml=xml)):
         print(line)
 
 
+# Checksum of an empty letter
+EMPTY_SHA1 = hashlib.sha1(b'').hexdigest()
+
+
 class LetterContent(object):
 
     def __init__(self, text, filename=None):
         self.text = text.replace('\r\n', '\n').replace('\r', '\n').strip()
         self.filename = filename
-        self.validate()
+        self._sha1 = None
 
     @property
     def sha1(self):
-        m = hashlib.sha1()
-        m.update(self.text.encode('utf-8'))
-        return m.hexdigest()
+        if self._sha1 is None:
+            m = hashlib.sha1()
+            m.update(self.text.encode('utf-8'))
+            self._sha1 = m.hexdigest()
+        return self._sha1
 
     def validate(self):
+        """
+        Check that the letter is well-formed XML, printing a warning if not.
+
+        This is not done on construction, since most letters (like all the ones we pull
+        from Alma) never need it. Use `validation.validate_files` to compile letters as XSLT.
+        """
         if self.text == '':
-            return
+            return True
         try:
             ElementTree.fromstring(self.text)
         except ElementTree.ParseError as e:
             print('%sError: %s contains invalid XML:%s' % (Fore.RED, self.filename or 'The letter', Style.RESET_ALL))
             print(Fore.RED + str(e) + Style.RESET_ALL)
-            return
+            return False
+        return True
 
 
 class LocalStorage(object):
     """File storage abstraction class."""
 
+    # Copies of the letters as last seen in Alma, for `diff`
+    remote_dir = '.slipsomat_remote'
+
     def __init__(self, status_file):
         self.status_file = status_file
 
+    def checksum(self, filename):
+        """
+        Return the checksum of a local letter, or None if it doesn't exist or is empty.
+
+        The file is only read if its stat data has changed since it was last hashed.
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        sha1 = self.status_file.index.lookup(filename, st)
+        if sha1 is None:
+            sha1 = self.get_content(filename).sha1
+        return None if sha1 == EMPTY_SHA1 else sha1
+
     def is_modified(self, filename):
         """Return True if the letter has local changes not yet pushed to Alma."""
-        local_content = self.get_content(filename)
-        return local_content.text != '' and local_content.sha1 != self.status_file.checksum(filename)
+        sha1 = self.checksum(filename)
+        return sha1 is not None and sha1 != self.status_file.checksum(filename)
+
+    def modified_files(self):
+        """Return the letters in status.json that have local changes not yet pushed to Alma."""
+        return sorted(
+            filename for filename in self.status_file.letters
+            if self.status_file.checksum(filename) is not None and self.is_modified(filename)
+        )
+
+    def status(self):
+        """
+        Compare the working tree with status.json, without contacting Alma.
+
+        Returns a dict mapping 'modified', 'untracked', 'missing' and 'default-drifted' to
+        sorted lists of filenames. A letter has drifted from the default when the default
+        version has been updated by `defaults` since the letter was last pulled or pushed.
+        """
+        result = {'modified': [], 'untracked': [], 'missing': [], 'default-drifted': []}
+
+        local = set(name for name in os.listdir('.') if name.endswith('.xsl') and os.path.isfile(name))
+        tracked = set()
+        for filename in self.status_file.letters:
+            if self.status_file.checksum(filename) is None:
+                continue
+            name = os.path.normpath(filename)
+            tracked.add(name)
+            if name not in local and not os.path.isfile(filename):
+                result['missing'].append(name)
+            elif self.is_modified(filename):
+                result['modified'].append(name)
+
+            base = self.status_file.default_base_checksum(filename)
+            if base is not None and base != self.status_file.default_checksum(filename):
+                result['default-drifted'].append(name)
+
+        result['untracked'] = list(local - tracked)
+        for filenames in result.values():
+            filenames.sort()
+        return result
 
     def get_content(self, filename):
         """
@@ -112,7 +179,10 @@ class LocalStorage(object):
         if not os.path.isfile(filename):
             return LetterContent('', filename=filename)
         with open(filename, 'rb') as fp:
-            return LetterContent(fp.read().decode('utf-8'), filename=filename)
+            st = os.fstat(fp.fileno())
+            content = LetterContent(fp.read().decode('utf-8'), filename=filename)
+        self.status_file.index.record(filename, st, content.sha1)
+        return content
 
     def store(self, letter_info, content, modified):
         """
@@ -128,10 +198,11 @@ class LocalStorage(object):
         
         if not os.path.exists(os.path.dirname(filename)):
             os.makedirs(os.path.dirname(filename))
+        self.store_remote(filename, content)
 
-        local_content = self.get_content(filename)
-        if local_content.text != '' and local_content.sha1 != self.status_file.checksum(filename):
+        if self.is_modified(filename):
             # The local file has been changed
+            local_content = self.get_content(filename)
             if not resolve_conflict(filename, content, local_content,
                                     'Pulling in this file would cause local changes to be overwritten.'):
                 return False
@@ -139,13 +210,26 @@ class LocalStorage(object):
         # Actually store the contents to disk
         with open(filename, 'wb') as f:
             f.write(content.text.encode('utf-8'))
+        self.status_file.index.record(filename, os.stat(filename), content.sha1)
 
         # Update the status file
         self.status_file.set_checksum(filename, content.sha1)
         self.status_file.set_modified(filename, modified)
+        self.status_file.set_default_base_checksum(filename, self.status_file.default_checksum(filename))
 
         return True
 
+    def remote_filename(self, filename):
+        return os.path.join(self.remote_dir, os.path.normpath(filename))
+
+    def store_remote(self, filename, content):
+        """Keep a copy of the version of a letter seen in Alma."""
+        remote_filename = self.remote_filename(filename)
+        if not os.path.exists(os.path.dirname(remote_filename)):
+            os.makedirs(os.path.dirname(remote_filename))
+        with open(remote_filename, 'wb') as f:
+            f.write(content.text.encode('utf-8'))
+
     def store_default(self, filename, content):
         """
         Store the contents of a default letter to disk.
@@ -163,22 +247,132 @@ class LocalStorage(object):
         self.status_file.set_default_checksum(filename, content.sha1)
 
 
+class StatIndex(object):
+    """
+    The stat data (mtime, size and inode) of the local letters when they were last hashed.
+
+    Like the git index, this lets us tell that a file is unchanged without reading it.
+    It is stored in `.slipsomat_index.json` rather than in status.json, since the stat
+    data is specific to this working tree and should not be committed.
+
+    An entry is not trusted if the file was modified in the same second as the index
+    was saved (or later), since the file could then have been changed again without
+    its mtime changing. Once such a file has been hashed again, the index is saved
+    anew, so the entry is trusted the next time.
+    """
+
+    filename = '.slipsomat_index.json'
+    version = 1
+
+    def __init__(self):
+        self.entries = {}
+        self.saved_at = 0
+        self.dirty = False
+        self.racy = set()  # filenames whose entries were not trusted by `lookup`
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as fp:
+                    data = json.load(fp)
+            except ValueError:
+                return
+            if data.get('version') == self.version:
+                self.entries = data['entries']
+                self.saved_at = data['saved_at']
+
+    def lookup(self, filename, st):
+        """Return the checksum of the file if its stat data is unchanged, otherwise None."""
+        entry = self.entries.get(os.path.normpath(filename))
+        if entry is None:
+            return None
+        mtime_ns, size, inode, sha1 = entry
+        if (mtime_ns, size, inode) != (st.st_mtime_ns, st.st_size, st.st_ino):
+            return None
+        if mtime_ns >= self.saved_at - 1000000000:
+            # Racily clean: the file may have changed after it was hashed
+            self.racy.add(os.path.normpath(filename))
+            return None
+        return sha1
+
+    def record(self, filename, st, sha1):
+        entry = [st.st_mtime_ns, st.st_size, st.st_ino, sha1]
+        filename = os.path.normpath(filename)
+        if self.entries.get(filename) != entry or filename in self.racy:
+            # A racy entry confirmed by hashing is saved again, so `saved_at` moves past its mtime
+            self.entries[filename] = entry
+            self.racy.discard(filename)
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        # The index is only a cache, so there's no need for a journal here
+        self.saved_at = int(time.time() * 1e9)
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as fp:
+            json.dump({'version': self.version, 'saved_at': self.saved_at, 'entries': self.entries}, fp)
+        os.replace(tmp_filename, self.filename)
+        self.dirty = False
+        self.racy.clear()
+
+
 class StatusFile(object):
+    """
+    The checksums and modification dates of the letters, stored in status.json.
+
+    Changes are kept in memory and appended to a journal file as they are made, so
+    they survive a crash. The status.json file itself is only rewritten (atomically,
+    through a temporary file) when `save()` is called, at the end of a command or at
+    a checkpoint. If a journal is found on startup, it is replayed on top of status.json.
+    """
+
+    filename = 'status.json'
+    journal_filename = 'status.json.journal'
 
     def __init__(self):
         letters = {}
-        if os.path.exists('status.json'):
-            with open('status.json') as fp:
+        alma_version = None
+        if os.path.exists(self.filename):
+            with open(self.filename) as fp:
                 contents = json.load(fp)
             letters = contents['letters']
+            alma_version = contents.get('alma_version')
 
         self.letters = letters
+        self.alma_version = alma_version  # Alma release the default letters were last pulled from
+        self.dirty = False
+        self.journal = None
+        self.replay_journal()
+        self.index = StatIndex()
+
+    def replay_journal(self):
+        """Apply changes left in the journal by a command that did not finish."""
+        if not os.path.exists(self.journal_filename):
+            return
+        with open(self.journal_filename, 'rb') as fp:
+            for line in fp:
+                try:
+                    filename, property, value = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # A partially written last line
+                    break
+                if filename is None:
+                    setattr(self, property, value)
+                else:
+                    self.letters.setdefault(filename, {})[property] = value
+                self.dirty = True
 
     def save(self):
+        """Write status.json if anything has changed, and clear the journal."""
+        self.index.save()
+        if not self.dirty:
+            return
+
         data = {
             'version': 1,
             'letters': self.letters,
         }
+        if self.alma_version is not None:
+            data['alma_version'] = self.alma_version
         jsondump = json.dumps(data, sort_keys=True, indent=2)
 
         # Remove trailling spaces (https://bugs.python.org/issue16333)
@@ -187,8 +381,19 @@ class StatusFile(object):
         # Normalize to unix line endings
         jsondump = normalize_line_endings(jsondump)
 
-        with open('status.json', 'wb') as fp:
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as fp:
             fp.write(jsondump.encode('utf-8'))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_filename, self.filename)
+
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if os.path.exists(self.journal_filename):
+            os.remove(self.journal_filename)
+        self.dirty = False
 
     def get(self, filename, property, default=None):
         if filename not in self.letters:
@@ -198,8 +403,17 @@ class StatusFile(object):
     def set(self, filename, property, value):
         if filename not in self.letters:
             self.letters[filename] = {}
+        elif self.letters[filename].get(property) == value:
+            return
         self.letters[filename][property] = value
-        self.save()
+        self.write_journal(filename, property, value)
+
+    def write_journal(self, filename, property, value):
+        self.dirty = True
+        if self.journal is None:
+            self.journal = open(self.journal_filename, 'ab')
+        self.journal.write(json.dumps([filename, property, value]).encode('utf-8') + b'\n')
+        self.journal.flush()
 
     def modified(self, filename):
         return self.get(filename, 'modified')
@@ -210,6 +424,22 @@ class StatusFile(object):
     def default_checksum(self, filename):
         return self.get(filename, 'default_checksum')
 
+    def default_base_checksum(self, filename):
+        """Return the checksum the default letter had when the letter was last pulled or pushed."""
+        return self.get(filename, 'default_base_checksum')
+
+    def remote(self, filename):
+        """Return the table columns (customized, updated by, updated on) seen in Alma when last pulled."""
+        return {
+            'customized': self.get(filename, 'customized'),
+            'updated_by': self.get(filename, 'updated_by'),
+            'updated_on': self.get(filename, 'updated_on'),
+        }
+
+    def set_remote(self, filename, remote):
+        for property, value in remote.items():
+            self.set(filename, property, value)
+
     def set_modified(self, filename, modified=None):
         if modified is None:
             modified = datetime.now().strftime('%d/%m/%Y')
@@ -221,203 +451,155 @@ class StatusFile(object):
     def set_default_checksum(self, filename, checksum):
         self.set(filename, 'default_checksum', checksum)
 
+    def set_default_base_checksum(self, filename, checksum):
+        self.set(filename, 'default_base_checksum', checksum)
+
+    def set_alma_version(self, version):
+        if version != self.alma_version:
+            self.alma_version = version
+            # Journaled without a filename, as it is not a property of a letter
+            self.write_journal(None, 'alma_version', version)
 
 
 # Commands ---------------------------------------------------------------------------------
 
-def pull_defaults(table, local_storage, status_file):
+
+def pull_defaults(letters_configuration, components_configuration, local_storage, status_file, jobs=1,
+                  resume=False, force=False):
     """
     Update the local copies of the default versions of the Alma letters.
 
-    This command downloads the latest version of all the default versions of the Alma letters.
+    This command downloads the default versions of the Alma letters to the `defaults` folder.
     If you keep the folder under version control, this allows you to detect changes in the
-    default letters. Unfortunately, there is no way of knowing if a default letter has changed
-    without actually opening it, so we have to open each and every letter. This takes some time
-    of course.
+    default letters. Alma gives no hint when a default letter has changed, so each letter has
+    to be opened. Default letters only change with new Alma releases, though, so the release
+    shown in Alma is stored in status.json, and as long as it stays the same, only letters that
+    have no default version yet are opened.
 
     Params:
-        table: TemplateConfigurationTable object
-        local_storage: LocalStorage object
-        status_file: StatusFile object
+        letters_configuration:    ConfigurationTable object for "Letters Configuration"
+        components_configuration: ConfigurationTable object for "Components Configuration"
+        local_storage:            LocalStorage object
+        status_file:              StatusFile object
+        jobs:                     Number of browser sessions to use
+        resume:                   Skip the letters finished by the last, interrupted run
+        force:                    Open all the letters, even if the Alma release is unchanged
     """
+    version = letters_configuration.worker.alma_version()
+    only_new = not force and version is not None and version == status_file.alma_version
+    if only_new:
+        print('Alma is still at release {}, only checking letters without a default version. '
+              'Use "defaults --force" to check them all.'.format(version))
+    elif version is None:
+        print('Could not find the Alma release, checking all the default letters.')
+
+    checkpoint = Checkpoint('defaults', resume)
     count_new = 0
     count_changed = 0
-    for idx, filename in enumerate(table.filenames):
-        progress = '%d/%d' % ((idx + 1), len(table.filenames))
-        table.print_letter_status(filename, 'checking...', progress)
-        try:
-            content = table.open_default_letter(filename)
-        except TimeoutException:
-            # Retry once
-            table.print_letter_status(filename, 'retrying...', progress)
-            content = table.open_default_letter(filename)
-
-        table.print_letter_status(filename, 'closing...', progress)
-        table.close_letter()
-
-        old_sha1 = status_file.default_checksum(filename)
-
-        if content.sha1 == old_sha1:
-            table.print_letter_status(filename, 'no changes', progress, True)
-            continue
-
-        # Write contents to default letter
-        local_storage.store_default(filename, content)
-
-        if old_sha1 is None:
-            count_new += 1
-            table.print_letter_status(filename, Fore.GREEN + 'fetched new letter @ {}'.format(
-                content.sha1[0:7]) + Style.RESET_ALL, progress, True)
-        else:
-            count_changed += 1
-            if old_sha1 == content.sha1:
-                table.print_letter_status(
-                    filename, Fore.GREEN + 'no changes' + Style.RESET_ALL, progress, True)
-            else:
-                table.print_letter_status(filename, Fore.GREEN + 'updated from {} to {}'.format(
-                    old_sha1[0:7], content.sha1[0:7]) + Style.RESET_ALL, progress, True)
+    failed = []
+    for table in (components_configuration, letters_configuration):
+        new, changed, table_failed = table.pull_defaults(local_storage, status_file, jobs, only_new, checkpoint)
+        count_new += new
+        count_changed += changed
+        failed += table_failed
 
     sys.stdout.write(Fore.GREEN + 'Fetched {} new, {} changed default letters\n'.format(
         count_new, count_changed) + Style.RESET_ALL)
-
-
-class TestPage(object):
-    """Interface to "Notification Template" in Alma."""
-
-    def __init__(self, worker):
-        self.worker = worker
-
-    def open(self):
-        try:
-            self.worker.first(By.ID, 'cbuttonupload')
-        except NoSuchElementException:
-            self.worker.get('/mng/action/home.do')
-
-            # Open Alma configuration
-            self.worker.wait_for_and_click(By.CSS_SELECTOR, '#ALMA_MENU_TOP_NAV_configuration')
-            self.worker.click(By.XPATH, '//*[@href="#CONF_MENU6"]')  # text() = "General"
-            self.worker.click(By.XPATH, '//*[text() = "Notification Template"]')
-
-            self.worker.wait_for(By.ID, 'cbuttonupload')
-
-    def test(self, filename, lang):
-
-        self.open()
-        wait = self.worker.waiter()
-
-        if not os.path.isfile(filename):
-            print('%sERROR: File not found: %s%s' % (Fore.RED, filename, Fore.RESET))
-            return
-
-        file_root, file_ext = os.path.splitext(filename)
-
-        png_path = '%s_%s.png' % (file_root, lang)
-        html_path = '%s_%s.html' % (file_root, lang)
-
-        tmp = tempfile.NamedTemporaryFile('wb')
-        with open(filename, 'rb') as fp:
-            tmp.write(re.sub('<preferred_language>[a-z]+</preferred_language>',
-                             '<preferred_language>%s</preferred_language>' % lang,
-                             fp.read().decode('utf-8')).encode('utf-8'))
-        tmp.flush()
-
-        # Set language
-        element = self.worker.first(By.ID, 'pageBeanuserPreferredLanguage')
-        element.click()
-        element = self.worker.first(By.ID, 'pageBeanuserPreferredLanguage_hiddenSelect')
-        select = Select(element)
-        opts = {el.get_attribute('value'): el.get_attribute('innerText') for el in select.options}
-        if lang not in opts:
-            print('%sERROR: Language not found: %s%s' % (Fore.RED, lang, Fore.RESET))
-            return
-
-        longLangName = opts[lang]
-
-        element = wait.until(EC.element_to_be_clickable(
-            (By.XPATH,
-             '//ul[@id="pageBeanuserPreferredLanguage_hiddenSelect_list"]/li[@title="%s"]/a' % longLangName)
-        ))
-        element.click()
-
-        # Upload the XML
-        file_field = self.worker.first(By.ID, 'pageBeannewFormFile')
-        file_field.send_keys(tmp.name)
-
-        upload_btn = self.worker.first(By.ID, 'cbuttonupload')
-        upload_btn.click()
-
-        self.worker.wait_for(By.CSS_SELECTOR, '.infoErrorMessages')
-
-        run_btn = wait.until(
-            EC.element_to_be_clickable(
-                (By.ID, 'PAGE_BUTTONS_admconfigure_notification_templaterun_xsl'))
-        )
-
-        cwh = self.worker.driver.current_window_handle
-
-        run_btn.click()
-        time.sleep(1)
-
-        # Take a screenshot
-        self.worker.driver.switch_to_window(self.worker.driver.window_handles[-1])
-
-        if self.worker.driver.page_source.startswith('<xsl'):
-            # Wrong window, try next one
-            self.worker.driver.switch_to_window(self.worker.driver.window_handles[-2])
-
-        # GitHub: #30  -> if 'beanContentParam=htmlContent' in self.worker.driver.current_url:
-        self.worker.driver.set_window_size(
-            self.worker.config.get('screenshot', 'width'),
-            600
-        )
-        with open(html_path, 'w+b') as html_file:
-            html_file.write(self.worker.driver.page_source.encode('utf-8'))
-        print('Saved output: %s' % html_path)
-        if self.worker.driver.save_screenshot(png_path):
-            print('Saved screenshot: %s' % png_path)
-        else:
-            print('Failed to save screenshot')
-
-        # if not found_win:
-        #     print(Fore.RED + 'ERROR: Failed to produce output!' + Fore.RESET)
-        self.worker.driver.switch_to_window(cwh)
-        tmp.close()
-
-
-def pull(letters_configuration, components_configuration, local_storage, status_file):
+    if len(failed) != 0:
+        # Keep the checkpoint, so only the failed letters are tried again
+        checkpoint.close()
+        print(Fore.RED + 'Failed to fetch {} default letter(s)'.format(len(failed)) + Style.RESET_ALL)
+        print('Run "defaults --resume" to try the failed letters again.')
+        return
+    checkpoint.clear()
+    if version is not None:
+        status_file.set_alma_version(version)
+        status_file.save()
+
+
+def pull(letters_configuration, components_configuration, local_storage, status_file, jobs=1, dry_run=False,
+         include_all=False, resume=False):
     """
     Update the local files with changes made in Alma.
- 
-    This will download letters whose remote checksum does not match the value in status.json.
- 
+
+    This will download letters that have been updated in Alma since the last pull, and whose
+    remote checksum does not match the value in status.json.
+
     Params:
-        letters_configuration:    
-        components_configuration: 
+        letters_configuration:    ConfigurationTable object for "Letters Configuration"
+        components_configuration: ConfigurationTable object for "Components Configuration"
         local_storage:            LocalStorage object
         status_file:              StatusFile object
+        jobs:                     Number of browser sessions to use
+        dry_run:                  Only list the letters that would be fetched
+        include_all:              Also fetch letters that are not customized
+        resume:                   Skip the letters finished by the last, interrupted run
+    """
+    if dry_run:
+        components_configuration.pull(local_storage, status_file, jobs, dry_run, include_all)
+        letters_configuration.pull(local_storage, status_file, jobs, dry_run, include_all)
+        return
+
+    checkpoint = Checkpoint('pull', resume)
+    failed = components_configuration.pull(local_storage, status_file, jobs, dry_run, include_all, checkpoint)
+    failed += letters_configuration.pull(local_storage, status_file, jobs, dry_run, include_all, checkpoint)
+    if len(failed) != 0:
+        # Keep the checkpoint, so only the failed letters are tried again
+        checkpoint.close()
+        print('Run "pull --resume" to try the failed letters again.')
+        return
+    checkpoint.clear()
+
+
+def check_files(files, jobs=None):
+    """
+    Compile the letters as XSLT before anything is uploaded.
+
+    Returns True if all the letters compiled.
     """
-    components_configuration.pull(local_storage, status_file)
-    letters_configuration.pull(local_storage, status_file)
+    sys.stdout.write('Compiling {} file(s)... '.format(len(files)))
+    sys.stdout.flush()
+    errors = validate_files(files, jobs)
+    if len(errors) == 0:
+        sys.stdout.write('OK\n')
+        return True
+
+    sys.stdout.write(Fore.RED + '{} file(s) failed\n'.format(len(errors)) + Style.RESET_ALL)
+    for filename, error in sorted(errors.items()):
+        print('%sError: %s does not compile:%s' % (Fore.RED, filename, Style.RESET_ALL))
+        print(Fore.RED + error + Style.RESET_ALL)
+    return False
 
 
-def push(table, local_storage, status_file, files=None):
+def push(letters_configuration, components_configuration, local_storage, status_file, files=None, jobs=1):
     """
     Push local changes to Alma.
 
-    This will upload files that have been modified locally to Alma.
+    This will upload files that have been modified locally to Alma. All the files are
+    compiled as XSLT first, and nothing is uploaded if one of them fails to compile.
+
+    With `jobs` > 1, the letters are pushed by a pool of browser sessions, so one session
+    can open the next letter and check its remote checksum while Alma is still saving the
+    letter pushed by another. Results are reported, and the status file updated, in the
+    order of the files. Conflicts are only asked about when the pool has finished, so the
+    prompts don't get mixed up with its output, and the letters that should be overwritten
+    anyway are then pushed by the main session.
 
     Params:
-        table: TemplateConfigurationTable object
-        local_storage: LocalStorage object
-        status_file: StatusFile object
-        files: list of filenames. If None, all files that have changed will be pushed.
+        letters_configuration:    ConfigurationTable object for "Letters Configuration"
+        components_configuration: ConfigurationTable object for "Components Configuration"
+        local_storage:            LocalStorage object
+        status_file:              StatusFile object
+        files:                    list of filenames. If None, all files that have changed will be pushed.
+        jobs:                     Number of browser sessions to use
     """
+    from .retry import RetryFailed
+
     files = files or []
+    confirm = len(files) == 0
     if len(files) == 0:
         # If no files were specified, we will look for files that have changes.
-        for filename in table.filenames:
-            if local_storage.is_modified(filename):
-                files.append(filename)
+        files = local_storage.modified_files()
 
         if len(files) == 0:
             sys.stdout.write(
@@ -427,69 +609,280 @@ def push(table, local_storage, status_file, files=None):
         sys.stdout.write(
             Fore.GREEN + 'Found {} modified file(s):'.format(len(files)) + Style.RESET_ALL + '\n')
         for filename in files:
-            print(' - {}'.format(filename.replace('xsl/letters/', '')))
+            print(' - {}'.format(os.path.normpath(filename)))
 
+    if not check_files(files):
+        print('Aborting')
+        return
+
+    if confirm:
         msg = 'Push the file(s) to Alma? '
         if input("%s (y/N) " % msg).lower() != 'y':
             print('Aborting')
             return
 
-    count_pushed = 0
+    letters = {}  # normalized filename -> (table, letter_info)
+    for table in (components_configuration, letters_configuration):
+        table.open()
+        table.read()
+        table.started = time.time()
+        for letter_info in table.letter_infos:
+            letters[os.path.normpath(letter_info.get_filename())] = (table, letter_info)
+
+    items = []  # (progress, table, letter_info, local content, checksum in status.json)
     for idx, filename in enumerate(files):
         progress = '%d/%d' % ((idx + 1), len(files))
-        if filename not in table.filenames:
-            table.print_letter_status(filename, Fore.RED + 'File not found' + Style.RESET_ALL, progress, True)
+        if os.path.normpath(filename) not in letters:
+            letters_configuration.print_letter_status(
+                filename, Fore.RED + 'File not found' + Style.RESET_ALL, progress, True)
             continue
+        table, letter_info = letters[os.path.normpath(filename)]
+        filename = letter_info.get_filename()
+        items.append((progress, table, letter_info, local_storage.get_content(filename),
+                      status_file.checksum(filename)))
+
+    count_pushed = [0]
+
+    def ask_overwrite(item):
+        answers = {}  # remote checksum -> answer, so a retried push doesn't ask again
+
+        def overwrite(remote_content):
+            if remote_content.sha1 not in answers:
+                msg = 'The remote version has changed. Overwrite remote version?'
+                answers[remote_content.sha1] = resolve_conflict(item[2].get_filename(), item[3], remote_content, msg)
+            return answers[remote_content.sha1]
+        return overwrite
+
+    def report(item, result, conflicts=None):
+        """Print the result of a letter, and update the status file if it was pushed."""
+        progress, table, letter_info, local_content, old_sha1 = item
+        filename = letter_info.get_filename()
+        if isinstance(result, RetryFailed):
+            table.print_letter_status(filename, Fore.RED + 'failed, skipping ({})'.format(result) + Style.RESET_ALL,
+                                      progress, True)
+            return
+        pushed, remote_content = result
+        if not pushed:
+            local_storage.store_remote(filename, remote_content)
+            if conflicts is not None:
+                conflicts.append((item, remote_content))
+                table.print_letter_status(filename, 'remote version has changed', progress, True)
+                return
+            table.print_letter_status(filename, 'skipped', progress, True)
+            return
 
-        table.print_letter_status(filename, 'pushing', progress)
-        old_sha1 = status_file.checksum(filename)
-
-        local_content = local_storage.get_content(filename)
-        remote_content = table.open_letter(filename)
-
-        # Read text area content
-        if remote_content.sha1 != old_sha1:
-            msg = 'The remote version has changed. Overwrite remote version?'
-            if not resolve_conflict(filename, local_content, remote_content, msg):
-                table.print_letter_status(filename, 'skipped', progress, True)
-
-                # Go back
-                table.close_letter()
-
-                # Skip to next letter
-                continue
-
-        table.put_contents(filename, local_content)
-        count_pushed += 1
+        count_pushed[0] += 1
         msg = 'updated from {} to {}'.format(
-            old_sha1[0:7], local_content.sha1[0:7])
+            (old_sha1 or 'nothing')[0:7], local_content.sha1[0:7])
         table.print_letter_status(filename, msg, progress, True)
 
         # Update the status file
         status_file.set_checksum(filename, local_content.sha1)
         status_file.set_modified(filename)
+        status_file.set_default_base_checksum(filename, status_file.default_checksum(filename))
+        local_storage.store_remote(filename, local_content)
 
+    def push_one(item, expected_sha1):
+        progress, table, letter_info, local_content, old_sha1 = item
+        table.print_letter_status(letter_info.get_filename(), 'pushing', progress)
+        try:
+            result = table.push_letter(letter_info, local_content, expected_sha1, ask_overwrite(item))
+        except RetryFailed as e:
+            result = e
+        report(item, result)
+
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        for item in items:
+            push_one(item, item[4])
+    else:
+        conflicts = []  # (item, remote content) of the letters changed in Alma
+        pool = WorkerPool(letters_configuration.worker, jobs)
+        sys.stdout.write('Starting {} additional browser session(s)...\n'.format(jobs - 1))
+        pool.connect()
+        try:
+            def make_task(worker):
+                tables = {}
+
+                def task(item):
+                    progress, table, letter_info, local_content, old_sha1 = item
+                    if table.pagename not in tables:
+                        tables[table.pagename] = table.child(worker)
+                    try:
+                        # Conflicts are handed back to the main thread, which asks about them at the end
+                        return tables[table.pagename].push_letter(letter_info, local_content, old_sha1)
+                    except RetryFailed as e:
+                        return e
+                return task
+
+            # Results arrive in the order they complete, and are reported in the order of the files
+            results = {}
+            next_item = 0
+            try:
+                for item, result, seconds in pool.imap(make_task, items, key=lambda x: x[2].unique_name):
+                    results[item[2].unique_name] = result
+                    while next_item < len(items) and items[next_item][2].unique_name in results:
+                        report(items[next_item], results.pop(items[next_item][2].unique_name), conflicts)
+                        next_item += 1
+            finally:
+                # If the pool failed, the letters pushed after the one still in progress must be recorded too
+                for item in items[next_item:]:
+                    if item[2].unique_name in results:
+                        report(item, results.pop(item[2].unique_name))
+        finally:
+            pool.close()
+
+        for item, remote_content in conflicts:
+            progress, table, letter_info, local_content, old_sha1 = item
+            if ask_overwrite(item)(remote_content):
+                push_one(item, remote_content.sha1)
+            else:
+                table.print_letter_status(letter_info.get_filename(), 'skipped', progress, True)
+
+    status_file.save()
     sys.stdout.write(
-        Fore.GREEN + 'Pushed {} file(s)\n'.format(count_pushed) + Style.RESET_ALL)
+        Fore.GREEN + 'Pushed {} file(s)\n'.format(count_pushed[0]) + Style.RESET_ALL)
 
 
-def test(testpage, files, languages):
+def status(local_storage):
+    """
+    Show how the working tree differs from status.json.
+
+    This only looks at local files, so it does not need a browser.
+
+    Params:
+        local_storage: LocalStorage object
+    """
+    changes = local_storage.status()
+    labels = [
+        ('modified', Fore.YELLOW, 'Modified (not pushed yet)'),
+        ('untracked', Fore.GREEN, 'Untracked (not in status.json)'),
+        ('missing', Fore.RED, 'Missing (in status.json, but not found locally)'),
+        ('default-drifted', Fore.CYAN, 'Default letter updated since last pull or push'),
+    ]
+    if not any(changes.values()):
+        print(Fore.GREEN + 'No local changes.' + Style.RESET_ALL)
+        return
+
+    for key, color, label in labels:
+        if len(changes[key]) == 0:
+            continue
+        print('{}{}: {}{}'.format(color, label, len(changes[key]), Style.RESET_ALL))
+        for filename in changes[key]:
+            print(' - {}'.format(filename))
+
+
+def diff(local_storage, files=None, defaults=False, xml=False, stat=False, jobs=None):
+    """
+    Show the changes in the local letters, compared with Alma or with the default letters.
+
+    The comparison is with the copies of the letters kept from the last pull or push, or
+    with the `defaults` folder, so it does not need a browser. All the letters are diffed
+    in one batch, in parallel.
+
+    Params:
+        local_storage: LocalStorage object
+        files: list of filenames. If None, the modified files (or, with `defaults`, all the
+            letters that have a default version) are compared.
+        defaults: compare with the default letters instead of the versions in Alma
+        xml: compare the canonical XML forms, ignoring attribute order and indentation
+        stat: only print the number of added and removed lines per file
+        jobs: number of processes to use. Defaults to the number of CPUs.
+    """
+    status_file = local_storage.status_file
+    if not files:
+        if defaults:
+            files = sorted(filename for filename in status_file.letters
+                           if status_file.default_checksum(filename) is not None)
+        else:
+            files = local_storage.modified_files()
+
+    pairs = []
+    for filename in files:
+        if defaults:
+            other = os.path.join('defaults', os.path.normpath(filename))
+        else:
+            other = local_storage.remote_filename(filename)
+        if not os.path.isfile(filename):
+            print(Fore.RED + 'File not found: {}'.format(filename) + Style.RESET_ALL)
+        elif not os.path.isfile(other):
+            hint = 'run "defaults" first' if defaults else 'pull or push it first'
+            print(Fore.YELLOW + 'No {} version of {}, {}'.format(
+                'default' if defaults else 'cached Alma', filename, hint) + Style.RESET_ALL)
+        else:
+            pairs.append((other, filename))
+
+    count = 0
+    for (other, filename), lines in zip(pairs, diff_files(pairs, xml, jobs)):
+        if len(lines) == 0:
+            continue
+        count += 1
+        if stat:
+            added = len([line for line in lines[2:] if line.startswith('+')])
+            removed = len([line for line in lines[2:] if line.startswith('-')])
+            print('{:60} {}+{}{} {}-{}{}'.format(os.path.normpath(filename), Fore.GREEN, added, Fore.RESET,
+                                                 Fore.RED, removed, Fore.RESET))
+            continue
+        for line in color_diff(lines):
+            print(line)
+        print()
+
+    print('{} of {} file(s) differ'.format(count, len(pairs)))
+
+
+def test(testpage, files, languages, jobs=1, update_golden=False):
     """
     Test the output of an XML file by running a "notification template" test in Alma.
 
+    The outputs are compared with the golden versions in test-data/golden, and only
+    the outputs that changed are reported.
+
     Params:
-        worker: worker object
+        testpage: TestPage object
         files: list of XML files in test-data to use
         languages: list og languages to test
+        jobs: number of browser sessions to spread the files over
+        update_golden: replace the golden versions with the new outputs
     """
-    testpage.open()
+    writer = CaptureWriter(os.path.join(os.path.dirname(files[0]), 'golden'), update_golden)
+    try:
+        if jobs <= 1:
+            testpage.test_many(files, languages, writer)
+            return
+
+        pool = WorkerPool(testpage.worker, jobs)
+        sys.stdout.write('Starting {} additional browser session(s)...\n'.format(jobs - 1))
+        pool.connect()
+        try:
+            def make_task(worker):
+                page = testpage if worker is testpage.worker else type(testpage)(worker)
+                return lambda filename: page.test_many([filename], languages, writer)
+
+            for _ in pool.imap(make_task, files):
+                pass
+        finally:
+            pool.close()
+    finally:
+        writer.close()
+
 
-    for n, filename in enumerate(files):
-        for m, lang in enumerate(languages):
-            cur = n * len(languages) + m + 1
-            tot = len(languages) * len(files)
-            print('[%d/%d] Testing "%s" using language "%s"' % (cur, tot,
-                                                                os.path.basename(filename),
-                                                                lang))
+def test_local(files, languages, xsl=None):
+    """
+    Test the output of XML files by rendering them with the local letters, without Alma.
 
-            testpage.test(filename, lang)
+    Params:
+        files: list of XML files in test-data to use
+        languages: list of languages to test
+        xsl: letter to use. If None, the letter is found from the letter name in each XML file.
+    """
+    tot = len(languages) * len(files)
+    failed = 0
+    for cur, (filename, lang, html_path, error) in enumerate(render_files(files, languages, xsl)):
+        print('[%d/%d] Rendered "%s" using language "%s"' % (cur + 1, tot, os.path.basename(filename), lang))
+        if error is None:
+            print('Saved output: %s' % html_path)
+        else:
+            failed += 1
+            print('%sERROR: %s%s' % (Fore.RED, error, Fore.RESET))
+    if failed != 0:
+        print('%s%d of %d renderings failed%s' % (Fore.RED, failed, tot, Fore.RESET))
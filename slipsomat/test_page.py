@@ -0,0 +1,288 @@
+# encoding=utf8
+from __future__ import print_function
+
+import os
+import tempfile
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.remote.errorhandler import NoSuchElementException, TimeoutException
+from colorama import Fore
+
+from .capture import CaptureWriter
+from .retry import RetryFailed
+from .render import set_preferred_language, output_path
+
+
+class TestPage(object):
+    """Interface to "Notification Template" in Alma."""
+
+    # Seconds without a new window after which the first test run is taken to have opened all its windows
+    window_settle_time = 2
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.languages = None  # language code -> name, read once
+        self.current_language = None
+        self.uploaded = None  # contents of the file last uploaded
+        self.windows_per_run = None  # number of windows Alma opens for a test run, learned from the first run
+        self.main_window = None  # the window with the "Notification Template" page
+
+    def open(self):
+        try:
+            self.worker.first(By.ID, 'cbuttonupload')
+        except NoSuchElementException:
+            def walk():
+                self.worker.get('/mng/action/home.do')
+
+                # Open Alma configuration
+                self.worker.wait_for_and_click(By.CSS_SELECTOR, '#ALMA_MENU_TOP_NAV_configuration')
+                self.worker.click(By.XPATH, '//*[@href="#CONF_MENU6"]')  # text() = "General"
+                self.worker.click(By.XPATH, '//*[text() = "Notification Template"]')
+
+            with self.worker.step('test: open page'):
+                self.worker.navigate('Notification Template', By.ID, 'cbuttonupload', walk)
+            self.current_language = None
+            self.uploaded = None
+
+    def get_languages(self):
+        """Return a dict of language code -> language name, read from the page only once."""
+        if self.languages is None:
+            options = self.worker.execute_script(
+                'return Array.prototype.map.call(arguments[0].options, function (opt) {'
+                '    return [opt.value, opt.innerText];'
+                '});',
+                self.worker.first(By.ID, 'pageBeanuserPreferredLanguage_hiddenSelect'))
+            self.languages = {value: text for value, text in options}
+        return self.languages
+
+    def set_language(self, lang):
+        if lang == self.current_language:
+            return
+        with self.worker.step('test: set language'):
+            element = self.worker.first(By.ID, 'pageBeanuserPreferredLanguage')
+            element.click()
+
+            element = self.worker.wait.until(EC.element_to_be_clickable(
+                (By.XPATH,
+                 '//ul[@id="pageBeanuserPreferredLanguage_hiddenSelect_list"]/li[@title="%s"]/a'
+                 % self.get_languages()[lang])
+            ))
+            element.click()
+        self.current_language = lang
+
+    def upload(self, text):
+        """
+        Upload an XML file, unless the same contents were the last ones uploaded.
+
+        Since the preferred language is written into the file, this only saves an upload
+        when a file without a `preferred_language` element is tested in several languages.
+        """
+        if text == self.uploaded:
+            return
+        with self.worker.step('test: upload'):
+            tmp = tempfile.NamedTemporaryFile('wb')
+            tmp.write(text.encode('utf-8'))
+            tmp.flush()
+
+            file_field = self.worker.first(By.ID, 'pageBeannewFormFile')
+            file_field.send_keys(tmp.name)
+
+            upload_btn = self.worker.first(By.ID, 'cbuttonupload')
+            upload_btn.click()
+
+            self.worker.wait_for(By.CSS_SELECTOR, '.infoErrorMessages')
+            tmp.close()
+        self.uploaded = text
+
+    def run(self, filename, lang):
+        """
+        Start a test run, without waiting for the output.
+
+        Returns the handles of the windows opened by the run, or None if the test could not be started.
+        """
+        if not os.path.isfile(filename):
+            print('%sERROR: File not found: %s%s' % (Fore.RED, filename, Fore.RESET))
+            return None
+        if lang not in self.get_languages():
+            print('%sERROR: Language not found: %s%s' % (Fore.RED, lang, Fore.RESET))
+            return None
+
+        with open(filename, 'rb') as fp:
+            text = set_preferred_language(fp.read().decode('utf-8'), lang)
+
+        self.set_language(lang)
+        self.upload(text)
+
+        run_btn = self.worker.wait.until(
+            EC.element_to_be_clickable(
+                (By.ID, 'PAGE_BUTTONS_admconfigure_notification_templaterun_xsl'))
+        )
+
+        old_handles = self.worker.driver.window_handles
+        with self.worker.step('test: run xsl'):
+            run_btn.click()
+            return self.wait_for_run_windows(old_handles)
+
+    def wait_for_run_windows(self, old_handles):
+        """
+        Wait for all the windows of a test run to open, and return their handles.
+
+        Alma may open the windows of a run one after another, and a window opened late
+        would otherwise be taken for one of the next run. So for the first run we wait
+        until no more windows open, and for the next runs until as many have opened.
+        """
+        if self.windows_per_run is not None:
+            return self.worker.wait_for_new_window(old_handles, count=self.windows_per_run)
+
+        handles = self.worker.wait_for_new_window(old_handles)
+        while True:
+            try:
+                handles += self.worker.wait_for_new_window(old_handles + handles, self.window_settle_time)
+            except TimeoutException:
+                break
+        self.windows_per_run = len(handles)
+        return handles
+
+    def find_result_window(self, handles):
+        """
+        Wait for the output of a test run to load in one of its windows, and switch to it.
+
+        Alma may open more than one window, one of which shows the XSL source,
+        so we wait for a window that has finished loading something else.
+        """
+        def result_window(driver):
+            for handle in handles:
+                driver.switch_to.window(handle)
+                if driver.execute_script('return document.readyState') != 'complete':
+                    continue
+                if not driver.page_source.startswith('<xsl'):
+                    return handle
+            return False
+
+        return self.worker.wait_until(result_window)
+
+    def collect(self, filename, lang, handles, writer):
+        """Capture the output and a full-page screenshot of a test run, and close its windows."""
+        png_path = output_path(filename, lang, 'png')
+        html_path = output_path(filename, lang, 'html')
+        driver = self.worker.driver
+
+        with self.worker.step('test: wait for output'):
+            self.find_result_window(handles)
+
+        # GitHub: #30  -> if 'beanContentParam=htmlContent' in self.worker.driver.current_url:
+        with self.worker.step('test: capture output'):
+            html = driver.page_source
+            height = driver.execute_script(
+                'return Math.max(document.body.scrollHeight, document.documentElement.scrollHeight);')
+            driver.set_window_size(self.worker.config.get('screenshot', 'width'), max(int(height), 200))
+            png = driver.get_screenshot_as_png()
+
+        # Writing and comparing with the golden set is done in the background
+        writer.submit(html_path, png_path, html, png)
+
+        self.close_windows(handles)
+
+    def close_windows(self, handles):
+        driver = self.worker.driver
+        open_handles = driver.window_handles
+        for handle in handles:
+            if handle in open_handles:
+                driver.switch_to.window(handle)
+                driver.close()
+
+    def show_main_window(self):
+        """Switch back to the window with the test page, and open the page if needed."""
+        driver = self.worker.driver
+        if self.main_window not in driver.window_handles:
+            # The browser was restarted
+            self.main_window = driver.window_handles[0]
+        driver.switch_to.window(self.main_window)
+        self.open()
+
+    def start(self, filename, lang):
+        """Start a test run, retrying failures according to the worker's retry policy."""
+        return self.worker.retry(lambda: self.run(filename, lang), reset=self.show_main_window)
+
+    def finish(self, filename, lang, handles, writer):
+        """
+        Collect the output of a test run, retrying failures according to the worker's retry policy.
+
+        If the output could not be collected, or the windows of the run are gone (for
+        instance because the browser was restarted for another run), the test is run again.
+        """
+        run = [handles]
+
+        def collect():
+            if run[0] is None or not set(run[0]) <= set(self.worker.driver.window_handles):
+                self.show_main_window()
+                run[0] = self.run(filename, lang)
+                if run[0] is None:
+                    return
+            self.collect(filename, lang, run[0], writer)
+
+        def reset():
+            if run[0] is not None:
+                self.close_windows(run[0])
+                run[0] = None
+            self.show_main_window()
+
+        self.worker.retry(collect, reset=reset)
+
+    def test_many(self, files, languages, writer, in_flight=None):
+        """
+        Test all combinations of files and languages.
+
+        Several test runs are kept in flight at once: the next run is started while the
+        output windows of the previous ones are still loading. The language list is only
+        read once. Failures are retried according to the worker's retry policy, and a
+        test that still fails is reported and skipped.
+
+        Params:
+            files: list of XML files to test
+            languages: list of language codes
+            writer: CaptureWriter the outputs are handed to
+            in_flight: max number of runs waiting for output at the same time
+        """
+        if in_flight is None:
+            in_flight = int(self.worker.config.get('test', 'max_in_flight'))
+
+        self.open()
+        self.main_window = self.worker.driver.current_window_handle
+        pending = []
+        tot = len(languages) * len(files)
+
+        def collect_oldest():
+            filename, lang, handles = pending.pop(0)
+            try:
+                self.finish(filename, lang, handles, writer)
+            except RetryFailed as e:
+                print('%sERROR: Testing "%s" using language "%s" failed: %s%s' % (
+                    Fore.RED, os.path.basename(filename), lang, e, Fore.RESET))
+            self.show_main_window()
+
+        for n, filename in enumerate(files):
+            for m, lang in enumerate(languages):
+                cur = n * len(languages) + m + 1
+                print('[%d/%d] Testing "%s" using language "%s"' % (cur, tot, os.path.basename(filename), lang))
+                try:
+                    handles = self.start(filename, lang)
+                except RetryFailed as e:
+                    print('%sERROR: Could not start the test: %s%s' % (Fore.RED, e, Fore.RESET))
+                    self.show_main_window()
+                    continue
+                if handles is not None:
+                    pending.append((filename, lang, handles))
+                if len(pending) >= in_flight:
+                    collect_oldest()
+
+        while len(pending) != 0:
+            collect_oldest()
+
+    def test(self, filename, lang):
+        writer = CaptureWriter(os.path.join(os.path.dirname(filename), 'golden'))
+        try:
+            self.test_many([filename], [lang], writer, 1)
+        finally:
+            writer.close()
@@ -0,0 +1,197 @@
+# encoding=utf8
+from __future__ import print_function
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+def percentile(values, p):
+    """Return the p-th percentile (0-100) of a list of numbers, by nearest rank."""
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    k = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(0, min(len(values) - 1, k))]
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return '{}s'.format(seconds)
+    if seconds < 3600:
+        return '{}m{:02d}s'.format(seconds // 60, seconds % 60)
+    return '{}h{:02d}m'.format(seconds // 3600, seconds % 3600 // 60)
+
+
+class Span(object):
+    """A named, timed step, possibly nested inside another step."""
+
+    __slots__ = ('name', 'start', 'duration', 'depth', 'parent', 'thread', 'args', 'roundtrips')
+
+    def __init__(self, name, start, depth, parent, thread, args):
+        self.name = name
+        self.start = start
+        self.duration = None
+        self.depth = depth
+        self.parent = parent
+        self.thread = thread
+        self.args = args
+        self.roundtrips = 0  # WebDriver commands sent while the span was open, including nested spans
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration': round(self.duration, 6),
+            'depth': self.depth,
+            'parent': self.parent,
+            'thread': self.thread,
+            'roundtrips': self.roundtrips,
+            'args': self.args,
+        }
+
+
+class Tracer(object):
+    """
+    Records nested, timed spans and counts the WebDriver round trips made inside them.
+
+    Spans are opened with `span(name, **args)` and nest per thread, so the workers of a
+    WorkerPool can share one tracer. Every command sent by an instrumented driver (see
+    `instrument`) is counted in all the spans open in the sending thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.t0 = time.time()
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name, **args):
+        stack = self.stack()
+        parent = stack[-1].name if len(stack) != 0 else None
+        span = Span(name, time.time(), len(stack), parent, threading.current_thread().name, args)
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span.duration = time.time() - span.start
+            if len(stack) != 0:
+                stack[-1].roundtrips += span.roundtrips
+            with self.lock:
+                self.spans.append(span)
+
+    def count_roundtrip(self):
+        stack = self.stack()
+        if len(stack) != 0:
+            stack[-1].roundtrips += 1
+
+    def instrument(self, driver):
+        """Count every command sent by a WebDriver (including through its WebElements)."""
+        execute = driver.execute
+
+        @wraps(execute)
+        def counted_execute(*args, **kwargs):
+            self.count_roundtrip()
+            return execute(*args, **kwargs)
+        driver.execute = counted_execute
+        return driver
+
+    def durations(self):
+        """Return a dict mapping span names to lists of `(duration, roundtrips)`."""
+        result = {}
+        with self.lock:
+            for span in self.spans:
+                result.setdefault(span.name, []).append((span.duration, span.roundtrips))
+        return result
+
+    def print_stats(self):
+        """Print the count, total, p50 and p95 of each step, slowest total first, and the letter throughput."""
+        rows = sorted(self.durations().items(), key=lambda x: sum(d for d, r in x[1]), reverse=True)
+        if len(rows) == 0:
+            print('Nothing recorded yet')
+            return
+        print('{:40} {:>6} {:>9} {:>8} {:>8} {:>10}'.format(
+            'Step', 'Count', 'Total (s)', 'p50 (s)', 'p95 (s)', 'Roundtrips'))
+        for name, values in rows:
+            durations = [d for d, r in values]
+            roundtrips = sum(r for d, r in values) / float(len(values))
+            print('{:40} {:6d} {:9.2f} {:8.3f} {:8.3f} {:10.1f}'.format(
+                name[:40], len(values), sum(durations), percentile(durations, 50), percentile(durations, 95),
+                roundtrips))
+
+        with self.lock:
+            letters = [span for span in self.spans if span.name == 'letter']
+        if len(letters) != 0:
+            elapsed = max(s.start + s.duration for s in letters) - min(s.start for s in letters)
+            print('\n{} letter(s) in {}, {:.1f} letters/min, {:.1f} WebDriver round trips per letter'.format(
+                len(letters), format_duration(elapsed), len(letters) / max(elapsed, 0.001) * 60,
+                sum(s.roundtrips for s in letters) / float(len(letters))))
+
+    def export(self, filename, format=None):
+        """
+        Write the recorded spans to a file.
+
+        Params:
+            filename: Name of the file to write
+            format: 'jsonl' for one span per line, or 'chrome' for the Trace Event Format
+                read by chrome://tracing and Perfetto. By default, the format is chosen
+                from the file extension (.json is chrome, anything else jsonl).
+        """
+        if format is None:
+            format = 'chrome' if os.path.splitext(filename)[1] == '.json' else 'jsonl'
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+
+        with open(filename, 'w') as fp:
+            if format == 'jsonl':
+                for span in spans:
+                    fp.write(json.dumps(span.as_dict()) + '\n')
+            elif format == 'chrome':
+                threads = {}
+                events = []
+                for span in spans:
+                    tid = threads.setdefault(span.thread, len(threads) + 1)
+                    args = dict(span.args, roundtrips=span.roundtrips)
+                    events.append({
+                        'name': span.name,
+                        'ph': 'X',
+                        'ts': int((span.start - self.t0) * 1e6),
+                        'dur': int(span.duration * 1e6),
+                        'pid': 1,
+                        'tid': tid,
+                        'args': args,
+                    })
+                for thread, tid in threads.items():
+                    events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid,
+                                   'args': {'name': thread}})
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+            else:
+                raise ValueError('Unknown trace format: {}'.format(format))
+        return len(spans)
+
+
+def traced(name):
+    """Decorator for Worker methods, recording each call as a span."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.tracer.span(name):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,51 @@
+# encoding=utf8
+from __future__ import print_function
+
+import json
+import os
+import threading
+
+
+class UrlCache(object):
+    """
+    The URLs of the Alma pages slipsomat has navigated to, so they can be opened directly.
+
+    Finding a page through the Alma menus takes several round trips, and opening a letter
+    from its table throws the table away. Once a page has been found, its URL is stored
+    here under a name like 'Letters Configuration' or 'letter:<unique name>', and the next
+    time the page is opened with a single `get`. URLs are kept per Alma URL and institution,
+    since each instance has its own. The file is shared by the workers of a WorkerPool.
+    """
+
+    filename = '.slipsomat_urls.json'
+
+    def __init__(self, base_url, institution):
+        self.key = '{}|{}'.format(base_url, institution)
+        self.lock = threading.Lock()
+        self.data = {}
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename) as fp:
+                    self.data = json.load(fp)
+            except ValueError:
+                self.data = {}
+        self.urls = self.data.setdefault(self.key, {})
+
+    def get(self, name):
+        return self.urls.get(name)
+
+    def set(self, name, url):
+        with self.lock:
+            if self.urls.get(name) == url:
+                return
+            self.urls[name] = url
+            self.save()
+
+    def forget(self, name):
+        with self.lock:
+            if self.urls.pop(name, None) is not None:
+                self.save()
+
+    def save(self):
+        with open(self.filename, 'w') as fp:
+            json.dump(self.data, fp, sort_keys=True, indent=2)
@@ -0,0 +1,79 @@
+# encoding=utf8
+from __future__ import print_function
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+XSL_NAMESPACE = 'http://www.w3.org/1999/XSL/Transform'
+
+
+def check_includes(filename, tree):
+    """Return an error message if an xsl:include or xsl:import refers to a file missing from the local tree."""
+    basedir = os.path.dirname(filename)
+    for tag in ('include', 'import'):
+        for elem in tree.iter('{%s}%s' % (XSL_NAMESPACE, tag)):
+            href = elem.get('href', '')
+            if '://' not in href and not os.path.isfile(os.path.join(basedir, href)):
+                return 'Included file not found: {}'.format(href)
+    return None
+
+
+def compile_xslt(filename):
+    """
+    Compile a letter as XSLT, with includes resolved from the local tree.
+
+    Returns None if the letter compiles, otherwise an error message, also if the file
+    cannot be read. If lxml is not installed, only well-formedness and the presence of
+    included files are checked.
+    This function is run in worker processes by `validate_files`.
+    """
+    try:
+        from lxml import etree
+    except ImportError:
+        etree = None
+
+    if etree is None:
+        try:
+            tree = ElementTree.parse(filename)
+        except ElementTree.ParseError as e:
+            return str(e)
+        except (IOError, OSError) as e:
+            return 'Could not read the file: {}'.format(e)
+        return check_includes(filename, tree)
+
+    try:
+        tree = etree.parse(filename)
+    except etree.XMLSyntaxError as e:
+        return str(e)
+    except (IOError, OSError) as e:
+        return 'Could not read the file: {}'.format(e)
+    error = check_includes(filename, tree)
+    if error is not None:
+        return error
+    try:
+        etree.XSLT(tree)
+    except etree.XSLTParseError as e:
+        messages = [str(entry) for entry in e.error_log] or [str(e)]
+        return '\n'.join(messages)
+    return None
+
+
+def validate_files(filenames, jobs=None):
+    """
+    Compile the given letters in parallel.
+
+    Returns a dict mapping the filenames that failed to their error messages.
+
+    Params:
+        filenames: list of letter filenames
+        jobs: number of processes to use. Defaults to the number of CPUs.
+    """
+    if len(filenames) == 0:
+        return {}
+    if len(filenames) == 1:
+        errors = [compile_xslt(filenames[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            errors = list(executor.map(compile_xslt, filenames))
+    return {filename: error for filename, error in zip(filenames, errors) if error is not None}
@@ -1,49 +1,147 @@
 # encoding=utf8
 from __future__ import print_function
-from textwrap import dedent
-from io import StringIO
-import getpass
 import sys
 from selenium.webdriver.support.ui import Select
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.remote.errorhandler import NoSuchElementException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
 
-
-try:
-    from configparser import ConfigParser  # Python 3
-except Exception:
-    from ConfigParser import ConfigParser  # Python 2
+from .config import read_config, ask_password
+from .retry import RetryPolicy
+from .session_cache import SessionCache
+from .url_cache import UrlCache
+from .tracing import Tracer, traced
+
+
+# Browser settings implied by each value of the `profile` option in the [selenium] section.
+# Any of the settings can also be given explicitly in slipsomat.cfg to override the profile.
+BROWSER_PROFILES = {
+    'default': {
+        'headless': 'false',
+        'page_load_strategy': 'normal',
+        'block_images': 'false',
+        'block_fonts': 'false',
+        'block_analytics': 'false',
+        'disable_cache': 'false',
+        'disable_extensions': 'false',
+    },
+    'headless': {
+        'headless': 'true',
+        'page_load_strategy': 'normal',
+        'block_images': 'false',
+        'block_fonts': 'false',
+        'block_analytics': 'false',
+        'disable_cache': 'false',
+        'disable_extensions': 'true',
+    },
+    'fast': {
+        'headless': 'true',
+        'page_load_strategy': 'eager',
+        'block_images': 'true',
+        'block_fonts': 'true',
+        'block_analytics': 'true',
+        'disable_cache': 'true',
+        'disable_extensions': 'true',
+    },
+}
+
+FONT_URLS = ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot']
+ANALYTICS_URLS = ['*google-analytics.com*', '*googletagmanager.com*', '*pendo.io*', '*walkme.com*',
+                  '*hotjar.com*', '*newrelic.com*', '*nr-data.net*']
 
 
 class Worker(object):
     """This class is mostly about providing helper methods to work efficiently with Selenium."""
 
-    def __init__(self, cfg_file):
+    def __init__(self, cfg_file, config=None):
         """
         Construct a new Worker object.
 
         Params:
             cfg_file: Name of config file
+            config: An already parsed ConfigParser object. If given, cfg_file is not read.
         """
         self.driver = None
-        self.config = self.read_config(cfg_file)
+        self.config = config if config is not None else self.read_config(cfg_file)
+        self.tracer = Tracer()
         self.default_timeout = int(self.config.get('selenium', 'default_timeout'))
         self.instance = self.config.get('login', 'instance')
+        self.base_url = self.config.get('login', 'base_url') or \
+            'https://{}.alma.exlibrisgroup.com'.format(self.instance)
+        self.transport = None  # HttpTransport, if enabled
+        self.use_session_cache = True
+        self.retry_policy = RetryPolicy(self.config)
+        self.record_file = self.config.get('selenium', 'record')  # session file to record commands to
+        self.recorder = None
+        self.replay_connection = None
+        self.urls = self.url_cache()  # UrlCache, if enabled
+        self.cached_url_timeout = float(self.config.get('navigation', 'cached_url_timeout'))
+
+        # Letters with a cached URL are opened in a tab of their own, so the table stays loaded.
+        # The tab is shared by the tables using this worker, see ConfigurationTable.open_letter_in_tab
+        self.table_window = None
+        self.letter_window = None
+        self.in_letter_window = False
 
     def waiter(self, timeout=None):
         if timeout is None:
             timeout = self.default_timeout
         return WebDriverWait(self.driver, timeout)
 
+    def step(self, name, **args):
+        """Context manager recording a named navigation step as a span in the trace."""
+        return self.tracer.span(name, **args)
+
+    @traced('worker.execute_script')
+    def execute_script(self, script, *args):
+        return self.driver.execute_script(script, *args)
+
+    @traced('worker.wait_until')
+    def wait_until(self, condition, timeout=None):
+        """Wait until `condition(driver)` returns something truthy, and return that."""
+        wait = self.wait if timeout is None else self.waiter(timeout)
+        return wait.until(condition)
+
+    def wait_for_new_window(self, old_handles, timeout=None, count=1):
+        """Wait for `count` or more windows to open in addition to `old_handles`, and return their handles."""
+        def new_windows(driver):
+            handles = [handle for handle in driver.window_handles if handle not in old_handles]
+            return handles if len(handles) >= count else False
+        return self.wait_until(new_windows, timeout)
+
+    def wait_for_content(self, by, by_value, timeout=None):
+        """
+        Wait for an element to be populated, and return it.
+
+        The element is considered populated when it has a non-empty text or value,
+        or when the page has finished loading (so an element that really is empty
+        does not cause a timeout).
+        """
+        def populated(driver):
+            elems = driver.find_elements(by, by_value)
+            if len(elems) == 0:
+                return False
+            if elems[0].text != '' or elems[0].get_attribute('value'):
+                return elems[0]
+            if driver.execute_script('return document.readyState') == 'complete':
+                return elems[0]
+            return False
+        return self.wait_until(populated, timeout)
+
+    def wait_for_staleness(self, element, timeout=None):
+        """Wait for an element to be removed from the DOM, e.g. because a new page was loaded."""
+        return self.wait_until(EC.staleness_of(element), timeout)
+
     def first(self, by, by_value):
         return self.driver.find_element(by, by_value)
 
     def all(self, by, by_value):
         return self.driver.find_elements(by, by_value)
 
+    @traced('worker.wait_for')
     def wait_for(self, by, by_value, timeout=None):
         wait = self.wait if timeout is None else self.waiter(timeout)
         return wait.until(EC.visibility_of_element_located((by, by_value)))
@@ -57,11 +155,13 @@ class Worker(object):
         element.send_keys(text)
         return element
 
+    @traced('worker.click')
     def click(self, by, by_value):
         element = self.wait.until(EC.element_to_be_clickable((by, by_value)))
         element.click()
         return element
 
+    @traced('worker.scroll_into_view_and_click')
     def scroll_into_view_and_click(self, value, by=By.ID):
         element = self.driver.find_element(by, value)
         self.driver.execute_script('arguments[0].scrollIntoView();', element)
@@ -73,11 +173,39 @@ class Worker(object):
         except WebDriverException:
             element.send_keys(Keys.RETURN)  # works in some edge cases
 
+    def clone(self):
+        """Return a new, not yet connected, Worker sharing this worker's configuration."""
+        worker = Worker(None, config=self.config)
+        # Clones log in with their own Alma session, to not interfere with this one
+        worker.use_session_cache = False
+        worker.tracer = self.tracer
+        worker.urls = self.urls
+        # Only the main session is recorded, a replay could not tell the sessions apart
+        worker.record_file = ''
+        return worker
+
+    def close_letter_window(self):
+        """Close the tab used for letters, and switch back to the table."""
+        if self.letter_window is None:
+            return
+        try:
+            self.driver.switch_to.window(self.letter_window)
+            self.driver.close()
+            self.driver.switch_to.window(self.table_window)
+        except Exception:
+            pass  # the browser is gone already
+        self.table_window = None
+        self.letter_window = None
+        self.in_letter_window = False
+
     def close(self):
+        self.close_letter_window()
         try:
             self.driver.close()
         except Exception as e:
             print("\nException closing driver:", e)
+        if self.recorder is not None:
+            self.recorder.close()
 
     def restart(self):
         if "config" in vars(self):  # check for test mode
@@ -85,73 +213,234 @@ class Worker(object):
             self._template_table = None
             self.connect()
 
+    def retry(self, fn, reset=None, on_retry=None):
+        """Call `fn()`, retrying on timeouts, stale elements, crashes and logouts. See `RetryPolicy.call`."""
+        return self.retry_policy.call(self, fn, reset, on_retry)
+
+    def is_logged_out(self):
+        """Return True if Alma (or the identity provider) is showing a login page."""
+        url = self.driver.current_url
+        return not url.startswith(self.base_url) or '/login' in url
+
+    def relogin(self):
+        """Log in again in the same browser, after the Alma session has expired."""
+        cache = self.session_cache()
+        if cache is not None:
+            cache.clear()
+        self.driver.delete_all_cookies()
+        self.login()
+        self.save_session()
+        if self.transport is not None:
+            self.transport.sync_cookies()
+
     @staticmethod
     def read_config(cfg_file):
-        config = ConfigParser()
-        defaults = StringIO(dedent(
-            u"""[login]
-            domain=
-
-            [selenium]
-            browser=firefox
-            default_timeout=20
-
-            [window]
-            width=1300
-            height=800
-
-            [screenshot]
-            width=1000
-            """
-        ))
-        config.read_file(defaults)
-        config.read(cfg_file)
-
-        if config.get('login', 'username') == '':
-            raise RuntimeError('No username configured in slipsomat.cfg')
-
-        if config.get('login', 'password') == '':
-            config.set('login', 'password', getpass.getpass())
-
+        config = read_config(cfg_file)
+        ask_password(config)
         return config
 
+    def browser_setting(self, name):
+        """Return a boolean or string browser setting from [selenium], falling back to the profile."""
+        if self.config.has_option('selenium', name):
+            value = self.config.get('selenium', name)
+        else:
+            profile = self.config.get('selenium', 'profile')
+            if profile not in BROWSER_PROFILES:
+                raise RuntimeError('Unknown browser profile: {}'.format(profile))
+            value = BROWSER_PROFILES[profile][name]
+        if value.lower() in ('true', 'yes', 'on', '1'):
+            return True
+        if value.lower() in ('false', 'no', 'off', '0'):
+            return False
+        return value
+
+    def get_firefox_driver(self):
+        from selenium.webdriver import Firefox
+        from selenium.webdriver.firefox.options import Options
+
+        options = Options()
+        if self.browser_setting('headless'):
+            options.add_argument('-headless')
+        options.set_capability('pageLoadStrategy', self.browser_setting('page_load_strategy'))
+        if self.browser_setting('block_images'):
+            options.set_preference('permissions.default.image', 2)
+        if self.browser_setting('block_fonts'):
+            options.set_preference('browser.display.use_document_fonts', 0)
+            options.set_preference('gfx.downloadable_fonts.enabled', False)
+        if self.browser_setting('block_analytics'):
+            # Firefox has no URL blocklist, but tracking protection covers the common analytics services
+            options.set_preference('privacy.trackingprotection.enabled', True)
+        if self.browser_setting('disable_cache'):
+            options.set_preference('browser.cache.disk.enable', False)
+            options.set_preference('browser.cache.memory.enable', False)
+            options.set_preference('browser.cache.offline.enable', False)
+        if self.browser_setting('disable_extensions'):
+            options.set_preference('extensions.enabledScopes', 0)
+            options.set_preference('xpinstall.enabled', False)
+
+        return Firefox(options=options)
+
+    def get_chrome_driver(self):
+        from selenium.webdriver import Chrome
+        from selenium.webdriver.chrome.options import Options
+
+        options = Options()
+        if self.browser_setting('headless'):
+            options.add_argument('--headless')
+        options.set_capability('pageLoadStrategy', self.browser_setting('page_load_strategy'))
+        if self.browser_setting('block_images'):
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+        if self.browser_setting('disable_cache'):
+            options.add_argument('--disk-cache-size=1')
+            options.add_argument('--media-cache-size=1')
+        if self.browser_setting('disable_extensions'):
+            options.add_argument('--disable-extensions')
+            options.add_argument('--disable-component-extensions-with-background-pages')
+
+        driver = Chrome(options=options)
+
+        blocked_urls = []
+        if self.browser_setting('block_fonts'):
+            blocked_urls += FONT_URLS
+        if self.browser_setting('block_analytics'):
+            blocked_urls += ANALYTICS_URLS
+        if len(blocked_urls) != 0 or self.browser_setting('disable_cache'):
+            driver.execute_cdp_cmd('Network.enable', {})
+        if len(blocked_urls) != 0:
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_urls})
+        if self.browser_setting('disable_cache'):
+            # The small disk cache above still leaves the memory cache in use
+            driver.execute_cdp_cmd('Network.setCacheDisabled', {'cacheDisabled': True})
+
+        return driver
+
     def get_driver(self):
         # Start a new browser and return the WebDriver
 
         browser_name = self.config.get('selenium', 'browser')
 
         if browser_name == 'firefox':
-            from selenium.webdriver import Firefox
-
-            return Firefox()
+            return self.get_firefox_driver()
 
         if browser_name == 'chrome':
-            from selenium.webdriver import Chrome
-
-            return Chrome()
+            return self.get_chrome_driver()
 
         if browser_name == 'phantomjs':
             from selenium.webdriver import PhantomJS
 
             return PhantomJS()
 
-        # @TODO: Add chrome
+        if browser_name == 'replay':
+            from selenium.webdriver import Remote
+            from selenium.webdriver.firefox.options import Options
+            from .recording import ReplayConnection
+
+            # Kept across restarts, so a restarted browser continues with the next recorded session
+            if self.replay_connection is None:
+                self.replay_connection = ReplayConnection(self.config.get('selenium', 'replay'),
+                                                          float(self.config.get('selenium', 'replay_speed')),
+                                                          self.secrets())
+            return Remote(command_executor=self.replay_connection, options=Options())
+
         raise RuntimeError('Unsupported/unknown browser')
 
+    def secrets(self):
+        """Return the strings that must not be written to recordings."""
+        return [self.config.get('login', 'password'), self.config.get('login', 'username')]
+
+    def is_replaying(self):
+        return self.config.get('selenium', 'browser') == 'replay'
+
+    def session_cache(self):
+        if not self.use_session_cache or not self.config.getboolean('session', 'cache'):
+            return None
+        if self.record_file or self.is_replaying():
+            # Recordings always start with a full login, so they replay the same way every time
+            return None
+        return SessionCache(self.base_url,
+                            self.config.get('login', 'institution'),
+                            self.config.get('login', 'username'),
+                            float(self.config.get('session', 'max_age_hours')) * 3600)
+
+    def url_cache(self):
+        if not self.config.getboolean('navigation', 'url_cache'):
+            return None
+        if self.record_file or self.is_replaying():
+            # A recording should not depend on which URLs happened to be cached
+            return None
+        return UrlCache(self.base_url, self.config.get('login', 'institution'))
+
+    def restore_session(self):
+        """Log in with cookies from a cached session. Returns False if there is none, or it has expired in Alma."""
+        cache = self.session_cache()
+        cookies = cache.load() if cache is not None else None
+        if cookies is None:
+            return False
+
+        sys.stdout.write('Restoring cached session...')
+        sys.stdout.flush()
+
+        # Cookies can only be added for the domain of the current page
+        self.get('/favicon.ico')
+        for cookie in cookies:
+            cookie = {k: v for k, v in cookie.items() if k in ('name', 'value', 'path', 'secure', 'expiry')}
+            try:
+                self.driver.add_cookie(cookie)
+            except WebDriverException:
+                pass  # e.g. a cookie from the identity provider
+
+        self.goto_alma_start_page()
+        try:
+            self.wait_for(By.CSS_SELECTOR, '.logoAlma', 10)
+        except TimeoutException:
+            sys.stdout.write(' EXPIRED\n')
+            cache.clear()
+            self.driver.delete_all_cookies()
+            return False
+
+        sys.stdout.write(' DONE\n')
+        return True
+
+    def save_session(self):
+        cache = self.session_cache()
+        if cache is not None:
+            cache.save(self.driver.get_cookies())
+
     def connect(self):
-        domain = self.config.get('login', 'domain')
-        auth_type = self.config.get('login', 'auth_type')
         institution = self.config.get('login', 'institution')
-        username = self.config.get('login', 'username')
-        password = self.config.get('login', 'password')
 
-        self.driver = self.get_driver()
+        self.driver = self.tracer.instrument(self.get_driver())
+        if self.record_file:
+            from .recording import Recorder
+
+            if self.recorder is None:
+                self.recorder = Recorder(self.record_file, self.secrets())
+            self.recorder.attach(self.driver)
+            print('Recording the browser session to {}'.format(self.record_file))
         self.driver.set_window_size(self.config.get('window', 'width'),
                                     self.config.get('window', 'height'))
         self.wait = self.waiter()
 
         print('Connecting to {}:{}'.format(self.instance, institution))
 
+        if not self.restore_session():
+            self.login()
+            self.save_session()
+
+        if self.config.getboolean('http', 'enabled') and not self.is_replaying():
+            if self.transport is None:
+                from .http_transport import HttpTransport
+                self.transport = HttpTransport(self)
+            self.transport.sync_cookies()
+
+    def login(self):
+        """Go through the full login flow."""
+        domain = self.config.get('login', 'domain')
+        auth_type = self.config.get('login', 'auth_type')
+        institution = self.config.get('login', 'institution')
+        username = self.config.get('login', 'username')
+        password = self.config.get('login', 'password')
+
         if auth_type == 'Feide' and domain != '':
             sys.stdout.write('Logging in as {}@{}...'.format(username, domain))
 
@@ -195,9 +484,63 @@ class Worker(object):
 
         sys.stdout.write(' DONE\n')
 
+    def url(self, path):
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return '{}/{}'.format(self.base_url.rstrip('/'), path.lstrip('/'))
+
+    @traced('worker.get')
     def get(self, url):
-        return self.driver.get('https://{}.alma.exlibrisgroup.com/{}'.format(self.instance, url.lstrip('/')))
-    
+        return self.driver.get(self.url(url))
+
+    def navigate(self, name, by, by_value, walk):
+        """
+        Open a page by its cached URL, falling back to `walk()`, e.g. through the Alma menus.
+
+        The page is recognised by the element `(by, by_value)`. After a walk, the URL of
+        the page is cached under `name` for the next time. Returns True if the cached URL
+        was used.
+        """
+        url = self.urls.get(name) if self.urls is not None else None
+        if url is not None:
+            with self.step('navigate: cached url', page=name):
+                self.get(url)
+                try:
+                    self.wait_for(by, by_value, timeout=self.cached_url_timeout)
+                    return True
+                except TimeoutException:
+                    if self.is_logged_out():
+                        raise  # not the URL's fault, leave it to the retry policy
+                    self.urls.forget(name)
+
+        with self.step('navigate: walk', page=name):
+            walk()
+            self.wait_for(by, by_value)
+        if self.urls is not None:
+            self.urls.set(name, self.driver.current_url)
+        return False
+
+    # The release shown on the Alma start page, e.g. "November 2026"
+    css_selector_alma_version = '#almaVersion'
+
+    def alma_version(self):
+        """
+        Return the Alma release shown on the start page, or None if it cannot be found.
+
+        The version is always read from the start page, as other pages (or a letter tab) don't
+        show it. None makes `defaults` check all the letters, so a release isn't missed when
+        Alma moves the element.
+        """
+        with self.step('alma version'):
+            self.goto_alma_start_page()
+            try:
+                self.wait_for(By.CSS_SELECTOR, '.logoAlma')
+            except TimeoutException:
+                return None
+            elems = self.all(By.CSS_SELECTOR, self.css_selector_alma_version)
+            if len(elems) == 0:
+                return None
+            return elems[0].get_attribute('textContent').strip() or None
+
     def goto_alma_start_page(self):
         self.get('/mng/action/home.do?mode=ajax')
-
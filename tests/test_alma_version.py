@@ -0,0 +1,99 @@
+# encoding=utf8
+import pytest
+from selenium.common.exceptions import TimeoutException
+
+from slipsomat import slipsomat
+from slipsomat.config import read_config
+from slipsomat.slipsomat import StatusFile
+from slipsomat.worker import Worker
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    return tmp_path
+
+
+class Element(object):
+    def __init__(self, text):
+        self.text = text
+
+    def get_attribute(self, name):
+        assert name == 'textContent'
+        return self.text
+
+
+def start_page(elements, loads=True):
+    """Return a Worker showing a start page with the given elements, by CSS selector."""
+    with open('slipsomat.cfg', 'w') as fp:
+        fp.write('[login]\nusername=test\ninstance=test\ninstitution=TEST\n[navigation]\nurl_cache=false\n')
+    worker = Worker(None, config=read_config('slipsomat.cfg'))
+    worker.pages = []
+
+    def wait_for(by, by_value, timeout=None):
+        if not loads:
+            raise TimeoutException()
+
+    worker.goto_alma_start_page = lambda: worker.pages.append('start')
+    worker.wait_for = wait_for
+    worker.all = lambda by, by_value: [Element(text) for text in elements.get(by_value, [])]
+    return worker
+
+
+def test_version_is_read_from_the_start_page():
+    worker = start_page({'#almaVersion': ['  November 2026\n']})
+    assert worker.alma_version() == 'November 2026'
+    assert worker.pages == ['start']
+
+
+@pytest.mark.parametrize('elements, loads', [
+    ({}, True),
+    ({'#almaVersion': ['']}, True),
+    ({'#almaVersion': ['November 2026']}, False),
+])
+def test_no_version(elements, loads):
+    assert start_page(elements, loads).alma_version() is None
+
+
+class Table(object):
+    """A stand-in for ConfigurationTable, recording how pull_defaults was called."""
+
+    def __init__(self, version, calls, failed=()):
+        self.worker = self
+        self.version = version
+        self.calls = calls
+        self.failed = list(failed)
+
+    def alma_version(self):
+        return self.version
+
+    def pull_defaults(self, local_storage, status_file, jobs, only_new, checkpoint):
+        self.calls.append(only_new)
+        return 0, 0, self.failed
+
+
+def pull_defaults(status_file, version, force=False, failed=()):
+    calls = []
+    slipsomat.pull_defaults(Table(version, calls, failed), Table(version, calls), None, status_file, force=force)
+    return calls
+
+
+@pytest.mark.parametrize('stored, version, force, only_new', [
+    ('November 2026', 'November 2026', False, True),
+    ('November 2026', 'November 2026', True, False),
+    ('August 2026', 'November 2026', False, False),
+    (None, 'November 2026', False, False),
+    ('November 2026', None, False, False),
+])
+def test_skip_decision(stored, version, force, only_new):
+    status_file = StatusFile()
+    status_file.set_alma_version(stored)
+    assert pull_defaults(status_file, version, force) == [only_new, only_new]
+    assert status_file.alma_version == (version or stored)
+
+
+def test_version_is_kept_until_all_letters_are_fetched():
+    status_file = StatusFile()
+    status_file.set_alma_version('August 2026')
+    pull_defaults(status_file, 'November 2026', failed=['Letter A'])
+    assert status_file.alma_version == 'August 2026'
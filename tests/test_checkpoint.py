@@ -0,0 +1,50 @@
+# encoding=utf8
+import pytest
+
+from slipsomat.checkpoint import Checkpoint
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    return tmp_path
+
+
+def test_resume():
+    checkpoint = Checkpoint('pull')
+    checkpoint.add('Letters Configuration', 'Letter A')
+    checkpoint.close()
+
+    checkpoint = Checkpoint('pull', resume=True)
+    assert checkpoint.is_done('Letters Configuration', 'Letter A')
+    assert not checkpoint.is_done('Letters Configuration', 'Letter B')
+    assert checkpoint.count('Letters Configuration') == 1
+    assert Checkpoint.pending() == 'pull'
+
+    checkpoint.clear()
+    assert Checkpoint.pending() is None
+
+
+def test_commands_keep_their_own_letters():
+    pull = Checkpoint('pull')
+    pull.add('Letters Configuration', 'Letter A')
+    pull.close()
+
+    defaults = Checkpoint('defaults')
+    assert not defaults.is_done('Letters Configuration', 'Letter A')
+    defaults.add('Letters Configuration', 'Letter B')
+    defaults.clear()
+
+    assert Checkpoint('pull', resume=True).is_done('Letters Configuration', 'Letter A')
+    assert not Checkpoint('defaults', resume=True).is_done('Letters Configuration', 'Letter B')
+
+
+def test_partially_written_line(workdir):
+    (workdir / Checkpoint.filename).write_bytes(b'["pull", "Letters Configuration", "Letter A"]\n["pull", "Let')
+    checkpoint = Checkpoint('pull', resume=True)
+    assert checkpoint.completed == {('Letters Configuration', 'Letter A')}
+    checkpoint.add('Letters Configuration', 'Letter B')
+    checkpoint.close()
+
+    assert Checkpoint('pull', resume=True).completed == {('Letters Configuration', 'Letter A'),
+                                                         ('Letters Configuration', 'Letter B')}
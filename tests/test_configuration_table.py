@@ -0,0 +1,122 @@
+# encoding=utf8
+import contextlib
+import re
+from datetime import datetime
+
+import pytest
+from selenium.webdriver.common.by import By
+
+from slipsomat.configuration_table import ConfigurationTable
+from slipsomat.letter_info import LetterInfo
+from slipsomat.slipsomat import StatusFile
+
+
+class Worker(object):
+    """Stands in for a Worker showing a table whose pagination links only the pages near the current one."""
+
+    def __init__(self, pages, page=1, window=2):
+        self.pages = pages
+        self.page = page
+        self.window = window
+        self.clicks = []
+
+    @contextlib.contextmanager
+    def step(self, name, **args):
+        yield
+
+    def all(self, by, selector):
+        if by == By.XPATH:
+            number = int(re.search(r'"(\d+)"', selector).group(1))
+            if number != self.page and abs(number - self.page) <= self.window and number <= self.pages:
+                return [number]
+            return []
+        if selector == '.paginationNext:not(.disabled) a' and self.page < self.pages:
+            return [self.page + 1]
+        if selector == '.paginationPrevious:not(.disabled) a' and self.page > 1:
+            return [self.page - 1]
+        return []
+
+    def execute_script(self, script, *args):
+        if len(args) == 0:
+            return self.page  # shown_page
+        self.clicks.append(args[0])
+        self.page = args[0]
+
+    def wait_for(self, by, selector):
+        pass
+
+
+def test_goto_page_clicks_page_link():
+    worker = Worker(pages=10)
+    table = ConfigurationTable('Letters Configuration', worker)
+    table.goto_page(3)
+    assert worker.clicks == [3]
+    assert table.current_page == 3
+
+
+def test_goto_page_steps_to_distant_pages():
+    worker = Worker(pages=10)
+    table = ConfigurationTable('Letters Configuration', worker)
+    table.goto_page(7)
+    assert worker.clicks == [2, 3, 4, 5, 7]
+    assert table.current_page == 7
+
+    table.goto_page(1)
+    assert worker.clicks == [2, 3, 4, 5, 7, 6, 5, 4, 3, 1]
+    assert table.current_page == 1
+
+
+def test_goto_page_beyond_last_page():
+    worker = Worker(pages=3)
+    table = ConfigurationTable('Letters Configuration', worker)
+    with pytest.raises(RuntimeError):
+        table.goto_page(5)
+
+
+def row(name, customized='Institution', updated_on='01/10/2026'):
+    return LetterInfo(name, 0, 'EMAIL', customized, 'jdoe', updated_on)
+
+
+@pytest.fixture
+def status_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    return StatusFile()
+
+
+def pulled(status_file, letter_info):
+    status_file.set_checksum(letter_info.get_filename(), 'abc')
+    status_file.set_remote(letter_info.get_filename(), letter_info.remote_metadata())
+
+
+def test_plan(status_file, capsys):
+    unchanged = row('Unchanged')
+    changed = row('Changed')
+    today = row('Today', updated_on=datetime.now().strftime('%d/%m/%Y'))
+    reset = row('Reset')
+    for letter_info in (unchanged, changed, today, reset):
+        pulled(status_file, letter_info)
+    pulled(status_file, row('Deleted'))  # no longer in the table
+
+    changed.updated_on = '02/10/2026'
+    reset.customized = '-'
+    new = row('New')
+    not_customized = row('Default', customized='-')
+
+    table = ConfigurationTable('Letters Configuration', None)
+    table.letter_infos = [unchanged, changed, today, reset, new, not_customized]
+    plan = table.plan(status_file)
+    assert [(letter_info.name, reason) for letter_info, reason in plan] == [
+        ('Unchanged', None),
+        ('Changed', 'changed in Alma'),
+        ('Today', 'updated today'),
+        ('Reset', 'changed in Alma'),
+        ('New', 'new'),
+        ('Default', None),
+    ]
+    assert dict(table.plan(status_file, include_all=True))[not_customized] == 'new'
+
+    table.print_plan(plan)
+    out = capsys.readouterr().out
+    assert 'Unchanged' not in out and 'Deleted' not in out and 'Default' not in out
+    assert 'Changed-EMAIL' in out and 'New-EMAIL' in out
+    assert out.endswith('Letters Configuration: 4 of 6 letters would be fetched\n')
@@ -0,0 +1,128 @@
+# encoding=utf8
+import difflib
+import random
+
+import pytest
+
+from slipsomat.diff import canonical_lines, diff_texts, get_opcodes, unified_diff
+
+LETTER = u"""<?xml version="1.0" encoding="utf-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <xsl:template match="/">
+    <p class="a" id="b">Dear   {name}</p>
+    <xsl:text>{text}</xsl:text>
+    <pre xml:space="preserve">{pre}</pre>
+  </xsl:template>
+</xsl:stylesheet>
+"""
+
+
+def letter(name='reader', text=', ', pre='  x'):
+    return LETTER.format(name=name, text=text, pre=pre)
+
+
+def test_canonical_form():
+    assert canonical_lines(letter()) == [
+        'xmlns:xsl="http://www.w3.org/1999/XSL/Transform"',
+        '<xsl:stylesheet version="1.0">',
+        '  <xsl:template match="/">',
+        '    <p class="a" id="b">',
+        '      Dear reader',
+        '    </p>',
+        '    <xsl:text>',
+        '      ", "',
+        '    </xsl:text>',
+        '    <pre xml:space="preserve">',
+        '      "  x"',
+        '    </pre>',
+        '  </xsl:template>',
+        '</xsl:stylesheet>',
+    ]
+
+
+def test_canonical_form_ignores_formatting():
+    reformatted = (u'<xsl:stylesheet xmlns:xsl="http://www.w3.org/1999/XSL/Transform" version="1.0">'
+                   u'<xsl:template match="/"><p id="b" class="a">\n  Dear reader\n</p>'
+                   u'<xsl:text>, </xsl:text><pre xml:space="preserve">  x</pre>'
+                   u'</xsl:template></xsl:stylesheet>')
+    assert canonical_lines(reformatted) == canonical_lines(letter())
+
+
+@pytest.mark.parametrize('changed', [letter(text=','), letter(text=' '), letter(pre='x'), letter(pre='  x\n')])
+def test_canonical_form_keeps_significant_whitespace(changed):
+    assert canonical_lines(changed) != canonical_lines(letter())
+
+
+def test_canonical_form_of_whitespace_only_text():
+    lines = canonical_lines(letter(text=' ', pre='\n'))
+    assert '      " "' in lines
+    assert '      "\\n"' in lines
+
+
+def test_not_well_formed():
+    with pytest.raises(ValueError):
+        canonical_lines(u'<a>')
+    # The XML diff falls back to a line diff
+    assert diff_texts(u'<a>', u'<b>', xml=True)[2:] == ['@@ -1 +1 @@', '-<a>', '+<b>']
+
+
+def check_opcodes(a, b):
+    opcodes = get_opcodes(a, b)
+    i = j = 0
+    result = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j)
+        assert tag in ('equal', 'replace', 'delete', 'insert')
+        if tag == 'equal':
+            assert a[i1:i2] == b[j1:j2]
+        result += b[j1:j2]
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    assert result == b
+    return opcodes
+
+
+def test_opcodes_like_difflib():
+    a = ['a', 'b', 'c', 'd', 'e']
+    for b in (a, ['a', 'b', 'x', 'd', 'e'], ['a', 'b', 'd', 'e'], ['a', 'b', 'c', 'x', 'd', 'e'], [], ['x']):
+        assert check_opcodes(a, b) == difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes()
+
+
+def test_opcodes_of_random_changes():
+    rng = random.Random(1)
+    for _ in range(200):
+        a = [rng.choice('abcdef') for _ in range(rng.randint(0, 40))]
+        b = list(a)
+        for _ in range(rng.randint(0, 6)):
+            k = rng.randint(0, len(b))
+            if rng.random() < 0.5 and k < len(b):
+                del b[k]
+            else:
+                b.insert(k, rng.choice('abcdefg'))
+        opcodes = check_opcodes(a, b)
+        matched = sum(i2 - i1 for tag, i1, i2, j1, j2 in opcodes if tag == 'equal')
+        # Myers finds a longest common subsequence, which is at least as long as difflib's matches
+        expected = sum(size for _, _, size in difflib.SequenceMatcher(None, a, b, autojunk=False).get_matching_blocks())
+        assert matched >= expected
+
+
+def test_patience_keeps_unique_lines_together():
+    a = ['<a>', '  x', '</a>', '<b>', '  y', '</b>']
+    b = ['<b>', '  y', '</b>', '<a>', '  x', '</a>']
+    opcodes = check_opcodes(a, b)
+    # One of the elements is kept as a whole, and the other moved as a whole
+    assert sorted(tag for tag, _, _, _, _ in opcodes) == ['delete', 'equal', 'insert']
+    assert [i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == 'equal'] == [3]
+
+
+def test_unified_diff_like_difflib():
+    a = ['line {}'.format(i) for i in range(20)]
+    b = list(a)
+    b[3] = 'changed'
+    del b[10]
+    b.insert(17, 'added')
+    expected = list(difflib.unified_diff(a, b, 'old', 'new', n=3, lineterm=''))
+    assert list(unified_diff(a, b, 'old', 'new', 3)) == expected
+    assert list(unified_diff(a, a, 'old', 'new')) == []
+    assert list(unified_diff([], ['x'], 'old', 'new')) == list(difflib.unified_diff([], ['x'], 'old', 'new',
+                                                                                    lineterm=''))
@@ -0,0 +1,101 @@
+# encoding=utf8
+from configparser import ConfigParser
+
+import pytest
+
+from slipsomat.configuration_table import LETTER_LINK
+from slipsomat.fake_alma import FakeAlma, FakeAlmaServer
+from slipsomat.http_transport import FormChanged, HttpTransport
+from slipsomat.letter_info import LetterInfo
+from slipsomat.slipsomat import LetterContent
+from slipsomat.url_cache import UrlCache
+
+requests = pytest.importorskip('requests')
+
+
+class Worker(object):
+    """The parts of slipsomat.worker.Worker that HttpTransport uses."""
+
+    def __init__(self, urls=None):
+        self.config = ConfigParser()
+        self.config.read_dict({'http': {'pool_size': '2'}})
+        self.default_timeout = 5
+        self.urls = urls
+
+
+@pytest.fixture
+def server():
+    server = FakeAlmaServer(FakeAlma(letters=5, components=0)).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def logged_in_transport(server, urls=None):
+    transport = HttpTransport(Worker(urls))
+    transport.session.post(server.base_url + '/mng/login', data={'username': 'test', 'password': 'test'})
+    return transport
+
+
+def letter(index):
+    return LetterInfo('Bench Letter {:04d}'.format(index), index, None)
+
+
+def test_fetch_and_save(server):
+    transport = logged_in_transport(server)
+    letter_info = letter(1)
+    assert not transport.can_fetch(letter_info)
+
+    transport.learn(letter_info, server.base_url + '/mng/action/letter?t=letters&id=1')
+    content = transport.fetch(letter_info)
+    assert '<p>Bench Letter 0001</p>' in content.text
+    assert transport.can_save(letter_info)
+
+    assert transport.save(letter_info, LetterContent('<new/>'))
+    assert server.alma.rows['letters'][1]['content'] == '<new/>'
+    assert not transport.can_save(letter_info)
+
+
+def test_logged_out(server):
+    transport = HttpTransport(Worker())
+    letter_info = letter(0)
+    transport.learn(letter_info, server.base_url + '/mng/action/letter?t=letters&id=0')
+    with pytest.raises(FormChanged):
+        transport.fetch(letter_info)
+
+
+def test_connection_error_raises_form_changed(server):
+    transport = logged_in_transport(server)
+    letter_info = letter(0)
+    transport.learn(letter_info, server.base_url + '/mng/action/letter?t=letters&id=0')
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(FormChanged):
+        transport.fetch(letter_info)
+
+
+def test_urls_are_kept_across_runs(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    letter_info = letter(2)
+    url = server.base_url + '/mng/action/letter?t=letters&id=2&tab=template'
+    UrlCache(server.base_url, 'TEST').set('letter:' + letter_info.unique_name, url)
+
+    # A new run, with a new transport
+    transport = logged_in_transport(server, UrlCache(server.base_url, 'TEST'))
+    assert transport.can_fetch(letter_info)
+    assert '<p>Bench Letter 0002</p>' in transport.fetch(letter_info).text
+
+    transport.forget(letter_info)
+    assert not transport.can_fetch(letter_info)
+    assert UrlCache(server.base_url, 'TEST').get('letter:' + letter_info.unique_name) is None
+
+
+@pytest.mark.parametrize('link, expected', [
+    ('http://127.0.0.1:8080/mng/action/letter?t=letters&id=3', True),
+    ('https://bibsys-k.alma.exlibrisgroup.com/mng/action/letterEdit.do?id=3', True),
+    ('http://127.0.0.1:8080/mng/action/table?t=letters&page=1#', False),  # href="#"
+    ('http://127.0.0.1:8080/mng/action/table?t=letters&page=1', False),
+    ('javascript:void(0)', False),
+])
+def test_letter_links(link, expected):
+    assert bool(LETTER_LINK.match(link)) == expected
@@ -0,0 +1,120 @@
+# encoding=utf8
+import threading
+import time
+
+import pytest
+
+from slipsomat.pool import WorkerPool
+
+
+class Worker(object):
+    """A stand-in for slipsomat.worker.Worker, which only counts its clones."""
+
+    def __init__(self, name='main'):
+        self.name = name
+        self.clones = 0
+        self.driver = object()
+        self.closed = False
+
+    def clone(self):
+        self.clones += 1
+        return Worker('clone{}'.format(self.clones))
+
+    def connect(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_all_items_are_processed_once():
+    pool = WorkerPool(Worker(), 3)
+    pool.connect()
+    done = []
+    lock = threading.Lock()
+
+    def make_task(worker):
+        def task(item):
+            with lock:
+                done.append(item)
+            return item * 2
+        return task
+
+    results = {item: value for item, value, seconds in pool.imap(make_task, list(range(20)))}
+    pool.close()
+    assert results == {item: item * 2 for item in range(20)}
+    assert sorted(done) == list(range(20))
+    assert all(worker.closed for worker in pool.workers[1:])
+    assert not pool.workers[0].closed
+
+
+def test_most_expensive_items_first():
+    pool = WorkerPool(Worker(), 1)
+    results = pool.imap(lambda worker: lambda item: item, [1, 3, 2], cost=lambda item: item)
+    order = [item for item, value, seconds in results]
+    pool.close()
+    assert order == [3, 2, 1]
+
+
+def test_crashed_worker_hands_its_item_over():
+    pool = WorkerPool(Worker(), 2)
+
+    def make_task(worker):
+        def task(item):
+            if worker.name == 'main' and item == 'b':
+                raise RuntimeError('browser crashed')
+            time.sleep(0.01)
+            return worker.name
+        return task
+
+    results = {item: value for item, value, seconds in pool.imap(make_task, ['a', 'b', 'c'])}
+    pool.close()
+    assert results['b'] == 'clone1'
+    assert set(results) == {'a', 'b', 'c'}
+
+
+def test_item_failing_on_every_worker_is_given_up():
+    pool = WorkerPool(Worker(), 2)
+
+    def make_task(worker):
+        def task(item):
+            if item == 'bad':
+                raise ValueError(worker.name)
+            return item
+        return task
+
+    with pytest.raises(ValueError):
+        list(pool.imap(make_task, ['bad', 'a', 'b']))
+    pool.close()
+
+
+def test_all_workers_crashed():
+    pool = WorkerPool(Worker(), 2)
+
+    def make_task(worker):
+        raise RuntimeError('could not start')
+
+    with pytest.raises(RuntimeError, match='All workers crashed, 2 letter'):
+        list(pool.imap(make_task, ['a', 'b']))
+    pool.close()
+
+
+def test_threads_stop_when_the_caller_stops():
+    pool = WorkerPool(Worker(), 2)
+    started = []
+
+    def make_task(worker):
+        def task(item):
+            started.append(item)
+            time.sleep(0.02)
+            return item
+        return task
+
+    for item, value, seconds in pool.imap(make_task, list(range(50))):
+        break
+    pool.close()
+    count = len(started)
+    assert count < 50
+    assert pool.threads == []
+    time.sleep(0.1)
+    assert len(started) == count  # the main worker is no longer used by the pool
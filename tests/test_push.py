@@ -0,0 +1,163 @@
+# encoding=utf8
+import threading
+import time
+
+import pytest
+
+from slipsomat import slipsomat
+from slipsomat.letter_info import LetterInfo
+from slipsomat.slipsomat import LetterContent, LocalStorage, StatusFile
+
+
+class Worker(object):
+    """A stand-in for slipsomat.worker.Worker, for the pool."""
+
+    driver = object()
+
+    def clone(self):
+        return Worker()
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class Table(object):
+    """
+    A stand-in for ConfigurationTable, with the letters in Alma given by `remote`.
+
+    `delays` holds how long pushing a letter takes, so the letters can be made to
+    finish in another order than they were started.
+    """
+
+    def __init__(self, names, remote, events, delays=None, retries=0):
+        self.pagename = 'Letters Configuration'
+        self.worker = Worker()
+        self.letter_infos = [LetterInfo(name, index, None) for index, name in enumerate(names)]
+        self.remote = remote
+        self.events = events
+        self.delays = delays or {}
+        self.retries = retries
+        self.started = None
+
+    def open(self):
+        pass
+
+    def read(self):
+        pass
+
+    def child(self, worker):
+        return self
+
+    def print_letter_status(self, string, msg, progress=None, newline=False):
+        if newline:
+            self.events.append(('status', string, msg))
+
+    def push_letter(self, letter_info, content, expected_sha1, overwrite=None):
+        time.sleep(self.delays.get(letter_info.name, 0))
+        remote_content = self.remote[letter_info.name]
+        self.events.append(('push', letter_info.name))
+        # Like a retry, which checks the remote version again
+        for _ in range(self.retries + 1):
+            if remote_content.sha1 != expected_sha1 and (overwrite is None or not overwrite(remote_content)):
+                return False, remote_content
+        self.remote[letter_info.name] = content
+        return True, remote_content
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    monkeypatch.setattr(slipsomat, 'check_files', lambda files: True)
+    status_file = StatusFile()
+    local_storage = LocalStorage(status_file)
+    return status_file, local_storage
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    """The answers to the conflict prompts, by filename. The prompts asked are kept in `asked`."""
+    answers = {}
+
+    def resolve_conflict(filename, local_content, remote_content, msg):
+        # The pool threads must have finished, so the prompt doesn't get mixed up with their output
+        assert threading.active_count() == 1
+        asked.append(filename)
+        return answers[filename]
+
+    asked = []
+    monkeypatch.setattr(slipsomat, 'resolve_conflict', resolve_conflict)
+    return answers, asked
+
+
+def letters(status_file, names):
+    """Write local changes to the letters, and return their old versions, as pulled before."""
+    remote = {}
+    for name in names:
+        with open(name + '.xsl', 'wb') as fp:
+            fp.write(b'new ' + name.encode('utf-8'))
+        remote[name] = LetterContent('old ' + name)
+        status_file.set_checksum('./' + name + '.xsl', remote[name].sha1)
+    return remote
+
+
+def updated(name):
+    return 'updated from {} to {}'.format(LetterContent('old ' + name).sha1[:7], LetterContent('new ' + name).sha1[:7])
+
+
+def test_pool_reports_in_order_and_asks_at_the_end(storage, answers):
+    status_file, local_storage = storage
+    answers, asked = answers
+    events = []
+    remote = letters(status_file, ['A', 'B', 'C', 'D'])
+    remote['B'] = LetterContent('changed in Alma')
+    answers['./B.xsl'] = True
+    table = Table(['A', 'B', 'C', 'D'], remote, events, delays={'A': 0.3, 'C': 0.1})
+    slipsomat.push(table, Table([], {}, []), local_storage, status_file,
+                   ['A.xsl', 'B.xsl', 'C.xsl', 'D.xsl'], jobs=2)
+
+    statuses = [event[1:] for event in events if event[0] == 'status']
+    assert statuses[:4] == [
+        ('./A.xsl', updated('A')),
+        ('./B.xsl', 'remote version has changed'),
+        ('./C.xsl', updated('C')),
+        ('./D.xsl', updated('D')),
+    ]
+    assert asked == ['./B.xsl']
+    assert events[-2:] == [
+        ('push', 'B'),
+        ('status', './B.xsl', updated('B')),
+    ]
+    for name in 'ABCD':
+        assert status_file.checksum('./' + name + '.xsl') == LetterContent('new ' + name).sha1
+
+
+def test_pool_skips_conflicts_not_overwritten(storage, answers):
+    status_file, local_storage = storage
+    answers, asked = answers
+    events = []
+    remote = letters(status_file, ['A', 'B'])
+    remote['A'] = LetterContent('changed in Alma')
+    answers['./A.xsl'] = False
+    slipsomat.push(Table(['A', 'B'], remote, events), Table([], {}, []), local_storage, status_file,
+                   ['A.xsl', 'B.xsl'], jobs=2)
+
+    assert asked == ['./A.xsl']
+    assert sorted(event for event in events if event[0] == 'push') == [('push', 'A'), ('push', 'B')]
+    assert events[-1] == ('status', './A.xsl', 'skipped')
+    assert status_file.checksum('./A.xsl') == LetterContent('old A').sha1
+    assert remote['A'].text == 'changed in Alma'
+
+
+def test_retried_push_asks_once(storage, answers):
+    status_file, local_storage = storage
+    answers, asked = answers
+    remote = letters(status_file, ['A'])
+    remote['A'] = LetterContent('changed in Alma')
+    answers['./A.xsl'] = True
+    slipsomat.push(Table(['A'], remote, [], retries=2), Table([], {}, []), local_storage, status_file, ['A.xsl'])
+
+    assert asked == ['./A.xsl']
+    assert status_file.checksum('./A.xsl') == LetterContent('new A').sha1
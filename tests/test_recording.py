@@ -0,0 +1,66 @@
+# encoding=utf8
+import json
+
+from selenium.webdriver.remote.webelement import WebElement
+
+from slipsomat.recording import REDACTED, Recorder, ReplayConnection, redact
+
+
+class Executor(object):
+
+    def __init__(self):
+        self.commands = []
+
+    def execute(self, command, params):
+        self.commands.append((command, params))
+        return {'value': None}
+
+
+class Driver(object):
+    """The parts of a WebDriver that Recorder and WebElement use."""
+
+    session_id = 'session'
+    capabilities = {'browserName': 'test'}
+    _is_remote = False
+
+    def __init__(self):
+        self.command_executor = Executor()
+
+    def execute(self, command, params):
+        return self.command_executor.execute(command, params)
+
+
+def test_redact():
+    assert redact({'text': 'user hunter2'}, ['hunter2']) == {'text': 'user ' + REDACTED}
+    assert redact(['a', 'b'], ['ab']) == ['a', 'b']
+    assert redact({'value': list('hunter2x')}, ['hunter2']) == {'value': [REDACTED]}
+    assert redact({'value': list('other')}, ['hunter2']) == {'value': list('other')}
+    cookie = {'name': 'ALMA_SESSION', 'value': 'token'}
+    assert redact([cookie], [], cookies=True) == [{'name': 'ALMA_SESSION', 'value': REDACTED}]
+
+
+def test_send_keys_is_redacted(tmp_path):
+    filename = str(tmp_path / 'session.jsonl')
+    driver = Driver()
+    recorder = Recorder(filename, ['hunter2', ''])
+    recorder.attach(driver)
+    WebElement(driver, 'password-field').send_keys('hunter2')
+    recorder.close()
+
+    # The browser still gets the password
+    assert driver.command_executor.commands[0][1]['text'] == 'hunter2'
+
+    with open(filename) as fp:
+        text = fp.read()
+    assert 'hunter2' not in text
+    entry = json.loads(text.splitlines()[1])
+    assert entry['command'] == 'sendKeysToElement'
+    assert entry['params']['text'] == REDACTED
+    assert entry['params']['value'] == [REDACTED]
+
+    # Replaying the same command matches the redacted entry
+    replay = ReplayConnection(filename, speed=0, secrets=['hunter2'])
+    replay.start_session()
+    params = {'text': 'hunter2', 'value': list('hunter2'), 'id': 'password-field'}
+    assert replay.execute('sendKeysToElement', params) == {'value': None}
+    assert replay.position == 2
@@ -0,0 +1,130 @@
+# encoding=utf8
+from configparser import ConfigParser
+
+import pytest
+from selenium.common.exceptions import (InvalidSessionIdException, NoSuchElementException,
+                                        StaleElementReferenceException, TimeoutException, WebDriverException)
+
+from slipsomat import retry
+from slipsomat.retry import RetryFailed, RetryPolicy
+
+
+class Worker(object):
+    """Stands in for a Worker, recording how it was recovered."""
+
+    def __init__(self, logged_out=False):
+        self.logged_out = logged_out
+        self.calls = []
+
+    def is_logged_out(self):
+        if isinstance(self.logged_out, Exception):
+            raise self.logged_out
+        return self.logged_out
+
+    def restart(self):
+        self.calls.append('restart')
+
+    def relogin(self):
+        self.calls.append('relogin')
+
+
+class Fails(object):
+    """A function raising the given exceptions in turn, then returning 'ok'."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if len(self.errors) != 0:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+@pytest.fixture
+def policy():
+    config = ConfigParser()
+    config.read_dict({'retry': {'timeout': '2', 'stale': '3', 'session': '1', 'logged_out': '1',
+                                'backoff': '1', 'max_backoff': '3'}})
+    return RetryPolicy(config)
+
+
+@pytest.fixture(autouse=True)
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(retry.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+@pytest.mark.parametrize('exc, worker, category', [
+    (InvalidSessionIdException(), Worker(), 'session'),
+    (ConnectionError(), Worker(), 'session'),
+    (WebDriverException('chrome not reachable'), Worker(), 'session'),
+    (WebDriverException('element not interactable'), Worker(), None),
+    (StaleElementReferenceException(), Worker(), 'stale'),
+    (TimeoutException(), Worker(), 'timeout'),
+    (NoSuchElementException(), Worker(), 'timeout'),
+    (TimeoutException(), Worker(logged_out=True), 'logged_out'),
+    (TimeoutException(), Worker(logged_out=WebDriverException('disconnected')), 'session'),
+    (ValueError(), Worker(), None),
+])
+def test_classify(policy, exc, worker, category):
+    assert policy.classify(exc, worker) == category
+
+
+@pytest.mark.parametrize('category, calls', [
+    ('session', ['restart']),
+    ('logged_out', ['relogin']),
+    ('timeout', []),
+    ('stale', []),
+])
+def test_recover(policy, category, calls):
+    worker = Worker()
+    policy.recover(category, worker)
+    assert worker.calls == calls
+
+
+def test_retries_with_backoff(policy, sleeps):
+    fn = Fails(StaleElementReferenceException(), StaleElementReferenceException(), StaleElementReferenceException())
+    resets = []
+    retries = []
+    worker = Worker()
+    assert policy.call(worker, fn, reset=lambda: resets.append(1),
+                       on_retry=lambda *args: retries.append(args)) == 'ok'
+    assert fn.calls == 4
+    assert retries == [('stale', 1, 1.0), ('stale', 2, 2.0), ('stale', 3, 3.0)]
+    assert sleeps == [1.0, 2.0, 3.0]
+    assert len(resets) == 3
+    assert worker.calls == []
+
+
+def test_recovers_before_retrying(policy):
+    worker = Worker()
+    assert policy.call(worker, Fails(InvalidSessionIdException())) == 'ok'
+    assert worker.calls == ['restart']
+
+
+def test_limits_are_per_category(policy):
+    fn = Fails(TimeoutException(), TimeoutException(), StaleElementReferenceException())
+    assert policy.call(Worker(), fn) == 'ok'
+
+
+def test_retry_failed(policy, sleeps):
+    error = TimeoutException('still loading')
+    fn = Fails(error, error, error, error)
+    with pytest.raises(RetryFailed) as info:
+        policy.call(Worker(), fn)
+    assert fn.calls == 3
+    assert sleeps == [1.0, 2.0]
+    assert info.value.category == 'timeout'
+    assert info.value.attempts == 3
+    assert info.value.cause is error
+
+
+def test_other_exceptions_are_not_retried(policy, sleeps):
+    fn = Fails(ValueError('bug'))
+    with pytest.raises(ValueError):
+        policy.call(Worker(), fn)
+    assert fn.calls == 1
+    assert sleeps == []
@@ -0,0 +1,49 @@
+# encoding=utf8
+import os
+
+import pytest
+
+from slipsomat import slipsomat
+from slipsomat.slipsomat import StatIndex
+
+
+@pytest.fixture
+def letter(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    (tmp_path / 'letter.xsl').write_text(u'<a/>')
+    os.utime('letter.xsl', (1000, 1000))
+    return 'letter.xsl'
+
+
+def save_at(monkeypatch, index, seconds):
+    monkeypatch.setattr(slipsomat.time, 'time', lambda: seconds)
+    index.save()
+
+
+def test_lookup(letter, monkeypatch):
+    index = StatIndex()
+    index.record(letter, os.stat(letter), 'abc')
+    save_at(monkeypatch, index, 1010)
+
+    index = StatIndex()
+    assert index.lookup(letter, os.stat(letter)) == 'abc'
+
+    with open(letter, 'w') as fp:
+        fp.write(u'<b></b>')
+    assert index.lookup(letter, os.stat(letter)) is None
+
+
+def test_racy_entry_is_trusted_after_rehashing(letter, monkeypatch):
+    index = StatIndex()
+    index.record(letter, os.stat(letter), 'abc')
+    # Saved in the same second as the file was modified
+    save_at(monkeypatch, index, 1000.5)
+
+    index = StatIndex()
+    assert index.lookup(letter, os.stat(letter)) is None
+    index.record(letter, os.stat(letter), 'abc')
+    assert index.dirty
+    save_at(monkeypatch, index, 1010)
+
+    index = StatIndex()
+    assert index.lookup(letter, os.stat(letter)) == 'abc'
@@ -0,0 +1,52 @@
+# encoding=utf8
+import os
+
+import pytest
+
+from slipsomat.slipsomat import LetterContent, LocalStorage, StatusFile
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    return tmp_path
+
+
+def write(filename, text):
+    with open(filename, 'wb') as fp:
+        fp.write(text.encode('utf-8'))
+
+
+def pulled(status_file, filename, text):
+    write(filename, text)
+    status_file.set_checksum('./' + filename, LetterContent(text).sha1)
+
+
+def test_status():
+    status_file = StatusFile()
+    local_storage = LocalStorage(status_file)
+    pulled(status_file, 'Unchanged.xsl', 'unchanged')
+    pulled(status_file, 'Modified.xsl', 'modified')
+    pulled(status_file, 'Missing.xsl', 'missing')
+    pulled(status_file, 'Drifted.xsl', 'drifted')
+    status_file.set_default_checksum('./Drifted.xsl', 'abc')
+    status_file.set_default_base_checksum('./Drifted.xsl', 'abc')
+
+    write('Modified.xsl', 'modified locally')
+    os.remove('Missing.xsl')
+    write('Untracked.xsl', 'untracked')
+    write('notes.txt', 'not a letter')
+    os.mkdir('folder.xsl')
+    status_file.set_default_checksum('./Drifted.xsl', 'def')
+
+    assert local_storage.status() == {
+        'modified': ['Modified.xsl'],
+        'untracked': ['Untracked.xsl'],
+        'missing': ['Missing.xsl'],
+        'default-drifted': ['Drifted.xsl'],
+    }
+
+
+def test_status_of_empty_directory():
+    assert LocalStorage(StatusFile()).status() == {
+        'modified': [], 'untracked': [], 'missing': [], 'default-drifted': []}
@@ -0,0 +1,74 @@
+# encoding=utf8
+import json
+import os
+
+import pytest
+
+from slipsomat import slipsomat
+from slipsomat.slipsomat import StatusFile
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(str(tmp_path))
+    return tmp_path
+
+
+def read_status():
+    with open(StatusFile.filename) as fp:
+        return json.load(fp)
+
+
+def test_changes_are_journaled_until_saved():
+    status_file = StatusFile()
+    status_file.set_checksum('letters/a.xsl', 'abc')
+    status_file.set_alma_version('2026.10')
+    assert not os.path.exists(StatusFile.filename)
+    assert os.path.exists(StatusFile.journal_filename)
+
+    status_file.save()
+    assert read_status() == {'version': 1, 'alma_version': '2026.10',
+                             'letters': {'letters/a.xsl': {'checksum': 'abc'}}}
+    assert not os.path.exists(StatusFile.journal_filename)
+
+
+def test_journal_is_replayed_after_a_crash():
+    status_file = StatusFile()
+    status_file.set_checksum('letters/a.xsl', 'abc')
+    status_file.save()
+
+    # A command that crashed before saving
+    status_file = StatusFile()
+    status_file.set_checksum('letters/a.xsl', 'def')
+    status_file.set_modified('letters/b.xsl', '01/02/2026')
+    status_file.set_alma_version('2026.10')
+    status_file.journal.close()
+    with open(StatusFile.journal_filename, 'ab') as fp:
+        fp.write(b'["letters/c.xsl", "check')  # the line being written when it crashed
+
+    status_file = StatusFile()
+    assert status_file.dirty
+    assert status_file.checksum('letters/a.xsl') == 'def'
+    assert status_file.modified('letters/b.xsl') == '01/02/2026'
+    assert status_file.alma_version == '2026.10'
+    assert 'letters/c.xsl' not in status_file.letters
+
+    status_file.save()
+    assert not os.path.exists(StatusFile.journal_filename)
+    assert read_status()['letters'] == {'letters/a.xsl': {'checksum': 'def'},
+                                        'letters/b.xsl': {'modified': '01/02/2026'}}
+
+
+def test_saved_once_per_command(monkeypatch):
+    replaced = []
+    replace = os.replace
+    monkeypatch.setattr(slipsomat.os, 'replace', lambda src, dst: (replaced.append(dst), replace(src, dst)))
+
+    status_file = StatusFile()
+    for i in range(10):
+        status_file.set_checksum('letters/{}.xsl'.format(i), str(i))
+    status_file.set_checksum('letters/0.xsl', '0')  # unchanged, not journaled
+    status_file.save()
+    status_file.save()  # nothing changed since the last save
+    assert replaced == [StatusFile.filename]
+    assert len(read_status()['letters']) == 10
@@ -0,0 +1,35 @@
+# encoding=utf8
+from slipsomat.validation import compile_xslt, validate_files
+
+STYLESHEET = u"""<?xml version="1.0" encoding="utf-8"?>
+<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+  <xsl:include href="footer.xsl"/>
+  <xsl:template match="/"><p/></xsl:template>
+</xsl:stylesheet>
+"""
+
+
+def test_valid_letter(tmp_path):
+    (tmp_path / 'footer.xsl').write_text(u'<xsl:stylesheet version="1.0" '
+                                         u'xmlns:xsl="http://www.w3.org/1999/XSL/Transform"/>')
+    letter = tmp_path / 'letter.xsl'
+    letter.write_text(STYLESHEET)
+    assert compile_xslt(str(letter)) is None
+
+
+def test_missing_include(tmp_path):
+    letter = tmp_path / 'letter.xsl'
+    letter.write_text(STYLESHEET)
+    assert compile_xslt(str(letter)) == 'Included file not found: footer.xsl'
+
+
+def test_not_well_formed(tmp_path):
+    letter = tmp_path / 'letter.xsl'
+    letter.write_text(u'<xsl:stylesheet>')
+    assert compile_xslt(str(letter)) is not None
+
+
+def test_missing_file(tmp_path):
+    missing = str(tmp_path / 'missing.xsl')
+    assert compile_xslt(missing).startswith('Could not read the file')
+    assert list(validate_files([missing])) == [missing]